@@ -120,6 +120,39 @@ REST_FRAMEWORK = {
 
 MAX_WORKERS = 4
 BATCH_SIZE = 10
+# Очередь задач в базе данных и обработчики manage.py dic_worker: число ожидающих задач на пользователя
+# и во всей очереди, прокси, которым доверяется X-Forwarded-For (имена хостов или адреса через запятую),
+# число процессов обработчика, период опроса, период сигнала обработчика, время без сигнала,
+# после которого задача возвращается в очередь, и число попыток обработки
+DIC_QUEUE_LIMIT = int(os.getenv("DIC_QUEUE_LIMIT", "20"))
+DIC_QUEUE_GLOBAL_LIMIT = int(os.getenv("DIC_QUEUE_GLOBAL_LIMIT", "200"))
+DIC_TRUSTED_PROXIES = [host.strip() for host in os.getenv("DIC_TRUSTED_PROXIES", "frontend").split(",") if host.strip()]
+DIC_WORKER_PROCESSES = int(os.getenv("DIC_WORKER_PROCESSES", "1"))
+DIC_WORKER_POLL_SECONDS = float(os.getenv("DIC_WORKER_POLL_SECONDS", "2"))
+DIC_HEARTBEAT_SECONDS = float(os.getenv("DIC_HEARTBEAT_SECONDS", "10"))
+DIC_HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("DIC_HEARTBEAT_TIMEOUT_SECONDS", "60"))
+DIC_MAX_ATTEMPTS = int(os.getenv("DIC_MAX_ATTEMPTS", "3"))
+# Бюджет памяти на анализ: при превышении изображения обрабатываются по тайлам из memmap-файлов
+DIC_MEMORY_BUDGET_MB = int(os.getenv("DIC_MEMORY_BUDGET_MB", "2048"))
+# Наибольший размер загружаемого изображения в пикселях (Image.MAX_IMAGE_PIXELS)
+DIC_MAX_IMAGE_PIXELS = int(os.getenv("DIC_MAX_IMAGE_PIXELS", "1000000000"))
+# Прогресс задач в кэше: период публикации, период записи поля progress в базу,
+# время хранения записи и наибольшая длительность одного потока прогресса (SSE)
+DIC_PROGRESS_SECONDS = float(os.getenv("DIC_PROGRESS_SECONDS", "1"))
+DIC_PROGRESS_DB_SECONDS = float(os.getenv("DIC_PROGRESS_DB_SECONDS", "10"))
+DIC_PROGRESS_TTL_SECONDS = int(os.getenv("DIC_PROGRESS_TTL_SECONDS", "86400"))
+DIC_PROGRESS_STREAM_SECONDS = float(os.getenv("DIC_PROGRESS_STREAM_SECONDS", "600"))
+# Период записи контрольной точки расчета поля: повторная обработка задачи продолжается с нее
+DIC_CHECKPOINT_SECONDS = float(os.getenv("DIC_CHECKPOINT_SECONDS", "60"))
+# Точность расчета и хранения полей: float32 (быстрее, вдвое меньше памяти) или float64
+DIC_PRECISION = os.getenv("DIC_PRECISION", "float32")
+# Кэш результатов по содержимому изображений и параметрам, размер ограничен
+DIC_RESULT_CACHE_DIR = os.getenv("DIC_RESULT_CACHE_DIR", str(MEDIA_ROOT / "result_cache"))
+DIC_RESULT_CACHE_MAX_MB = int(os.getenv("DIC_RESULT_CACHE_MAX_MB", "1024"))
+# Кэш предвычисленных эталонных изображений: LRU в памяти процесса и на диске, размеры в МБ
+DIC_REFERENCE_CACHE_MEMORY_MB = int(os.getenv("DIC_REFERENCE_CACHE_MEMORY_MB", "1024"))
+DIC_REFERENCE_CACHE_DIR = os.getenv("DIC_REFERENCE_CACHE_DIR", str(MEDIA_ROOT / "reference_cache"))
+DIC_REFERENCE_CACHE_MAX_MB = int(os.getenv("DIC_REFERENCE_CACHE_MAX_MB", "2048"))
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -166,7 +199,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://127.0.0.1:6379/1",
+        "LOCATION": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/1"),
         "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
     }
 }
@@ -21,9 +21,21 @@ class AsyncDigitalImageCorrelation:
     Асинхронный класс для выполнения Digital Image Correlation (DIC) между двумя изображениями.
     """
 
-    def __init__(self, subset_size: int = 25, step: int = 12, max_iter: int = 35, output_dir: str = "results"):
+    def __init__(
+        self,
+        subset_size: int = 25,
+        step: int = 12,
+        max_iter: int = 35,
+        output_dir: str = "results",
+        solver: str = "lbfgsb",
+        n_workers: int = 1,
+        reference_cache=None,
+        precision: str = "float32",
+    ):
         """
         Инициализация асинхронного DIC алгоритма.
+        reference_cache - общий кэш предвычисленных эталонов (ReferenceCache).
+        precision - тип вычислений и полей: "float32" или "float64".
         """
         self.subset_size = subset_size if subset_size % 2 == 1 else subset_size + 1
         if self.subset_size < 21:
@@ -36,6 +48,10 @@ class AsyncDigitalImageCorrelation:
         self.max_iter = max_iter
         self.tolerance = 1e-6
         self.output_dir = output_dir
+        self.solver = solver
+        self.n_workers = n_workers
+        self.reference_cache = reference_cache
+        self.precision = precision
 
         Path(output_dir).mkdir(parents=True, exist_ok=True)
 
@@ -43,7 +59,15 @@ class AsyncDigitalImageCorrelation:
         """
         Асинхронное вычисление поля смещений с оптимальными параметрами.
         """
-        dic = DigitalImageCorrelation(self.subset_size, self.step, self.max_iter)
+        dic = DigitalImageCorrelation(
+            self.subset_size,
+            self.step,
+            self.max_iter,
+            self.solver,
+            n_workers=self.n_workers,
+            reference_cache=self.reference_cache,
+            precision=self.precision,
+        )
 
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(thread_pool, dic.compute_displacement_field, img1, img2)
@@ -56,7 +80,7 @@ class AsyncDigitalImageCorrelation:
         Оптимальный порог корреляции для средних окон.
         """
         loop = asyncio.get_event_loop()
-        dic = DigitalImageCorrelation(self.subset_size, self.step, self.max_iter)
+        dic = DigitalImageCorrelation(self.subset_size, self.step, self.max_iter, self.solver, precision=self.precision)
         return await loop.run_in_executor(thread_pool, dic.post_process_displacements, U, V, C, min_correlation)
 
     async def save_results_json(self, test_id: str, results: Dict[str, Any]) -> str:
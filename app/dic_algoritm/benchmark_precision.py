@@ -0,0 +1,88 @@
+import argparse
+import time
+
+import numpy as np
+
+from dic_algorithm import DigitalImageCorrelation, ReferenceContext
+from synthetic import synthetic_pair
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(precision: str, reference, deformed, truth, subset_size: int, step: int, solver: str) -> dict:
+    """
+    Время этапов и ошибка смещений для одной точности.
+    """
+    dic = DigitalImageCorrelation(subset_size=subset_size, step=step, solver=solver, precision=precision)
+    img1, img2 = dic.preprocess_images(reference, deformed)
+    x_coords, y_coords = dic._build_grid(img1)
+    grid_x, grid_y = np.meshgrid(x_coords, y_coords)
+
+    timings = {}
+    (guess_u, guess_v, _), timings["integer_search"] = timed(
+        dic.integer_pixel_search, img1, img2, grid_x.ravel(), grid_y.ravel()
+    )
+    context, timings["reference"] = timed(ReferenceContext, dic, img1)
+    _, timings["reference_grid"] = timed(context.precompute_grid, x_coords, y_coords)
+    _, timings["zncc_batch"] = timed(
+        dic.zncc_batch, img1, img2, grid_x.ravel(), grid_y.ravel(), np.stack([guess_u, guess_v], axis=1), context
+    )
+    (U, V, C, *_), timings["field"] = timed(dic.compute_displacement_field, reference, deformed)
+    _, timings["post_process"] = timed(dic.post_process_displacements, U, V, C)
+
+    true_u, true_v = truth(x_coords, y_coords)
+    # Краевые точки исключаются: подрегион выходит за отраженную границу деформированного изображения
+    inner = (slice(2, -2), slice(2, -2))
+    error = np.hypot(U[inner] - true_u[inner], V[inner] - true_v[inner]).astype(np.float64)
+    error = error[np.isfinite(error)]
+
+    return {
+        "dtype": str(U.dtype),
+        "points": int(U.size),
+        "timings": timings,
+        "rms_error": float(np.sqrt(np.mean(error**2))),
+        "max_error": float(np.max(error)),
+        "fields_bytes": int(U.nbytes + V.nbytes + C.nbytes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение скорости и точности DIC в float32 и float64")
+    parser.add_argument("--size", type=int, default=400, help="размер синтетического изображения")
+    parser.add_argument("--subset-size", type=int, default=25)
+    parser.add_argument("--step", type=int, default=10)
+    parser.add_argument("--solver", choices=DigitalImageCorrelation.SOLVERS, default="icgn")
+    parser.add_argument("--shift", type=float, default=2.35, help="сдвиг u в пикселях")
+    parser.add_argument("--strain", type=float, default=0.002, help="равноосная деформация")
+    args = parser.parse_args()
+
+    reference, deformed, truth = synthetic_pair(args.size, args.shift, args.strain)
+    for precision in DigitalImageCorrelation.PRECISIONS:
+        # Прогрев: первый расчет в процессе заметно медленнее из-за загрузки библиотек
+        warmup = DigitalImageCorrelation(args.subset_size, args.step, solver=args.solver, precision=precision)
+        warmup.compute_displacement_field(reference[:96, :96], deformed[:96, :96])
+
+    results = {
+        precision: run(precision, reference, deformed, truth, args.subset_size, args.step, args.solver)
+        for precision in DigitalImageCorrelation.PRECISIONS
+    }
+
+    single, double = results["float32"], results["float64"]
+    print(f"Изображение {args.size}x{args.size}, точек {single['points']}, решатель {args.solver}")
+    print(f"{'этап':<16}{'float64, с':>12}{'float32, с':>12}{'ускорение':>11}")
+    for stage in double["timings"]:
+        fast, slow = single["timings"][stage], double["timings"][stage]
+        print(f"{stage:<16}{slow:>12.3f}{fast:>12.3f}{slow / max(fast, 1e-9):>10.2f}x")
+
+    print(f"{'':<16}{'float64':>12}{'float32':>12}")
+    print(f"{'RMS ошибка, px':<16}{double['rms_error']:>12.5f}{single['rms_error']:>12.5f}")
+    print(f"{'макс. ошибка, px':<16}{double['max_error']:>12.5f}{single['max_error']:>12.5f}")
+    print(f"{'поля U, V, C, Б':<16}{double['fields_bytes']:>12}{single['fields_bytes']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,80 @@
+import hashlib
+import heapq
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft
 from scipy.optimize import minimize
-from scipy.ndimage import median_filter
-from typing import Tuple
+from scipy.ndimage import binary_dilation, convolve, map_coordinates, median_filter, spline_filter
+from typing import Callable, Dict, Iterable, Iterator, Tuple
 import random
 import logging
 
 logger = logging.getLogger(__name__)
 
+_worker_state = {}
+
+
+class DICCancelled(Exception):
+    """Расчет поля прерван токеном отмены."""
+
+
+def _sample_subsets(img: np.ndarray, centers_x, centers_y, subset_size: int, dtype) -> np.ndarray:
+    """
+    Пакетная билинейная выборка подрегионов для набора центров.
+    Возвращает массив формы (N, subset_size, subset_size); значения совпадают
+    с bilinear_interpolation, включая нули за пределами изображения.
+    Координаты считаются в float64, веса и значения - в dtype.
+    """
+    centers_x = np.atleast_1d(np.asarray(centers_x, dtype=np.float64))
+    centers_y = np.atleast_1d(np.asarray(centers_y, dtype=np.float64))
+
+    offsets = np.arange(subset_size) - subset_size // 2
+    xs = centers_x[:, None] + offsets
+    ys = centers_y[:, None] + offsets
+
+    x0 = np.floor(xs)
+    y0 = np.floor(ys)
+    dx = (xs - x0).astype(dtype)
+    dy = (ys - y0).astype(dtype)
+    x0 = x0.astype(np.intp)
+    y0 = y0.astype(np.intp)
+
+    height, width = img.shape
+    valid_x = (x0 >= 0) & (x0 + 1 < width)
+    valid_y = (y0 >= 0) & (y0 + 1 < height)
+
+    x0 = np.clip(x0, 0, max(width - 2, 0))
+    y0 = np.clip(y0, 0, max(height - 2, 0))
+    x1 = x0 + 1
+    y1 = y0 + 1
+
+    rows0 = y0[:, :, None]
+    rows1 = y1[:, :, None]
+    cols0 = x0[:, None, :]
+    cols1 = x1[:, None, :]
+    dx = dx[:, None, :]
+    dy = dy[:, :, None]
+
+    subsets = (
+        img[rows0, cols0] * (1 - dx) * (1 - dy)
+        + img[rows0, cols1] * dx * (1 - dy)
+        + img[rows1, cols0] * (1 - dx) * dy
+        + img[rows1, cols1] * dx * dy
+    )
+
+    valid = valid_y[:, :, None] & valid_x[:, None, :]
+    subsets[~valid] = 0.0
+
+    return subsets
+
 
 class DigitalImageCorrelation:
     """
@@ -14,37 +82,350 @@ class DigitalImageCorrelation:
     Оптимизирован для средних окон (21-31 пикселя).
     """
 
-    def __init__(self, subset_size: int = 25, step: int = 12, max_iter: int = 35):
+    SOLVERS = ("lbfgsb", "icgn")
+    SCANS = ("raster", "reliability")
+    SHAPE_FUNCTIONS = ("rigid", "affine")
+    GRADIENT_KEYS = ("du_dx", "du_dy", "dv_dx", "dv_dy")
+    REFERENCE_MODES = ("fixed", "incremental")
+    PRECISIONS = ("float32", "float64")
+    BYTES_PER_TILE_PIXEL = 72
+    ADAPTIVE_GRADIENT = 0.02
+    ADAPTIVE_MIN_CORRELATION = 0.8
+    PYRAMID_REFINE_RADIUS = 2
+    SUBSET_SIZE_LIMITS = (21, 31)
+    AUTO_SUBSET_SIZE_LIMITS = (11, 41)
+    AUTO_TARGET_ERROR = 0.01
+    AUTO_PERCENTILE = 75
+    AUTO_SAMPLE_SIZE = 2048
+    NOISE_FLOOR = 1.0 / (255 * np.sqrt(12))
+    MEDIAN_TEST_EPSILON = 0.1
+    MIN_FILL_NEIGHBOURS = 3
+    FILL_ITERATIONS = 2
+    # Оптимальные сети сравнений для медиан окрестности 3x3 (8 соседей и 9 точек, Knuth, TAOCP 5.3.4)
+    SORTING_NETWORKS = {
+        8: ((0, 2), (1, 3), (4, 6), (5, 7), (0, 4), (1, 5), (2, 6), (3, 7), (0, 1), (2, 3), (4, 5), (6, 7),
+            (2, 4), (3, 5), (1, 4), (3, 6), (1, 2), (3, 4), (5, 6)),
+        9: ((0, 3), (1, 7), (2, 5), (4, 8), (0, 7), (2, 4), (3, 8), (5, 6), (0, 2), (1, 3), (4, 5), (7, 8),
+            (1, 4), (3, 6), (5, 7), (0, 1), (2, 4), (3, 5), (6, 8), (2, 3), (4, 5), (6, 7), (1, 2), (3, 4), (5, 6)),
+    }
+    MEDIAN_BLOCK_POINTS = 65536
+    PROGRESS_INTERVAL = 0.5
+    CANCEL_POLL_SECONDS = 0.2
+    CHECKPOINT_SAMPLE_PIXELS = 1_000_000
+
+    def __init__(
+        self,
+        subset_size: int = 25,
+        step: int = 12,
+        max_iter: int = 35,
+        solver: str = "lbfgsb",
+        search_radius: int = 15,
+        scan: str = "raster",
+        n_workers: int = 1,
+        tile_size: int = 16,
+        pyramid_levels: int = 1,
+        shape_function: str = "rigid",
+        adaptive_levels: int = 0,
+        roi_mask: np.ndarray = None,
+        min_texture: float = 0.01,
+        progress_callback: Callable[[int, int], None] = None,
+        cancel_token=None,
+        reference_cache: "ReferenceCache" = None,
+        precision: str = "float32",
+        checkpoint: "FieldCheckpoint" = None,
+    ):
         """
         Инициализация DIC алгоритма с оптимальными параметрами для средних окон.
+        solver: "lbfgsb" (scipy L-BFGS-B по ZNCC) или "icgn" (обратно-композиционный Гаусс-Ньютон).
+        search_radius: радиус целочисленного FFT-поиска начального приближения (0 - отключить).
+        scan: "raster" (построчный обход) или "reliability" (распространение от надежных точек).
+        n_workers: число процессов для расчета поля (1 - последовательный расчет).
+        tile_size: размер тайла сетки в точках; поле решается по тайлам при любом n_workers.
+        pyramid_levels: число уровней пирамиды изображений (1 - без пирамиды).
+        shape_function: "rigid" (сдвиг u, v) или "affine" (u, v и градиенты смещений).
+        adaptive_levels: число уровней адаптивного сгущения сетки (0 - равномерная сетка);
+        начальная сетка имеет шаг step * 2^adaptive_levels.
+        roi_mask: бинарная маска области интереса размером с изображение (может быть np.memmap:
+        читаются только узлы сетки); точки сетки вне маски не рассчитываются.
+        min_texture: минимальное СКО интенсивности подрегиона эталона,
+        подрегионы с более слабой текстурой не рассчитываются (0 - отключить).
+        progress_callback: функция (обработано точек, всего точек), вызывается
+        не чаще PROGRESS_INTERVAL секунд.
+        cancel_token: объект с методом is_set() (например threading.Event); проверяется
+        между точками и тайлами, при отмене расчет прерывается исключением DICCancelled.
+        reference_cache: общий кэш предвычисленных эталонов (ReferenceCache).
+        precision: "float32" или "float64" - тип изображений, подрегионов, корреляции
+        и полей U, V, C; параметры решателя, таблицы сумм и целевая функция L-BFGS-B
+        всегда float64.
+        checkpoint: контрольная точка (FieldCheckpoint) расчета поля: решенные тайлы
+        периодически сохраняются, повторный расчет продолжается с них.
         """
-        self.subset_size = subset_size if subset_size % 2 == 1 else subset_size + 1
-        if self.subset_size < 21:
-            self.subset_size = 21
-        elif self.subset_size > 31:
-            self.subset_size = 31
+        if solver not in self.SOLVERS:
+            raise ValueError(f"Неизвестный решатель: {solver}. Доступные: {', '.join(self.SOLVERS)}")
+        if scan not in self.SCANS:
+            raise ValueError(f"Неизвестный режим обхода: {scan}. Доступные: {', '.join(self.SCANS)}")
+        if shape_function not in self.SHAPE_FUNCTIONS:
+            raise ValueError(
+                f"Неизвестная функция формы: {shape_function}. Доступные: {', '.join(self.SHAPE_FUNCTIONS)}"
+            )
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Неизвестная точность: {precision}. Доступные: {', '.join(self.PRECISIONS)}")
 
-        self.half_subset = self.subset_size // 2
+        self._set_subset_size(subset_size, self.SUBSET_SIZE_LIMITS)
         self.step = step
         self.max_iter = max_iter
         self.tolerance = 1e-6
+        self.solver = solver
+        self.search_radius = max(int(search_radius), 0)
+        self.scan = scan
+        self.n_workers = max(int(n_workers), 1)
+        self.tile_size = max(int(tile_size), 1)
+        self.pyramid_levels = max(int(pyramid_levels), 1)
+        self.shape_function = shape_function
+        self.n_params = 6 if shape_function == "affine" else 2
+        self.adaptive_levels = max(int(adaptive_levels), 0)
+        self.roi_mask = None if roi_mask is None else np.asarray(roi_mask, dtype=bool)
+        self.min_texture = max(float(min_texture), 0.0)
+        self.progress_callback = progress_callback
+        self.cancel_token = cancel_token
+        self.reference_cache = reference_cache
+        self.precision = precision
+        self.dtype = np.dtype(precision)
+        self.checkpoint = checkpoint
+        self._progress_done = 0
+        self._progress_total = 0
+        self._progress_muted = 0
+        self._progress_reported_at = 0.0
+        self._spline_source = None
+        self._spline = None
 
         np.random.seed(42)
         random.seed(42)
 
+    def __getstate__(self):
+        """
+        Колбэк, токен отмены, кэш эталонов, контрольная точка и коэффициенты сплайна
+        не передаются в процессы пула: процессы проверяют общий флаг отмены, эталон
+        и сплайн получают через разделяемую память, тайлы сохраняет основной процесс.
+        """
+        state = self.__dict__.copy()
+        state["progress_callback"] = None
+        state["cancel_token"] = None
+        state["reference_cache"] = None
+        state["checkpoint"] = None
+        state["_spline_source"] = None
+        state["_spline"] = None
+        return state
+
+    def _reference_for(
+        self, img1: np.ndarray, build: bool = True, grid: bool = True
+    ) -> Tuple[np.ndarray, "ReferenceContext"]:
+        """
+        Предобработанный эталон и его контекст; при заданном reference_cache берутся из кэша.
+        build=False - отсутствующий в кэше эталон строится без данных сетки и в кэш не попадает.
+        grid=False - эталон строится и сохраняется в кэш без предвычисления сетки.
+        """
+        reference = None
+        if self.reference_cache is not None:
+            if build:
+                reference = self.reference_cache.get(self, img1, grid=grid)
+            else:
+                reference = self.reference_cache.peek(self, img1)
+
+        if reference is None:
+            img1 = self.preprocess_image(img1)
+            return img1, ReferenceContext(self, img1)
+
+        return reference.image, reference
+
+    def _check_cancelled(self) -> None:
+        """
+        Прерывание расчета, если токен отмены установлен.
+        """
+        if self.cancel_token is not None and self.cancel_token.is_set():
+            raise DICCancelled("Расчет отменен")
+
+    def _begin_progress(self, total: int) -> None:
+        """
+        Начало отсчета прогресса расчета поля из total точек.
+        """
+        self._progress_done = 0
+        self._progress_total = int(total)
+        self._progress_reported_at = 0.0
+        self._check_cancelled()
+
+    def _tick(self, count: int = 1) -> None:
+        """
+        Отметка обработанных точек: проверка отмены и вызов progress_callback.
+        """
+        self._check_cancelled()
+        if self._progress_muted:
+            return
+
+        self._progress_done += count
+        if self.progress_callback is None:
+            return
+
+        now = time.monotonic()
+        if now - self._progress_reported_at >= self.PROGRESS_INTERVAL:
+            self._progress_reported_at = now
+            self.progress_callback(min(self._progress_done, self._progress_total), self._progress_total)
+
+    def _end_progress(self) -> None:
+        """
+        Завершение отсчета прогресса (точки без текстуры не отмечаются, поэтому итог сообщается явно).
+        """
+        if self.progress_callback is not None:
+            self.progress_callback(self._progress_total, self._progress_total)
+
+    def _checkpoint_key(self, img1: np.ndarray, img2: np.ndarray, active: np.ndarray) -> str:
+        """
+        Ключ контрольной точки: выборка пикселей обоих изображений (не более
+        CHECKPOINT_SAMPLE_PIXELS), маска рассчитываемых точек и параметры решения.
+        """
+        digest = hashlib.sha256()
+        for img in (img1, img2):
+            stride = max(int(np.sqrt(img.size / self.CHECKPOINT_SAMPLE_PIXELS)), 1)
+            digest.update(f"{img.shape}|{img.dtype.str}|".encode())
+            digest.update(np.ascontiguousarray(img[::stride, ::stride]).view(np.uint8).ravel())
+        digest.update(f"{active.shape}|".encode())
+        digest.update(np.packbits(active).tobytes())
+        parameters = (
+            self.subset_size, self.step, self.max_iter, self.tolerance, self.solver, self.scan,
+            self.search_radius, self.pyramid_levels, self.shape_function, self.adaptive_levels,
+            self.min_texture, self.precision,
+        )
+        digest.update(repr(parameters).encode())
+        return digest.hexdigest()
+
+    def _resume(self, key: str, P: np.ndarray, C: np.ndarray, active: np.ndarray) -> np.ndarray:
+        """
+        Восстановление P и C из контрольной точки. Возвращает маску решенных точек
+        (все False, если контрольной точки нет или она от другого расчета).
+        """
+        solved = np.zeros(C.shape, dtype=bool)
+        restored = self.checkpoint.load(key, C.shape) if self.checkpoint is not None else None
+        if restored is None:
+            return solved
+
+        P[:], C[:], solved[:] = restored
+        logger.info(
+            f"Расчет продолжен с контрольной точки: решено {int(np.sum(solved & active))} из {int(np.sum(active))} точек"
+        )
+        return solved
+
+    def _set_subset_size(self, subset_size: int, limits: Tuple[int, int]) -> None:
+        """
+        Нечетный размер подрегиона в пределах limits.
+        """
+        self.subset_size = int(subset_size) if int(subset_size) % 2 == 1 else int(subset_size) + 1
+        self.subset_size = min(max(self.subset_size, limits[0]), limits[1])
+        self.half_subset = self.subset_size // 2
+
+    def configure_from_speckle(self, img1: np.ndarray, target_error: float = None) -> Dict:
+        """
+        Автоматический выбор размера подрегиона и шага по качеству спекл-картины эталона.
+        Ожидаемая шумовая ошибка смещения подрегиона оценивается по SSSIG (сумме квадратов
+        градиентов интенсивности): sigma_u = sqrt(2) * sigma_noise / sqrt(SSSIG).
+        Выбирается наименьший подрегион, для которого AUTO_PERCENTILE-процентиль ошибки
+        по текстурированным подрегионам не превышает target_error пикселя; шаг - половина
+        подрегиона (наибольший шаг, при котором соседние подрегионы перекрываются).
+        Для больших изображений оценка ведется по центральному фрагменту AUTO_SAMPLE_SIZE.
+        """
+        target_error = self.AUTO_TARGET_ERROR if target_error is None else float(target_error)
+
+        height, width = img1.shape[:2]
+        top = max((height - self.AUTO_SAMPLE_SIZE) // 2, 0)
+        left = max((width - self.AUTO_SAMPLE_SIZE) // 2, 0)
+        sample = self.preprocess_image(
+            np.asarray(img1[top : top + self.AUTO_SAMPLE_SIZE, left : left + self.AUTO_SAMPLE_SIZE])
+        ).astype(np.float64)
+
+        noise = self._estimate_noise(sample)
+        grad_x = np.zeros_like(sample)
+        grad_y = np.zeros_like(sample)
+        grad_x[:, 1:-1] = (sample[:, 2:] - sample[:, :-2]) / 2.0
+        grad_y[1:-1, :] = (sample[2:, :] - sample[:-2, :]) / 2.0
+
+        integral_x = ReferenceContext._integral(grad_x**2)
+        integral_y = ReferenceContext._integral(grad_y**2)
+        integral = ReferenceContext._integral(sample)
+        integral_sq = ReferenceContext._integral(sample**2)
+
+        def box(table, y0, x0, size):
+            return table[y0 + size, x0 + size] - table[y0, x0 + size] - table[y0 + size, x0] + table[y0, x0]
+
+        low, high = self.AUTO_SUBSET_SIZE_LIMITS
+        chosen, error = high, np.inf
+        for size in range(low | 1, high + 1, 2):
+            if size > min(sample.shape):
+                break
+
+            corners_y, corners_x = np.meshgrid(
+                np.arange(0, sample.shape[0] - size + 1, max(size // 2, 1)),
+                np.arange(0, sample.shape[1] - size + 1, max(size // 2, 1)),
+                indexing="ij",
+            )
+            sssig = np.minimum(box(integral_x, corners_y, corners_x, size), box(integral_y, corners_y, corners_x, size))
+            sums = box(integral, corners_y, corners_x, size)
+            variance = box(integral_sq, corners_y, corners_x, size) / size**2 - (sums / size**2) ** 2
+            textured = np.sqrt(np.clip(variance, 0.0, None)) >= self.min_texture
+            if not textured.any():
+                continue
+
+            error = float(np.percentile(np.sqrt(2.0) * noise / np.sqrt(sssig[textured] + 1e-20), self.AUTO_PERCENTILE))
+            if error <= target_error:
+                chosen = size
+                break
+
+        self._set_subset_size(chosen, self.AUTO_SUBSET_SIZE_LIMITS)
+        self.step = max(self.subset_size // 2, 1)
+        logger.info(
+            f"Автоподбор параметров: подрегион {self.subset_size}, шаг {self.step}, "
+            f"шум {noise:.4f}, ожидаемая ошибка {error:.4f} px"
+        )
+
+        return {
+            "subset_size": self.subset_size,
+            "step": self.step,
+            "noise_std": noise,
+            "expected_error": error,
+            "target_error": target_error,
+        }
+
+    def _estimate_noise(self, img: np.ndarray) -> float:
+        """
+        Оценка СКО шума изображения (метод Immerkaer) с нижней границей шума квантования 8 бит.
+        """
+        height, width = img.shape
+        if height < 3 or width < 3:
+            return self.NOISE_FLOOR
+
+        kernel = np.array([[1.0, -2.0, 1.0], [-2.0, 4.0, -2.0], [1.0, -2.0, 1.0]])
+        response = np.abs(convolve(img, kernel)[1:-1, 1:-1])
+        noise = np.sqrt(np.pi / 2.0) * np.sum(response) / (6.0 * (width - 2) * (height - 2))
+
+        return max(float(noise), self.NOISE_FLOOR)
+
     def preprocess_images(self, img1: np.ndarray, img2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
         Синхронная предварительная обработка изображений.
         """
-        if len(img1.shape) == 3:
-            img1 = np.mean(img1, axis=2)
-        if len(img2.shape) == 3:
-            img2 = np.mean(img2, axis=2)
+        return self.preprocess_image(img1), self.preprocess_image(img2)
 
-        img1 = (img1 - img1.min()) / (img1.max() - img1.min() + 1e-10)
-        img2 = (img2 - img2.min()) / (img2.max() - img2.min() + 1e-10)
+    def preprocess_image(self, img: np.ndarray) -> np.ndarray:
+        """
+        Предварительная обработка одного изображения: оттенки серого и нормировка в [0, 1]
+        в типе precision.
+        """
+        if len(img.shape) == 3:
+            img = np.mean(img, axis=2, dtype=self.dtype)
 
-        return img1.astype(np.float32), img2.astype(np.float32)
+        img = np.asarray(img, dtype=self.dtype)
+        low = img.min()
+        scale = self.dtype.type(1.0 / (img.max() - low + 1e-10))
+
+        return (img - low) * scale
 
     def zero_mean_normalized_cross_correlation(self, subset1: np.ndarray, subset2: np.ndarray) -> float:
         """
@@ -58,6 +439,64 @@ class DigitalImageCorrelation:
 
         return numerator / (denominator + 1e-10)
 
+    def zncc_with_reference(self, ref_zero: np.ndarray, ref_norm: float, subset: np.ndarray) -> float:
+        """
+        ZNCC с предвычисленным эталоном: ref_zero - подрегион без среднего, ref_norm - его норма.
+        Так как сумма ref_zero равна нулю, центрирование деформированного подрегиона
+        в числителе не требуется.
+        """
+        n_pixels = subset.size
+        subset_sum = np.sum(subset)
+        numerator = np.sum(ref_zero * subset)
+        variance = max(np.sum(subset * subset) - subset_sum * subset_sum / n_pixels, 0.0)
+
+        return numerator / (ref_norm * np.sqrt(variance) + 1e-10)
+
+    def zncc_batch(
+        self,
+        img1: np.ndarray,
+        img2: np.ndarray,
+        centers_x,
+        centers_y,
+        displacements: np.ndarray,
+        reference: "ReferenceContext" = None,
+        batch_size: int = 1024,
+    ) -> np.ndarray:
+        """
+        ZNCC для N точек сразу: displacements - массив (N, 2) пробных смещений (dx, dy).
+        Деформированные подрегионы собираются в стек (N, subset_size, subset_size),
+        корреляции считаются векторно. Возвращает массив (N,).
+        """
+        if reference is None:
+            reference = ReferenceContext(self, img1)
+
+        centers_x = np.atleast_1d(np.asarray(centers_x))
+        centers_y = np.atleast_1d(np.asarray(centers_y))
+        displacements = np.asarray(displacements, dtype=np.float64).reshape(-1, 2)
+
+        correlation = np.zeros(len(centers_x), dtype=self.dtype)
+        for start in range(0, len(centers_x), batch_size):
+            batch = slice(start, start + batch_size)
+            ref_zero, ref_norm = reference.subsets(centers_x[batch], centers_y[batch])
+            subsets_def = self.sample_subsets(
+                img2, centers_x[batch] + displacements[batch, 0], centers_y[batch] + displacements[batch, 1]
+            )
+            correlation[batch] = self._zncc_stack(ref_zero, ref_norm, subsets_def)
+
+        return correlation
+
+    @staticmethod
+    def _zncc_stack(ref_zero: np.ndarray, ref_norm: np.ndarray, subsets: np.ndarray) -> np.ndarray:
+        """
+        Векторная ZNCC для стека подрегионов с предвычисленным эталоном.
+        """
+        n_pixels = subsets.shape[1] * subsets.shape[2]
+        sums = np.sum(subsets, axis=(1, 2))
+        numerator = np.einsum("nij,nij->n", ref_zero, subsets)
+        variance = np.clip(np.einsum("nij,nij->n", subsets, subsets) - sums * sums / n_pixels, 0.0, None)
+
+        return numerator / (ref_norm * np.sqrt(variance) + 1e-10)
+
     def bilinear_interpolation(self, img: np.ndarray, x: float, y: float) -> float:
         """
         Билинейная интерполяция для получения значения пикселя в нецелых координатах.
@@ -82,27 +521,94 @@ class DigitalImageCorrelation:
 
         return value
 
-    def get_subset_interpolated(self, img: np.ndarray, center_x: float, center_y: float) -> np.ndarray:
+    def sample_subsets(self, img: np.ndarray, centers_x, centers_y, dtype=None) -> np.ndarray:
         """
-        Получает подрегион с билинейной интерполяцией.
-        Оптимизировано для средних окон.
+        Пакетная билинейная выборка подрегионов для набора центров (см. _sample_subsets);
+        значения в dtype (по умолчанию precision).
+        """
+        return _sample_subsets(img, centers_x, centers_y, self.subset_size, self.dtype if dtype is None else dtype)
+
+    def sample_points(self, img: np.ndarray, xs: np.ndarray, ys: np.ndarray, dtype=None) -> np.ndarray:
+        """
+        Билинейная выборка в произвольных точках (массивы xs, ys одной формы)
+        с теми же правилами, что bilinear_interpolation; значения в dtype (по умолчанию precision).
         """
-        subset = np.zeros((self.subset_size, self.subset_size))
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
 
-        y_indices = np.arange(self.subset_size) - self.half_subset
-        x_indices = np.arange(self.subset_size) - self.half_subset
+        x0 = np.floor(xs)
+        y0 = np.floor(ys)
+        dtype = self.dtype if dtype is None else dtype
+        dx = (xs - x0).astype(dtype)
+        dy = (ys - y0).astype(dtype)
+        x0 = x0.astype(np.intp)
+        y0 = y0.astype(np.intp)
 
-        for i in range(self.subset_size):
-            y = center_y + y_indices[i]
-            if y < 0 or y >= img.shape[0]:
-                continue
+        height, width = img.shape
+        valid = (x0 >= 0) & (x0 + 1 < width) & (y0 >= 0) & (y0 + 1 < height)
+
+        x0 = np.clip(x0, 0, max(width - 2, 0))
+        y0 = np.clip(y0, 0, max(height - 2, 0))
+        x1 = x0 + 1
+        y1 = y0 + 1
+
+        values = (
+            img[y0, x0] * (1 - dx) * (1 - dy)
+            + img[y0, x1] * dx * (1 - dy)
+            + img[y1, x0] * (1 - dx) * dy
+            + img[y1, x1] * dx * dy
+        )
+        values[~valid] = 0.0
+
+        return values
+
+    def warped_subset(self, img: np.ndarray, x: float, y: float, params: np.ndarray, dtype=None) -> np.ndarray:
+        """
+        Подрегион, деформированный функцией формы с параметрами
+        (u, v[, du/dx, du/dy, dv/dx, dv/dy]) относительно центра (x, y).
+        """
+        if len(params) == 2 or not np.any(params[2:]):
+            return self.sample_subsets(img, x + params[0], y + params[1], dtype)[0]
 
-            for j in range(self.subset_size):
-                x = center_x + x_indices[j]
-                if 0 <= x < img.shape[1] and 0 <= y < img.shape[0]:
-                    subset[i, j] = self.bilinear_interpolation(img, x, y)
+        u, v, du_dx, du_dy, dv_dx, dv_dy = params[:6]
+        offsets = np.arange(self.subset_size) - self.half_subset
+        off_y, off_x = np.meshgrid(offsets, offsets, indexing="ij")
 
-        return subset
+        xs = x + u + off_x + du_dx * off_x + du_dy * off_y
+        ys = y + v + off_y + dv_dx * off_x + dv_dy * off_y
+
+        return self.sample_points(img, xs, ys, dtype)
+
+    def spline_coefficients(self, img: np.ndarray) -> np.ndarray:
+        """
+        Коэффициенты кубического B-сплайна изображения в dtype точности.
+        Коэффициенты последнего изображения хранятся до смены изображения.
+        """
+        if self._spline_source is not img:
+            self._spline = spline_filter(img, order=3, output=self.dtype, mode="mirror")
+            self._spline_source = img
+        return self._spline
+
+    def warped_subset_cubic(self, coefficients: np.ndarray, x: float, y: float, params: np.ndarray) -> np.ndarray:
+        """
+        Деформированный подрегион, интерполированный кубическим B-сплайном
+        по коэффициентам spline_coefficients.
+        """
+        u, v, du_dx, du_dy, dv_dx, dv_dy = params[:6]
+        offsets = np.arange(self.subset_size) - self.half_subset
+        off_y, off_x = np.meshgrid(offsets, offsets, indexing="ij")
+
+        xs = x + u + off_x + du_dx * off_x + du_dy * off_y
+        ys = y + v + off_y + dv_dx * off_x + dv_dy * off_y
+
+        return map_coordinates(coefficients, [ys, xs], order=3, prefilter=False, mode="mirror")
+
+    def get_subset_interpolated(self, img: np.ndarray, center_x: float, center_y: float) -> np.ndarray:
+        """
+        Получает подрегион с билинейной интерполяцией.
+        Оптимизировано для средних окон.
+        """
+        return self.sample_subsets(img, center_x, center_y)[0]
 
     def compute_displacement(
         self,
@@ -111,95 +617,1662 @@ class DigitalImageCorrelation:
         x: int,
         y: int,
         initial_guess: Tuple[float, float] = (0, 0),
+        reference: "ReferenceContext" = None,
     ) -> Tuple[float, float, float]:
         """
         Синхронное вычисление смещения для одной точки.
         Оптимизировано для быстрой сходимости с средними окнами.
+        reference: предвычисленный контекст эталонного изображения (строится при None).
+        """
+        params, correlation = self.solve_point(img1, img2, x, y, initial_guess, reference)
+
+        return params[0], params[1], correlation
+
+    def solve_point(
+        self,
+        img1: np.ndarray,
+        img2: np.ndarray,
+        x: int,
+        y: int,
+        initial_guess=(0, 0),
+        reference: "ReferenceContext" = None,
+    ) -> Tuple[np.ndarray, float]:
+        """
+        Решение для одной точки с полным вектором параметров функции формы
+        (u, v, du/dx, du/dy, dv/dx, dv/dy); для "rigid" градиенты равны нулю.
+        initial_guess содержит 2 или 6 параметров.
         """
-        subset_ref = self.get_subset_interpolated(img1, x, y)
+        if reference is None:
+            reference = ReferenceContext(self, img1)
+
+        guess = np.zeros(6)
+        initial = np.asarray(initial_guess, dtype=np.float64).ravel()[: self.n_params]
+        guess[: len(initial)] = initial
+
+        if self.solver == "icgn":
+            return self._solve_point_icgn(img1, img2, x, y, guess, reference)
+
+        return self._solve_point_lbfgsb(img1, img2, x, y, guess, reference)
+
+    def _solve_point_lbfgsb(self, img1, img2, x, y, guess: np.ndarray, reference) -> Tuple[np.ndarray, float]:
+        """
+        Максимизация ZNCC методом L-BFGS-B с численным градиентом.
+        Деформированный подрегион интерполируется в float64 при любой точности:
+        шум округления float32 сбивает конечные разности и линейный поиск.
+        """
+        ref_zero, ref_norm = reference.subset(x, y)
 
         def objective(params):
-            dx, dy = params
-            subset_def = self.get_subset_interpolated(img2, x + dx, y + dy)
-            correlation = self.zero_mean_normalized_cross_correlation(subset_ref, subset_def)
+            subset_def = self.warped_subset(img2, x, y, params, np.float64)
+            correlation = self.zncc_with_reference(ref_zero, ref_norm, subset_def)
             return -correlation
 
-        bounds = [(-15, 15), (-15, 15)]
+        bounds = [
+            (guess[0] - 15, guess[0] + 15),
+            (guess[1] - 15, guess[1] + 15),
+        ] + [(None, None)] * (self.n_params - 2)
 
         result = minimize(
             objective,
-            initial_guess,
+            guess[: self.n_params],
             method="L-BFGS-B",
             bounds=bounds,
             options={"maxiter": self.max_iter, "gtol": 1e-8, "ftol": 1e-8},
             tol=self.tolerance,
         )
 
-        dx, dy = result.x
+        params = np.zeros(6)
+        params[: self.n_params] = result.x
         correlation = -result.fun
 
+        return params, correlation
+
+    def _solve_point_icgn(self, img1, img2, x, y, guess: np.ndarray, reference) -> Tuple[np.ndarray, float]:
+        """
+        Inverse-compositional Gauss-Newton для функции формы нулевого или первого порядка.
+        Градиент и гессиан эталонного подрегиона считаются один раз на точку,
+        итерация требует только одной выборки деформированного подрегиона.
+        Деформированный подрегион интерполируется кубическим B-сплайном: при билинейной
+        интерполяции неподвижная точка IC-GN смещена относительно максимума ZNCC.
+        Поиск ограничен окном ±15 пикселей вокруг начального приближения.
+        """
+        coefficients = self.spline_coefficients(img2)
+        ref_zero, ref_norm = reference.subset(x, y)
+        grad_x, grad_y = reference.gradients(x, y)
+
+        if self.n_params == 6:
+            offsets = np.arange(self.subset_size) - self.half_subset
+            off_y, off_x = np.meshgrid(offsets, offsets, indexing="ij")
+            columns = [grad_x, grad_y, grad_x * off_x, grad_x * off_y, grad_y * off_x, grad_y * off_y]
+        else:
+            columns = [grad_x, grad_y]
+
+        jacobian = np.stack([column.ravel() for column in columns], axis=1)
+        hessian = (jacobian.T @ jacobian).astype(np.float64)
+
+        params = guess.copy()
+        lower = params[:2] - 15.0
+        upper = params[:2] + 15.0
+
+        if ref_norm < 1e-10 or np.linalg.cond(hessian) > 1e12:
+            subset_def = self.warped_subset_cubic(coefficients, x, y, params)
+            return params, self.zncc_with_reference(ref_zero, ref_norm, subset_def)
+
+        hessian_inv = np.linalg.inv(hessian)
+        scale = np.array([1.0, 1.0] + [float(self.half_subset)] * (self.n_params - 2))
+
+        for _ in range(self.max_iter):
+            subset_def = self.warped_subset_cubic(coefficients, x, y, params)
+            def_zero = subset_def - np.mean(subset_def)
+            def_norm = np.sqrt(np.sum(def_zero**2))
+            if def_norm < 1e-10:
+                break
+
+            residual = ref_zero - (ref_norm / def_norm) * def_zero
+            delta = np.zeros(6)
+            delta[: self.n_params] = -hessian_inv @ (jacobian.T @ residual.ravel())
+
+            params = self._compose_inverse(params, delta)
+            params[:2] = np.clip(params[:2], lower, upper)
+            if np.sqrt(np.sum((delta[: self.n_params] * scale) ** 2)) < self.tolerance:
+                break
+
+        subset_def = self.warped_subset_cubic(coefficients, x, y, params)
+        correlation = self.zncc_with_reference(ref_zero, ref_norm, subset_def)
+
+        return params, correlation
+
+    @staticmethod
+    def _warp_matrix(params: np.ndarray) -> np.ndarray:
+        u, v, du_dx, du_dy, dv_dx, dv_dy = params
+        return np.array([[1.0 + du_dx, du_dy, u], [dv_dx, 1.0 + dv_dy, v], [0.0, 0.0, 1.0]])
+
+    @classmethod
+    def _compose_inverse(cls, params: np.ndarray, delta: np.ndarray) -> np.ndarray:
+        """
+        Обновление IC-GN: W(p) <- W(p) o W(delta)^-1.
+        """
+        warp = cls._warp_matrix(params) @ np.linalg.inv(cls._warp_matrix(delta))
+        return np.array(
+            [warp[0, 2], warp[1, 2], warp[0, 0] - 1.0, warp[0, 1], warp[1, 0], warp[1, 1] - 1.0]
+        )
+
+    def integer_pixel_search(
+        self,
+        img1: np.ndarray,
+        img2: np.ndarray,
+        centers_x,
+        centers_y,
+        batch_size: int = 256,
+        guess_x=None,
+        guess_y=None,
+        radius: int = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Целочисленный поиск пика ZNCC для набора точек через FFT-корреляцию.
+        Подрегион эталона сравнивается со всеми сдвигами в окне ±radius
+        (по умолчанию search_radius) вокруг приближения guess_x/guess_y;
+        точки обрабатываются пакетами. Возвращает (dx, dy, correlation).
+        FFT (scipy.fft) выполняется в типе precision без повышения до float64.
+        """
+        centers_x = np.rint(np.atleast_1d(centers_x)).astype(np.intp)
+        centers_y = np.rint(np.atleast_1d(centers_y)).astype(np.intp)
+
+        height, width = img2.shape
+        if guess_x is None:
+            targets_x = centers_x
+        else:
+            targets_x = np.clip(centers_x + np.rint(np.atleast_1d(guess_x)).astype(np.intp), 0, width - 1)
+        if guess_y is None:
+            targets_y = centers_y
+        else:
+            targets_y = np.clip(centers_y + np.rint(np.atleast_1d(guess_y)).astype(np.intp), 0, height - 1)
+
+        radius = self.search_radius if radius is None else radius
+        window = self.subset_size + 2 * radius
+        shifts = 2 * radius + 1
+        n_pixels = self.subset_size**2
+
+        img2_padded = np.pad(img2.astype(self.dtype, copy=False), self.half_subset + radius, mode="constant")
+        window_offsets = np.arange(window)
+
+        dx = (targets_x - centers_x).astype(self.dtype)
+        dy = (targets_y - centers_y).astype(self.dtype)
+        correlation = np.zeros(len(centers_x), dtype=self.dtype)
+
+        for start in range(0, len(centers_x), batch_size):
+            cx = centers_x[start : start + batch_size]
+            cy = centers_y[start : start + batch_size]
+            tx = targets_x[start : start + batch_size]
+            ty = targets_y[start : start + batch_size]
+
+            ref = self.sample_subsets(img1, cx, cy)
+            ref = ref - np.mean(ref, axis=(1, 2), keepdims=True)
+            ref_norm = np.sqrt(np.sum(ref**2, axis=(1, 2)))
+
+            rows = (ty[:, None] + window_offsets)[:, :, None]
+            cols = (tx[:, None] + window_offsets)[:, None, :]
+            windows = img2_padded[rows, cols]
+
+            spectrum = fft.rfft2(windows) * np.conj(fft.rfft2(ref, s=(window, window)))
+            numerator = fft.irfft2(spectrum, s=(window, window))[:, :shifts, :shifts]
+
+            sums = self._box_sums(windows, self.subset_size)[:, :shifts, :shifts]
+            sums_sq = self._box_sums(windows**2, self.subset_size)[:, :shifts, :shifts]
+            variance = np.clip(sums_sq - sums**2 / n_pixels, 0.0, None)
+
+            zncc = numerator / (ref_norm[:, None, None] * np.sqrt(variance) + 1e-10)
+
+            peak = np.argmax(zncc.reshape(len(cx), -1), axis=1)
+            peak_corr = zncc.reshape(len(cx), -1)[np.arange(len(cx)), peak]
+            found = peak_corr > 0
+
+            batch = slice(start, start + len(cx))
+            dy[batch] += np.where(found, peak // shifts - radius, 0)
+            dx[batch] += np.where(found, peak % shifts - radius, 0)
+            correlation[batch] = np.where(found, peak_corr, 0.0)
+
         return dx, dy, correlation
 
-    def compute_displacement_field_sequential(self, img1: np.ndarray, img2: np.ndarray) -> Tuple:
+    @staticmethod
+    def _box_sums(stack: np.ndarray, size: int) -> np.ndarray:
+        """
+        Суммы по окнам size x size для стека изображений через интегральные изображения
+        (накопление в float64 независимо от типа стека).
+        """
+        integral = np.zeros((stack.shape[0], stack.shape[1] + 1, stack.shape[2] + 1))
+        integral[:, 1:, 1:] = np.cumsum(np.cumsum(stack, axis=1, dtype=np.float64), axis=2)
+
+        return (
+            integral[:, size:, size:]
+            - integral[:, :-size, size:]
+            - integral[:, size:, :-size]
+            + integral[:, :-size, :-size]
+        )
+
+    def compute_displacement_field_sequential(
+        self, img1: np.ndarray, img2: np.ndarray, return_gradients: bool = False
+    ) -> Tuple:
         """
         Синхронное вычисление поля смещений для всего изображения.
-        Последовательный расчет для детерминированности и стабильности.
+        Сетка решается по тем же тайлам, что и в параллельном расчете, поэтому результат
+        не зависит от n_workers. С контрольной точкой checkpoint решенные тайлы
+        периодически сохраняются, повторный расчет продолжается с них.
+        При return_gradients=True последним элементом добавляется словарь
+        градиентов смещений (du_dx, du_dy, dv_dx, dv_dy).
+        """
+        img1, reference = self._reference_for(img1)
+        img2 = self.preprocess_image(img2)
+
+        x_coords, y_coords = self._build_grid(img1)
+        active = self._roi_points(img1, x_coords, y_coords)
+        guess_u, guess_v, guess_c = self._initial_guesses(img1, img2, x_coords, y_coords, active)
+
+        P = np.zeros((len(y_coords), len(x_coords), 6), dtype=self.dtype)
+        C = np.zeros((len(y_coords), len(x_coords)), dtype=self.dtype)
+
+        key = self._checkpoint_key(img1, img2, active) if self.checkpoint is not None else None
+        solved = self._resume(key, P, C, active)
+        self._begin_progress(np.sum(active))
+        self._tick(int(np.sum(active & solved)))
+
+        for rows, cols in self._grid_tiles(x_coords, y_coords):
+            if solved[rows, cols].all():
+                continue
+
+            P[rows, cols], C[rows, cols] = self._solve_grid(
+                img1,
+                img2,
+                x_coords[cols],
+                y_coords[rows],
+                guess_u[rows, cols],
+                guess_v[rows, cols],
+                guess_c[rows, cols],
+                reference,
+                active[rows, cols],
+            )
+            solved[rows, cols] = True
+            if self.checkpoint is not None:
+                self.checkpoint.maybe_save(key, P, C, solved)
+
+        self._end_progress()
+        return self._field_result(P, C, x_coords, y_coords, img1, img2, return_gradients)
+
+    def _grid_tiles(self, x_coords, y_coords) -> list:
+        """
+        Разбиение сетки на тайлы tile_size x tile_size узлов: пары срезов (строки, столбцы).
+        """
+        return [
+            (slice(row, row + self.tile_size), slice(col, col + self.tile_size))
+            for row in range(0, len(y_coords), self.tile_size)
+            for col in range(0, len(x_coords), self.tile_size)
+        ]
+
+    def compute_displacement_field_parallel(
+        self, img1: np.ndarray, img2: np.ndarray, return_gradients: bool = False
+    ) -> Tuple:
         """
-        img1, img2 = self.preprocess_images(img1, img2)
+        Параллельное вычисление поля смещений по тайлам сетки в n_workers процессах.
+        Изображения передаются процессам через разделяемую память, разбиение на тайлы
+        не зависит от числа процессов, поэтому результат детерминирован.
+        При отмене процессам выставляется общий флаг, и они прерываются между точками.
+        Тайлы, решенные в контрольной точке checkpoint, повторно не считаются.
+        Эталон и его таблицы сумм строятся один раз (или берутся из reference_cache и
+        сохраняются в него без предвычисления сетки), коэффициенты сплайна деформированного
+        изображения для IC-GN - тоже; все они передаются процессам через разделяемую память.
+        """
+        img1, reference = self._reference_for(img1, grid=False)
+        img2 = self.preprocess_image(img2)
+
+        x_coords, y_coords = self._build_grid(img1)
+        active = self._roi_points(img1, x_coords, y_coords)
+        guess_u, guess_v, guess_c = self._initial_guesses(img1, img2, x_coords, y_coords, active)
+
+        P = np.zeros((len(y_coords), len(x_coords), 6), dtype=self.dtype)
+        C = np.zeros((len(y_coords), len(x_coords)), dtype=self.dtype)
+
+        tiles = self._grid_tiles(x_coords, y_coords)
+        if not tiles:
+            return self._field_result(P, C, x_coords, y_coords, img1, img2, return_gradients)
 
+        key = self._checkpoint_key(img1, img2, active) if self.checkpoint is not None else None
+        solved = self._resume(key, P, C, active)
+        tiles = [(rows, cols) for rows, cols in tiles if not solved[rows, cols].all()]
+
+        self._begin_progress(np.sum(active))
+        self._tick(int(np.sum(active & solved)))
+        if not tiles:
+            self._end_progress()
+            return self._field_result(P, C, x_coords, y_coords, img1, img2, return_gradients)
+
+        shared = []
+        try:
+            arrays = (img1, img2, reference.integral, reference.integral_sq)
+            if self.solver == "icgn":
+                arrays += (self.spline_coefficients(img2),)
+            for array in arrays:
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+                shared.append(block)
+
+            specs = [(block.name, array.shape, array.dtype.str) for block, array in zip(shared, arrays)]
+            cancel_flag = shared_memory.SharedMemory(create=True, size=1)
+            cancel_flag.buf[0] = 0
+            shared.append(cancel_flag)
+            context = multiprocessing.get_context("spawn")
+
+            with ProcessPoolExecutor(
+                max_workers=min(self.n_workers, len(tiles)),
+                mp_context=context,
+                initializer=_attach_shared_images,
+                initargs=(self, specs, cancel_flag.name),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _solve_tile,
+                        x_coords[cols],
+                        y_coords[rows],
+                        guess_u[rows, cols],
+                        guess_v[rows, cols],
+                        guess_c[rows, cols],
+                        active[rows, cols],
+                    ): (rows, cols)
+                    for rows, cols in tiles
+                }
+
+                pending = set(futures)
+                try:
+                    while pending:
+                        finished, pending = wait(pending, timeout=self.CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            rows, cols = futures[future]
+                            P[rows, cols], C[rows, cols] = future.result()
+                            solved[rows, cols] = True
+                            self._tick(int(np.sum(active[rows, cols])))
+                            logger.info(f"Тайлы: {len(tiles) - len(pending)}/{len(tiles)}")
+                        if self.checkpoint is not None and finished:
+                            self.checkpoint.maybe_save(key, P, C, solved)
+                        self._check_cancelled()
+                except DICCancelled:
+                    cancel_flag.buf[0] = 1
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+        finally:
+            for block in shared:
+                block.close()
+                block.unlink()
+
+        self._end_progress()
+        return self._field_result(P, C, x_coords, y_coords, img1, img2, return_gradients)
+
+    def compute_displacement_field_out_of_core(
+        self, img1: np.ndarray, img2: np.ndarray, memory_budget_mb: float = 512, return_gradients: bool = False
+    ) -> Tuple:
+        """
+        Расчет поля смещений по тайлам для изображений, не помещающихся в память.
+        img1, img2 - уже предобработанные (preprocess_image) массивы, обычно
+        np.memmap. В память читается только окно тайла с перекрытием (halo), размер
+        тайла подбирается так, чтобы окно укладывалось в memory_budget_mb.
+        Тайлы, решенные в контрольной точке checkpoint, повторно не считаются.
+        """
         height, width = img1.shape
-        y_coords = np.arange(self.half_subset, height - self.half_subset, self.step)
-        x_coords = np.arange(self.half_subset, width - self.half_subset, self.step)
+        x_coords, y_coords = self._build_grid(img1)
+        active = self._roi_points(img1, x_coords, y_coords)
 
-        U = np.zeros((len(y_coords), len(x_coords)))
-        V = np.zeros((len(y_coords), len(x_coords)))
-        C = np.zeros((len(y_coords), len(x_coords)))
+        P = np.zeros((len(y_coords), len(x_coords), 6), dtype=self.dtype)
+        C = np.zeros((len(y_coords), len(x_coords)), dtype=self.dtype)
 
-        for i, y in enumerate(y_coords):
-            for j, x in enumerate(x_coords):
-                initial_guess = (0.0, 0.0)
+        halo = self._tile_halo()
+        tile = self._tile_points(memory_budget_mb, halo)
+        n_tiles = -(-len(y_coords) // tile) * -(-len(x_coords) // tile)
 
-                dx, dy, correlation = self.compute_displacement(img1, img2, x, y, initial_guess)
-                U[i, j] = dx
-                V[i, j] = dy
-                C[i, j] = correlation
+        key = self._checkpoint_key(img1, img2, active) if self.checkpoint is not None else None
+        solved = self._resume(key, P, C, active)
+        self._begin_progress(np.sum(active))
+        self._tick(int(np.sum(active & solved)))
 
-                if (i * len(x_coords) + j) % 100 == 0 and (i * len(x_coords) + j) > 0:
-                    processed = (i * len(x_coords) + j)
-                    total = len(y_coords) * len(x_coords)
-                    progress = processed / total * 100
-                    logger.info(f"Прогресс: {progress:.1f}% ({processed}/{total})")
+        done = 0
+        for row in range(0, len(y_coords), tile):
+            for col in range(0, len(x_coords), tile):
+                done += 1
+                if solved[row : row + tile, col : col + tile].all():
+                    continue
+
+                tile_y = y_coords[row : row + tile]
+                tile_x = x_coords[col : col + tile]
+
+                top = max(int(tile_y[0]) - halo, 0)
+                bottom = min(int(tile_y[-1]) + halo + 1, height)
+                left = max(int(tile_x[0]) - halo, 0)
+                right = min(int(tile_x[-1]) + halo + 1, width)
+
+                window1 = np.array(img1[top:bottom, left:right], dtype=self.dtype)
+                window2 = np.array(img2[top:bottom, left:right], dtype=self.dtype)
+                local_x = tile_x - left
+                local_y = tile_y - top
+
+                tile_active = active[row : row + tile, col : col + tile]
+                guess_u, guess_v, guess_c = self._initial_guesses(window1, window2, local_x, local_y, tile_active)
+                tile_P, tile_C = self._solve_grid(
+                    window1, window2, local_x, local_y, guess_u, guess_v, guess_c, active=tile_active
+                )
+
+                P[row : row + tile, col : col + tile] = tile_P
+                C[row : row + tile, col : col + tile] = tile_C
+                solved[row : row + tile, col : col + tile] = True
+
+                logger.info(f"Тайлы: {done}/{n_tiles}")
+                if self.checkpoint is not None:
+                    self.checkpoint.maybe_save(key, P, C, solved)
 
-        return U, V, C, x_coords, y_coords, img1, img2
+        self._end_progress()
+        return self._field_result(P, C, x_coords, y_coords, img1, img2, return_gradients)
 
-    def compute_displacement_field(self, img1: np.ndarray, img2: np.ndarray) -> Tuple:
+    def _tile_halo(self) -> int:
         """
-        Алиас для совместимости с существующим кодом.
+        Перекрытие тайла: подрегион, радиус поиска (с учетом пирамиды) и окно ±15 пикселей.
         """
-        return self.compute_displacement_field_sequential(img1, img2)
+        search = self.search_radius * 2 ** (self.pyramid_levels - 1)
+        return self.half_subset + search + 15 + 2
 
-    def post_process_displacements(
-        self, U: np.ndarray, V: np.ndarray, C: np.ndarray, min_correlation: float = 0.4
-    ) -> Tuple[np.ndarray, np.ndarray]:
+    def _tile_points(self, memory_budget_mb: float, halo: int) -> int:
+        """
+        Число точек сетки по стороне тайла, при котором окно тайла укладывается в бюджет памяти.
+        На пиксель окна приходится два изображения, две таблицы сумм float64, коэффициенты
+        сплайна IC-GN и временные массивы пирамиды и поиска.
+        """
+        budget = memory_budget_mb * 1024 * 1024
+        side = int(np.sqrt(budget / self.BYTES_PER_TILE_PIXEL))
+
+        return max((side - 2 * halo) // self.step, 1)
+
+    def compute_displacement_sequence(
+        self, frames: Iterable[np.ndarray], reference_mode: str = "fixed", return_gradients: bool = False
+    ) -> Iterator[Dict]:
+        """
+        Инкрементальный DIC по последовательности кадров (генератор, по результату на кадр).
+        Первый кадр - эталон; его предобработка и таблицы сумм строятся один раз.
+        Каждый кадр начинается с поля предыдущего кадра.
+        reference_mode: "fixed" - все кадры сравниваются с первым;
+        "incremental" - эталоном служит предыдущий кадр, полное смещение накапливается.
+        """
+        if reference_mode not in self.REFERENCE_MODES:
+            raise ValueError(
+                f"Неизвестный режим эталона: {reference_mode}. Доступные: {', '.join(self.REFERENCE_MODES)}"
+            )
+
+        frames = iter(frames)
+        first = next(frames, None)
+        if first is None:
+            return
+
+        ref_img, reference = self._reference_for(first)
+        x_coords, y_coords = self._build_grid(ref_img)
+        grid_x, grid_y = np.meshgrid(x_coords, y_coords)
+        active = self._roi_points(ref_img, x_coords, y_coords)
+
+        U_total = np.zeros(grid_x.shape, dtype=self.dtype)
+        V_total = np.zeros(grid_x.shape, dtype=self.dtype)
+        prev_u = None
+        prev_v = None
+
+        for index, frame in enumerate(frames, start=1):
+            img = self.preprocess_image(frame)
+            if img.shape != ref_img.shape:
+                raise ValueError(f"Размер кадра {index} {img.shape} не совпадает с эталоном {ref_img.shape}")
+
+            if prev_u is None:
+                guess_u, guess_v, guess_c = self._initial_guesses(ref_img, img, x_coords, y_coords, active)
+            else:
+                guess_u, guess_v, guess_c = self._seeded_guesses(ref_img, img, x_coords, y_coords, prev_u, prev_v, active)
+
+            self._begin_progress(np.sum(active))
+            P, C = self._solve_grid(ref_img, img, x_coords, y_coords, guess_u, guess_v, guess_c, reference, active)
+            self._end_progress()
+            U, V, C, *_ = self._field_result(P, C, x_coords, y_coords, ref_img, img, False)
+
+            if reference_mode == "incremental":
+                rows = (grid_y + V_total - y_coords[0]) / self.step
+                cols = (grid_x + U_total - x_coords[0]) / self.step
+                U_total = U_total + map_coordinates(np.nan_to_num(U), [rows, cols], order=1, mode="nearest")
+                V_total = V_total + map_coordinates(np.nan_to_num(V), [rows, cols], order=1, mode="nearest")
+                U_total[np.isnan(U)] = np.nan
+                V_total[np.isnan(V)] = np.nan
+
+                ref_img = img
+                reference = ReferenceContext(self, ref_img)
+            else:
+                U_total = U
+                V_total = V
+
+            prev_u = U
+            prev_v = V
+
+            result = {
+                "frame": index,
+                "U": U,
+                "V": V,
+                "C": C,
+                "U_total": U_total,
+                "V_total": V_total,
+                "x_coords": x_coords,
+                "y_coords": y_coords,
+            }
+            if return_gradients:
+                result["gradients"] = self._field_result(P, C, x_coords, y_coords, ref_img, img, True)[-1]
+
+            yield result
+
+    def _seeded_guesses(self, img1, img2, x_coords, y_coords, prev_u, prev_v, active=None) -> Tuple:
+        """
+        Начальные приближения от известного поля: целочисленный поиск вокруг него в точках active.
+        """
+        guess_u = np.nan_to_num(prev_u).astype(self.dtype)
+        guess_v = np.nan_to_num(prev_v).astype(self.dtype)
+        guess_c = np.zeros(guess_u.shape, dtype=self.dtype)
+        searched = np.ones(guess_u.shape, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+        if self.search_radius <= 0 or not searched.any():
+            return guess_u, guess_v, guess_c
+
+        grid_x, grid_y = np.meshgrid(x_coords, y_coords)
+        guess_u[searched], guess_v[searched], guess_c[searched] = self.integer_pixel_search(
+            img1, img2, grid_x[searched], grid_y[searched], guess_x=guess_u[searched], guess_y=guess_v[searched]
+        )
+
+        return guess_u, guess_v, guess_c
+
+    def _field_result(self, P, C, x_coords, y_coords, img1, img2, return_gradients: bool) -> Tuple:
         """
-        Синхронная постобработка полей смещений.
-        Оптимальный порог корреляции для средних окон.
+        Формирование результата поля: (U, V, C, x_coords, y_coords, img1, img2[, gradients]).
         """
-        U_filtered = U.copy()
-        V_filtered = V.copy()
+        U = P[..., 0].copy()
+        V = P[..., 1].copy()
+        result = (U, V, C, x_coords, y_coords, img1, img2)
 
-        mask = C > min_correlation
-        valid_points = np.sum(mask)
-        total_points = C.size
+        if return_gradients:
+            gradients = {key: P[..., index + 2].copy() for index, key in enumerate(self.GRADIENT_KEYS)}
+            result += (gradients,)
 
-        U_filtered[~mask] = np.nan
-        V_filtered[~mask] = np.nan
+        return result
+
+    def compute_strains(self, gradients: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Поля деформаций Грина-Лагранжа из градиентов смещений.
+        """
+        du_dx = gradients["du_dx"]
+        du_dy = gradients["du_dy"]
+        dv_dx = gradients["dv_dx"]
+        dv_dy = gradients["dv_dy"]
 
-        U_filtered = median_filter(U_filtered, size=3, mode="constant", cval=np.nan)
-        V_filtered = median_filter(V_filtered, size=3, mode="constant", cval=np.nan)
+        return {
+            "exx": du_dx + 0.5 * (du_dx**2 + dv_dx**2),
+            "eyy": dv_dy + 0.5 * (du_dy**2 + dv_dy**2),
+            "exy": 0.5 * (du_dy + dv_dx + du_dx * du_dy + dv_dx * dv_dy),
+        }
 
-        magnitude = np.sqrt(U_filtered**2 + V_filtered**2)
-        valid_mag = magnitude[~np.isnan(magnitude)]
+    def _build_grid(self, img1: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Равномерная сетка центров подрегионов.
+        """
+        height, width = img1.shape
+        y_coords = np.arange(self.half_subset, height - self.half_subset, self.step)
+        x_coords = np.arange(self.half_subset, width - self.half_subset, self.step)
+
+        return x_coords, y_coords
+
+    def _initial_guesses(self, img1, img2, x_coords, y_coords, active=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Начальные приближения для сетки: пирамида или поиск на одном уровне.
+        active - маска рассчитываемых точек; поиск ведется только в них, остальные получают нули.
+        """
+        if self.pyramid_levels > 1 and len(x_coords) > 0 and len(y_coords) > 0:
+            return self._pyramid_guesses(img1, img2, x_coords, y_coords, self.pyramid_levels, active)
+
+        return self._search_guesses(img1, img2, x_coords, y_coords, active)
+
+    def _search_guesses(self, img1, img2, x_coords, y_coords, active=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Начальные приближения на одном уровне: целочисленный FFT-поиск в точках active или нули.
+        """
+        shape = (len(y_coords), len(x_coords))
+        guess_u = np.zeros(shape, dtype=self.dtype)
+        guess_v = np.zeros(shape, dtype=self.dtype)
+        guess_c = np.zeros(shape, dtype=self.dtype)
+        searched = np.ones(shape, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+        if self.search_radius <= 0 or not searched.any():
+            return guess_u, guess_v, guess_c
+
+        grid_x, grid_y = np.meshgrid(x_coords, y_coords)
+        guess_u[searched], guess_v[searched], guess_c[searched] = self.integer_pixel_search(
+            img1, img2, grid_x[searched], grid_y[searched]
+        )
+
+        return guess_u, guess_v, guess_c
+
+    def _pyramid_guesses(self, img1, img2, x_coords, y_coords, levels: int, active=None) -> Tuple:
+        """
+        Coarse-to-fine: поле решается на изображениях, уменьшенных в 2 раза,
+        затем масштабируется на текущую сетку и уточняется целочисленным поиском
+        в малом окне в точках active. Радиус поиска на грубом уровне покрывает
+        search_radius * 2^(L-1) пикселей исходного изображения.
+        """
+        shape = (len(y_coords), len(x_coords))
+        coarse1 = self._downsample(img1)
+        coarse2 = self._downsample(img2)
+        coarse_x, coarse_y = self._build_grid(coarse1)
+
+        if levels <= 1 or len(coarse_x) < 2 or len(coarse_y) < 2:
+            return self._search_guesses(img1, img2, x_coords, y_coords, active)
+
+        coarse_active = self._coarse_active(active, x_coords, y_coords, coarse_x, coarse_y)
+        if levels > 2:
+            guess_u, guess_v, guess_c = self._pyramid_guesses(
+                coarse1, coarse2, coarse_x, coarse_y, levels - 1, coarse_active
+            )
+        else:
+            guess_u, guess_v, guess_c = self._search_guesses(coarse1, coarse2, coarse_x, coarse_y, coarse_active)
+
+        self._progress_muted += 1
+        try:
+            P, _ = self._solve_grid(coarse1, coarse2, coarse_x, coarse_y, guess_u, guess_v, guess_c, active=coarse_active)
+        finally:
+            self._progress_muted -= 1
+        U = median_filter(np.nan_to_num(P[..., 0]), size=3, mode="nearest")
+        V = median_filter(np.nan_to_num(P[..., 1]), size=3, mode="nearest")
+
+        grid_x, grid_y = np.meshgrid(x_coords, y_coords)
+        rows = ((grid_y - 0.5) / 2.0 - coarse_y[0]) / self.step
+        cols = ((grid_x - 0.5) / 2.0 - coarse_x[0]) / self.step
+        up_u = 2.0 * map_coordinates(U, [rows, cols], order=1, mode="nearest")
+        up_v = 2.0 * map_coordinates(V, [rows, cols], order=1, mode="nearest")
+
+        guess_u = np.zeros(shape, dtype=self.dtype)
+        guess_v = np.zeros(shape, dtype=self.dtype)
+        guess_c = np.zeros(shape, dtype=self.dtype)
+        searched = np.ones(shape, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+        if searched.any():
+            guess_u[searched], guess_v[searched], guess_c[searched] = self.integer_pixel_search(
+                img1,
+                img2,
+                grid_x[searched],
+                grid_y[searched],
+                guess_x=up_u[searched],
+                guess_y=up_v[searched],
+                radius=self.PYRAMID_REFINE_RADIUS,
+            )
+
+        return guess_u, guess_v, guess_c
+
+    def _coarse_active(self, active, x_coords, y_coords, coarse_x, coarse_y):
+        """
+        Узлы грубой сетки, нужные для точек active: углы билинейной интерполяции
+        и их соседи под медианным фильтром 3x3. None, если active не задана.
+        """
+        if active is None:
+            return None
+
+        mask = np.zeros((len(coarse_y), len(coarse_x)), dtype=bool)
+        rows, cols = np.nonzero(active)
+        rows = ((np.asarray(y_coords)[rows] - 0.5) / 2.0 - coarse_y[0]) / self.step
+        cols = ((np.asarray(x_coords)[cols] - 0.5) / 2.0 - coarse_x[0]) / self.step
+        row0 = np.clip(np.floor(rows).astype(np.intp), 0, len(coarse_y) - 1)
+        col0 = np.clip(np.floor(cols).astype(np.intp), 0, len(coarse_x) - 1)
+        row1 = np.minimum(row0 + 1, len(coarse_y) - 1)
+        col1 = np.minimum(col0 + 1, len(coarse_x) - 1)
+        for row, col in ((row0, col0), (row0, col1), (row1, col0), (row1, col1)):
+            mask[row, col] = True
+
+        return binary_dilation(mask, structure=np.ones((3, 3), dtype=bool))
+
+    @staticmethod
+    def _downsample(img: np.ndarray) -> np.ndarray:
+        """
+        Уменьшение изображения в 2 раза усреднением блоков 2x2.
+        """
+        height, width = img.shape[0] // 2, img.shape[1] // 2
+        blocks = img[: 2 * height, : 2 * width].reshape(height, 2, width, 2)
+
+        return blocks.mean(axis=(1, 3)).astype(img.dtype)
+
+    def _solve_grid(
+        self, img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, reference=None, active=None
+    ) -> Tuple:
+        """
+        Решение для всех точек сетки выбранным режимом обхода.
+        Возвращает параметры функции формы P (rows, cols, 6) и корреляцию C.
+        Точки вне active (область интереса) и точки с низкой текстурой
+        не рассчитываются: P = NaN, C = 0.
+        """
+        if reference is None:
+            reference = ReferenceContext(self, img1)
+
+        P = np.zeros((len(y_coords), len(x_coords), 6), dtype=self.dtype)
+        C = np.zeros((len(y_coords), len(x_coords)), dtype=self.dtype)
+
+        textured = self._textured_points(reference, x_coords, y_coords)
+        active = textured if active is None else active & textured
+        P[~active] = np.nan
+
+        if self.adaptive_levels > 0:
+            self._solve_adaptive(img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, P, C, reference, active)
+        else:
+            self._solve_scan(img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, P, C, reference, active)
+
+        return P, C
+
+    def _roi_points(self, img1, x_coords, y_coords) -> np.ndarray:
+        """
+        Маска точек сетки, центры которых лежат в области интереса roi_mask.
+        """
+        if self.roi_mask is None:
+            return np.ones((len(y_coords), len(x_coords)), dtype=bool)
+
+        if self.roi_mask.shape != img1.shape[:2]:
+            raise ValueError(f"Размер маски {self.roi_mask.shape} не совпадает с изображением {img1.shape[:2]}")
+
+        return self.roi_mask[np.ix_(np.asarray(y_coords, dtype=np.intp), np.asarray(x_coords, dtype=np.intp))]
+
+    def _textured_points(self, reference, x_coords, y_coords) -> np.ndarray:
+        """
+        Маска низкой текстуры: СКО подрегиона эталона не меньше min_texture.
+        """
+        shape = (len(y_coords), len(x_coords))
+        if self.min_texture <= 0 or not all(shape):
+            return np.ones(shape, dtype=bool)
+
+        grid_x, grid_y = np.meshgrid(x_coords, y_coords)
+        _, norms = reference.statistics(grid_x.ravel(), grid_y.ravel())
+
+        return (norms / self.subset_size).reshape(shape) >= self.min_texture
+
+    def _solve_scan(self, img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, P, C, reference, active):
+        """
+        Решение для всех точек сетки выбранным режимом обхода.
+        """
+        if self.scan == "reliability":
+            self._solve_reliability_guided(
+                img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, P, C, reference, active
+            )
+        else:
+            self._solve_raster(img1, img2, x_coords, y_coords, guess_u, guess_v, P, C, reference, active)
+
+    def _solve_adaptive(self, img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, P, C, reference, active):
+        """
+        Адаптивное сгущение: сначала решается сетка с шагом step * 2^adaptive_levels,
+        затем ячейки с большим градиентом смещений (ADAPTIVE_GRADIENT) или низкой
+        корреляцией (ADAPTIVE_MIN_CORRELATION) делятся пополам и досчитываются.
+        В остальных ячейках новые узлы заполняются билинейной интерполяцией углов,
+        так что результат всегда задан на равномерной сетке с шагом step.
+        """
+        rows, cols = C.shape
+        if C.size == 0:
+            return
+
+        stride = 2**self.adaptive_levels
+        coarse = np.ix_(self._level_indices(rows, stride), self._level_indices(cols, stride))
+
+        coarse_P = np.zeros(guess_u[coarse].shape + (6,), dtype=self.dtype)
+        coarse_C = np.zeros(guess_u[coarse].shape, dtype=self.dtype)
+        coarse_P[~active[coarse]] = np.nan
+        self._solve_scan(
+            img1,
+            img2,
+            x_coords[coarse[1].ravel()],
+            y_coords[coarse[0].ravel()],
+            guess_u[coarse],
+            guess_v[coarse],
+            guess_c[coarse],
+            coarse_P,
+            coarse_C,
+            reference,
+            active[coarse],
+        )
+        P[coarse] = coarse_P
+        C[coarse] = coarse_C
+
+        known = ~active
+        known[coarse] = True
+        solved = int(np.sum(active[coarse]))
+
+        while stride > 1:
+            half = stride // 2
+            cell_rows = self._level_indices(rows, stride)
+            cell_cols = self._level_indices(cols, stride)
+            next_rows = self._level_indices(rows, half)
+            next_cols = self._level_indices(cols, half)
+
+            for r0, r1 in zip(cell_rows[:-1], cell_rows[1:]):
+                for c0, c1 in zip(cell_cols[:-1], cell_cols[1:]):
+                    corners_P = P[np.ix_([r0, r1], [c0, c1])]
+                    corners_C = C[np.ix_([r0, r1], [c0, c1])]
+
+                    extent = max(r1 - r0, c1 - c0) * self.step
+                    jump = max(np.ptp(corners_P[..., 0]), np.ptp(corners_P[..., 1]))
+                    refine = jump / extent > self.ADAPTIVE_GRADIENT or corners_C.min() < self.ADAPTIVE_MIN_CORRELATION
+
+                    seed = corners_P.reshape(4, 6)[np.argmax(corners_C.ravel())] if corners_C.max() > 0 else None
+                    for r in next_rows[(next_rows >= r0) & (next_rows <= r1)]:
+                        for c in next_cols[(next_cols >= c0) & (next_cols <= c1)]:
+                            if known[r, c]:
+                                continue
+
+                            if refine:
+                                initial_guess = seed if seed is not None else (guess_u[r, c], guess_v[r, c])
+                                P[r, c], C[r, c] = self.solve_point(
+                                    img1, img2, x_coords[c], y_coords[r], initial_guess, reference
+                                )
+                                solved += 1
+                            else:
+                                wy = (r - r0) / max(r1 - r0, 1)
+                                wx = (c - c0) / max(c1 - c0, 1)
+                                weights = np.array([[(1 - wy) * (1 - wx), (1 - wy) * wx], [wy * (1 - wx), wy * wx]])
+                                P[r, c] = np.tensordot(weights, corners_P, axes=([0, 1], [0, 1]))
+                                C[r, c] = np.sum(weights * corners_C)
+                            known[r, c] = True
+                            self._tick()
+
+            stride = half
+
+        logger.info(f"Адаптивная сетка: решено {solved} из {int(np.sum(active))} точек")
+
+    @staticmethod
+    def _level_indices(n: int, stride: int) -> np.ndarray:
+        """
+        Индексы узлов уровня сетки с шагом stride, включая последний узел.
+        """
+        return np.unique(np.append(np.arange(0, n, stride), n - 1))
+
+    def _solve_raster(self, img1, img2, x_coords, y_coords, guess_u, guess_v, P, C, reference, active):
+        """
+        Построчный обход сетки: каждая точка решается от своего начального приближения.
+        """
+        for i, y in enumerate(y_coords):
+            for j, x in enumerate(x_coords):
+                if not active[i, j]:
+                    continue
+
+                initial_guess = (guess_u[i, j], guess_v[i, j])
+
+                P[i, j], C[i, j] = self.solve_point(img1, img2, x, y, initial_guess, reference)
+                self._tick()
+
+                if (i * len(x_coords) + j) % 100 == 0 and (i * len(x_coords) + j) > 0:
+                    processed = (i * len(x_coords) + j)
+                    total = len(y_coords) * len(x_coords)
+                    progress = processed / total * 100
+                    logger.info(f"Прогресс: {progress:.1f}% ({processed}/{total})")
+
+    def _solve_reliability_guided(
+        self, img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, P, C, reference, active
+    ):
+        """
+        Reliability-guided обход: решение начинается с точек с наибольшей ZNCC
+        целочисленного поиска, далее очередь с приоритетом по корреляции передает
+        решение лучшего решенного соседа как начальное приближение. Если результат
+        хуже целочисленного пика, расположенного далеко от приближения соседа,
+        точка перерешивается от целочисленного пика. Области, недостижимые
+        от затравок (острова маски), получают собственную затравку.
+        """
+        rows, cols = C.shape
+        total = int(np.sum(active))
+        if total == 0:
+            return
+
+        solved = ~active
+        queue = []
+
+        def seed(flat):
+            i, j = divmod(int(flat), cols)
+            P[i, j], C[i, j] = self.solve_point(
+                img1, img2, x_coords[j], y_coords[i], (guess_u[i, j], guess_v[i, j]), reference
+            )
+            solved[i, j] = True
+            heapq.heappush(queue, (-C[i, j], i, j))
+            self._tick()
+
+        n_seeds = max(1, total // 400)
+        for flat in np.argsort(-np.where(active, guess_c, -np.inf), axis=None, kind="stable")[:n_seeds]:
+            seed(flat)
+        processed = n_seeds
+
+        while queue:
+            _, i, j = heapq.heappop(queue)
+
+            for ni, nj in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+                if ni < 0 or nj < 0 or ni >= rows or nj >= cols or solved[ni, nj]:
+                    continue
+
+                params, correlation = self.solve_point(img1, img2, x_coords[nj], y_coords[ni], P[i, j], reference)
+                far_from_seed = abs(guess_u[ni, nj] - P[i, j, 0]) + abs(guess_v[ni, nj] - P[i, j, 1]) > 1.0
+                if correlation < guess_c[ni, nj] and far_from_seed:
+                    params, correlation = self.solve_point(
+                        img1, img2, x_coords[nj], y_coords[ni], (guess_u[ni, nj], guess_v[ni, nj]), reference
+                    )
+
+                P[ni, nj] = params
+                C[ni, nj] = correlation
+                solved[ni, nj] = True
+                heapq.heappush(queue, (-correlation, ni, nj))
+                self._tick()
+
+                processed += 1
+                if processed % 100 == 0:
+                    progress = processed / total * 100
+                    logger.info(f"Прогресс: {progress:.1f}% ({processed}/{total})")
+
+            if not queue and not solved.all():
+                seed(np.argmax(np.where(solved, -np.inf, guess_c)))
+                processed += 1
+
+    def compute_displacement_field(self, img1: np.ndarray, img2: np.ndarray, return_gradients: bool = False) -> Tuple:
+        """
+        Алиас для совместимости с существующим кодом.
+        При n_workers > 1 используется параллельный расчет по тайлам.
+        """
+        if self.n_workers > 1:
+            return self.compute_displacement_field_parallel(img1, img2, return_gradients)
+        return self.compute_displacement_field_sequential(img1, img2, return_gradients)
+
+    def compute_displacement_points(
+        self, img1: np.ndarray, img2: np.ndarray, points, return_gradients: bool = False
+    ) -> Tuple:
+        """
+        Смещения только в заданных точках (например, виртуальных тензометрах).
+        points - массив (N, 2) координат (x, y) центров подрегионов на эталоне.
+        Эталон берется из reference_cache, если он там уже есть; начальное приближение -
+        целочисленный FFT-поиск в окне search_radius. Точки, подрегион которых выходит
+        за изображение, и точки с низкой текстурой не рассчитываются: NaN, C = 0.
+        Возвращает (U, V, C[, gradients]) - массивы длины N.
+        """
+        img1, reference = self._reference_for(img1, build=False)
+        img2 = self.preprocess_image(img2)
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self._begin_progress(len(points))
+        P, C = self._solve_points(img1, img2, points[:, 0], points[:, 1], reference)
+        self._end_progress()
+
+        return self._points_result(P, C, return_gradients)
+
+    def compute_displacement_points_out_of_core(
+        self, img1: np.ndarray, img2: np.ndarray, points, return_gradients: bool = False
+    ) -> Tuple:
+        """
+        Смещения в заданных точках для изображений, не помещающихся в память.
+        img1, img2 - уже предобработанные (preprocess_image) массивы, обычно np.memmap;
+        для каждой точки в память читается только окно с перекрытием, как у тайла
+        compute_displacement_field_out_of_core. Результат - как у compute_displacement_points.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        height, width = img1.shape
+        halo = self._tile_halo()
+
+        P = np.full((len(points), 6), np.nan, dtype=self.dtype)
+        C = np.zeros(len(points), dtype=self.dtype)
+
+        self._begin_progress(len(points))
+        for index, (x, y) in enumerate(points):
+            top = min(max(int(y) - halo, 0), height)
+            bottom = min(max(int(y) + halo + 1, 0), height)
+            left = min(max(int(x) - halo, 0), width)
+            right = min(max(int(x) + halo + 1, 0), width)
+            if bottom - top <= self.subset_size or right - left <= self.subset_size:
+                continue
+
+            window1 = np.array(img1[top:bottom, left:right], dtype=self.dtype)
+            window2 = np.array(img2[top:bottom, left:right], dtype=self.dtype)
+            local_x = np.array([x - left])
+            local_y = np.array([y - top])
+            point_P, point_C = self._solve_points(window1, window2, local_x, local_y, ReferenceContext(self, window1))
+            P[index], C[index] = point_P[0], point_C[0]
+        self._end_progress()
+
+        return self._points_result(P, C, return_gradients)
+
+    def _solve_points(self, img1, img2, xs, ys, reference: "ReferenceContext") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Параметры P (N, 6) и корреляция C (N,) в точках xs, ys предобработанных изображений.
+        Точки, подрегион которых выходит за изображение, и точки с низкой текстурой
+        не рассчитываются: NaN, C = 0.
+        """
+        height, width = img1.shape
+        active = (
+            (xs >= self.half_subset)
+            & (xs < width - self.half_subset)
+            & (ys >= self.half_subset)
+            & (ys < height - self.half_subset)
+        )
+        if self.min_texture > 0 and active.any():
+            _, norms = reference.statistics(np.rint(xs[active]), np.rint(ys[active]))
+            active[active] = norms / self.subset_size >= self.min_texture
+
+        P = np.full((len(xs), 6), np.nan, dtype=self.dtype)
+        C = np.zeros(len(xs), dtype=self.dtype)
+
+        indices = np.flatnonzero(active)
+        guess_u = np.zeros(len(indices))
+        guess_v = np.zeros(len(indices))
+        if self.search_radius > 0 and len(indices):
+            guess_u, guess_v, _ = self.integer_pixel_search(img1, img2, xs[indices], ys[indices])
+
+        for index, guess in zip(indices, zip(guess_u, guess_v)):
+            P[index], C[index] = self.solve_point(img1, img2, xs[index], ys[index], guess, reference)
+            self._tick()
+
+        return P, C
+
+    def _points_result(self, P: np.ndarray, C: np.ndarray, return_gradients: bool) -> Tuple:
+        result = (P[:, 0].copy(), P[:, 1].copy(), C)
+        if return_gradients:
+            result += ({key: P[:, index + 2].copy() for index, key in enumerate(self.GRADIENT_KEYS)},)
+
+        return result
+
+    def post_process_displacements(
+        self,
+        U: np.ndarray,
+        V: np.ndarray,
+        C: np.ndarray,
+        min_correlation: float = 0.4,
+        median_threshold: float = 2.0,
+        fill_holes: bool = True,
+        return_report: bool = False,
+    ) -> Tuple:
+        """
+        Синхронная постобработка полей смещений (векторизованная, с учетом NaN).
+        1. Отбраковка точек с корреляцией не выше min_correlation.
+        2. Нормализованный медианный тест по 8 соседям (Westerweel, Scarano):
+           точка отбраковывается, если отклонение от медианы соседей, деленное на
+           медиану отклонений соседей + MEDIAN_TEST_EPSILON, больше median_threshold.
+        3. Заполнение отбракованных точек средним по не менее MIN_FILL_NEIGHBOURS
+           достоверным соседям (FILL_ITERATIONS проходов). Точки, которые не
+           рассчитывались (NaN, вне области интереса), не заполняются.
+        4. Сглаживание медианой 3x3 только по достоверным точкам.
+        При return_report=True последним элементом добавляется словарь со счетчиками.
+        """
+        computed = np.isfinite(U) & np.isfinite(V)
+        by_correlation = computed & ~(C > min_correlation)
+
+        U_valid = np.where(computed & ~by_correlation, U, np.nan)
+        V_valid = np.where(computed & ~by_correlation, V, np.nan)
+
+        by_median = np.zeros(C.shape, dtype=bool)
+        if C.size:
+            neighbours_u = self._neighbour_planes(U_valid, include_center=False)
+            neighbours_v = self._neighbour_planes(V_valid, include_center=False)
+            median_u = self._nan_median(neighbours_u)
+            median_v = self._nan_median(neighbours_v)
+            spread_u = self._nan_median(neighbours_u, offset=median_u)
+            spread_v = self._nan_median(neighbours_v, offset=median_v)
+
+            residual = np.sqrt(
+                (np.abs(U_valid - median_u) / (spread_u + self.MEDIAN_TEST_EPSILON)) ** 2
+                + (np.abs(V_valid - median_v) / (spread_v + self.MEDIAN_TEST_EPSILON)) ** 2
+            )
+            by_median = np.nan_to_num(residual, nan=0.0) > median_threshold
+
+        U_valid[by_median] = np.nan
+        V_valid[by_median] = np.nan
+
+        filled = np.zeros(C.shape, dtype=bool)
+        if fill_holes and C.size:
+            kernel = np.ones((3, 3))
+            kernel[1, 1] = 0.0
+            for _ in range(self.FILL_ITERATIONS):
+                holes = computed & np.isnan(U_valid)
+                if not holes.any():
+                    break
+
+                valid = np.isfinite(U_valid)
+                count = convolve(valid.astype(U_valid.dtype), kernel, mode="constant")
+                fillable = holes & (count >= self.MIN_FILL_NEIGHBOURS)
+                if not fillable.any():
+                    break
+
+                sum_u = convolve(np.where(valid, U_valid, 0.0), kernel, mode="constant")
+                sum_v = convolve(np.where(valid, V_valid, 0.0), kernel, mode="constant")
+                U_valid[fillable] = sum_u[fillable] / count[fillable]
+                V_valid[fillable] = sum_v[fillable] / count[fillable]
+                filled |= fillable
+
+        U_filtered = U_valid
+        V_filtered = V_valid
+        if C.size:
+            U_filtered = self._nan_median(self._neighbour_planes(U_valid, include_center=True))
+            V_filtered = self._nan_median(self._neighbour_planes(V_valid, include_center=True))
+            U_filtered[np.isnan(U_valid)] = np.nan
+            V_filtered[np.isnan(V_valid)] = np.nan
+
+        report = {
+            "total_points": int(C.size),
+            "computed_points": int(np.sum(computed)),
+            "rejected_correlation": int(np.sum(by_correlation)),
+            "rejected_median": int(np.sum(by_median)),
+            "filled": int(np.sum(filled)),
+            "valid_points": int(np.sum(np.isfinite(U_filtered))),
+        }
+        logger.info(
+            f"Валидация: отбраковано {report['rejected_correlation']} по корреляции, "
+            f"{report['rejected_median']} медианным тестом, заполнено {report['filled']}"
+        )
+
+        if return_report:
+            return U_filtered, V_filtered, report
+        return U_filtered, V_filtered
+
+    @staticmethod
+    def _neighbour_planes(field: np.ndarray, include_center: bool) -> list:
+        """
+        Окрестность 3x3 каждой точки как список полей по соседям (срезы одного массива);
+        NaN и значения за границей заменены на +inf.
+        """
+        padded = np.pad(np.where(np.isnan(field), np.inf, field), 1, mode="constant", constant_values=np.inf)
+        rows, cols = field.shape
+
+        return [
+            padded[1 + di : 1 + di + rows, 1 + dj : 1 + dj + cols]
+            for di in (-1, 0, 1)
+            for dj in (-1, 0, 1)
+            if include_center or di or dj
+        ]
+
+    @classmethod
+    def _nan_median(cls, planes: list, offset: np.ndarray = None) -> np.ndarray:
+        """
+        Поточечная медиана списка из 8 или 9 полей без учета +inf и NaN (NaN, если значений нет).
+        offset - поле, от которого берутся модули отклонений (медиана отклонений) вместо самих значений.
+        Поля упорядочиваются сетью сравнений SORTING_NETWORKS из np.minimum/np.maximum,
+        +inf уходят в конец; медиана - среднее упорядоченных полей с номерами (n - 1) // 2
+        и n // 2, где n - число конечных значений в точке. Поле обрабатывается блоками строк
+        по MEDIAN_BLOCK_POINTS точек, чтобы рабочие массивы оставались в кэше процессора.
+        """
+        median = np.empty(planes[0].shape, dtype=planes[0].dtype)
+        rows_per_block = max(cls.MEDIAN_BLOCK_POINTS // max(median.shape[1], 1), 1)
+
+        for top in range(0, median.shape[0], rows_per_block):
+            block = slice(top, top + rows_per_block)
+            if offset is None:
+                block_planes = [plane[block].copy() for plane in planes]
+            else:
+                block_planes = [np.abs(plane[block] - offset[block]) for plane in planes]
+            median[block] = cls._block_median(block_planes)
+
+        return median
+
+    @classmethod
+    def _block_median(cls, planes: list) -> np.ndarray:
+        """
+        Медиана _nan_median для блока; planes - собственные копии, упорядочиваются на месте.
+        """
+        size = len(planes)
+        count = np.zeros(planes[0].shape, dtype=np.int8)
+        for plane in planes:
+            count += np.isfinite(plane)
+        buffer = np.empty_like(planes[0])
+
+        for i, j in cls.SORTING_NETWORKS[size]:
+            np.minimum(planes[i], planes[j], out=buffer)
+            np.maximum(planes[i], planes[j], out=planes[j])
+            planes[i], buffer = buffer, planes[i]
+
+        median = 0.5 * (planes[(size - 1) // 2] + planes[size // 2])
+
+        partial = np.flatnonzero(count < size)
+        if partial.size:
+            ordered = np.stack([plane.ravel()[partial] for plane in planes[: size // 2 + 1]])
+            known = count.ravel()[partial].astype(np.intp)
+            columns = np.arange(partial.size)
+            low = ordered[np.maximum(known - 1, 0) // 2, columns]
+            high = ordered[known // 2, columns]
+            median.ravel()[partial] = np.where(known > 0, 0.5 * (low + high), np.nan)
+
+        return median
+
+
+class ReferenceContext:
+    """
+    Предвычисленные данные эталонного изображения для корреляции.
+    Таблицы сумм (integral images) дают среднее и норму любого целочисленного
+    подрегиона за O(1), поэтому статистики эталона не пересчитываются в целевой функции.
+    precompute_grid дополнительно сохраняет подрегионы, нормы и градиенты для узлов сетки.
+    Контекст хранит только параметры подрегиона, а не сам DigitalImageCorrelation, поэтому
+    запись кэша не удерживает маску области интереса, колбэк и токен отмены задачи.
+    """
+
+    GRID_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, dic: DigitalImageCorrelation, img1: np.ndarray, tables=None):
+        """
+        tables - готовые таблицы сумм (integral, integral_sq) этого эталона, например
+        из разделяемой памяти; иначе строятся по img1.
+        """
+        self.image = img1
+        self.subset_size = dic.subset_size
+        self.half_subset = dic.half_subset
+        self.n_pixels = dic.subset_size**2
+        self.dtype = dic.dtype
+        self.pad = self.half_subset + 1
+
+        if tables is None:
+            # sample_subsets возвращает 0 для последней строки/столбца и за границей изображения
+            sampled = img1.astype(np.float64)
+            sampled[-1, :] = 0.0
+            sampled[:, -1] = 0.0
+            padded = np.pad(sampled, self.pad, mode="constant")
+            tables = (self._integral(padded), self._integral(padded**2))
+        self.integral, self.integral_sq = tables
+
+        self.grid_index = {}
+        self.grid_x = np.zeros(0)
+        self.grid_y = np.zeros(0)
+        self.grid_zero = None
+        self.grid_norms = None
+        self.grid_grad_x = None
+        self.grid_grad_y = None
+
+    def precompute_grid(self, x_coords, y_coords) -> bool:
+        """
+        Подрегионы без среднего, нормы и градиенты эталона для всех узлов сетки.
+        Не выполняется, если стеки превышают GRID_MAX_BYTES.
+        """
+        grid_x, grid_y = np.meshgrid(np.asarray(x_coords, dtype=np.float64), np.asarray(y_coords, dtype=np.float64))
+        grid_x = grid_x.ravel()
+        grid_y = grid_y.ravel()
+        if 3 * grid_x.size * self.n_pixels * self.dtype.itemsize > self.GRID_MAX_BYTES:
+            return False
+
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.grid_zero, self.grid_norms = self.subsets(grid_x, grid_y)
+        self.grid_grad_x = 0.5 * (self.windows(grid_x + 1, grid_y) - self.windows(grid_x - 1, grid_y))
+        self.grid_grad_y = 0.5 * (self.windows(grid_x, grid_y + 1) - self.windows(grid_x, grid_y - 1))
+        self._index_grid()
+
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Объем памяти эталона, таблиц сумм и данных сетки в байтах.
+        """
+        arrays = (
+            self.image,
+            self.integral,
+            self.integral_sq,
+            self.grid_x,
+            self.grid_y,
+            self.grid_zero,
+            self.grid_norms,
+            self.grid_grad_x,
+            self.grid_grad_y,
+        )
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def _index_grid(self) -> None:
+        self.grid_index = {(x, y): index for index, (x, y) in enumerate(zip(self.grid_x.tolist(), self.grid_y.tolist()))}
+
+    def windows(self, centers_x, centers_y) -> np.ndarray:
+        """
+        Стек подрегионов эталона (N, s, s), как sample_subsets. Подрегионы с целочисленным
+        центром, не задевающие последние строку и столбец, копируются из изображения
+        без интерполяции: билинейные веса для них равны 0 и 1, значения совпадают.
+        """
+        centers_x = np.atleast_1d(np.asarray(centers_x, dtype=np.float64))
+        centers_y = np.atleast_1d(np.asarray(centers_y, dtype=np.float64))
+        x0 = centers_x - self.half_subset
+        y0 = centers_y - self.half_subset
+
+        height, width = self.image.shape
+        direct = (
+            (centers_x == np.floor(centers_x))
+            & (centers_y == np.floor(centers_y))
+            & (x0 >= 0)
+            & (y0 >= 0)
+            & (x0 + self.subset_size < width)
+            & (y0 + self.subset_size < height)
+        )
+        if not direct.any():
+            return _sample_subsets(self.image, centers_x, centers_y, self.subset_size, self.dtype)
+
+        subsets = np.empty((len(centers_x), self.subset_size, self.subset_size), dtype=self.dtype)
+        view = sliding_window_view(self.image, (self.subset_size, self.subset_size))
+        subsets[direct] = view[y0[direct].astype(np.intp), x0[direct].astype(np.intp)]
+        if not direct.all():
+            subsets[~direct] = _sample_subsets(
+                self.image, centers_x[~direct], centers_y[~direct], self.subset_size, self.dtype
+            )
+
+        return subsets
+
+    def gradients(self, x: float, y: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Градиенты эталонного подрегиона по x и y (центральные разности).
+        """
+        index = self.grid_index.get((float(x), float(y)))
+        if index is not None:
+            return self.grid_grad_x[index], self.grid_grad_y[index]
+
+        shifted = self.windows([x + 1, x - 1, x, x], [y, y, y + 1, y - 1])
+        return 0.5 * (shifted[0] - shifted[1]), 0.5 * (shifted[2] - shifted[3])
+
+    def save(self, path: str) -> None:
+        """
+        Атомарная запись нормированного эталона в файл .npz.
+        Таблицы сумм и данные сетки не сохраняются: построить их заново быстрее,
+        чем прочитать с диска (стеки сетки - сотни мегабайт для изображения 2000x2000).
+        """
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, image=self.image)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, dic: DigitalImageCorrelation, path: str) -> "ReferenceContext":
+        """
+        Загрузка контекста, сохраненного save.
+        """
+        with np.load(path) as data:
+            return cls(dic, data["image"])
+
+    @staticmethod
+    def _integral(img: np.ndarray) -> np.ndarray:
+        integral = np.zeros((img.shape[0] + 1, img.shape[1] + 1))
+        integral[1:, 1:] = np.cumsum(np.cumsum(img, axis=0), axis=1)
+        return integral
+
+    def statistics(self, centers_x, centers_y) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Среднее и норма (без среднего) подрегионов с целочисленными центрами.
+        """
+        x0 = np.asarray(centers_x, dtype=np.intp) - self.half_subset + self.pad
+        y0 = np.asarray(centers_y, dtype=np.intp) - self.half_subset + self.pad
+        x1 = x0 + self.subset_size
+        y1 = y0 + self.subset_size
+
+        sums = self.integral[y1, x1] - self.integral[y0, x1] - self.integral[y1, x0] + self.integral[y0, x0]
+        sums_sq = (
+            self.integral_sq[y1, x1] - self.integral_sq[y0, x1] - self.integral_sq[y1, x0] + self.integral_sq[y0, x0]
+        )
+
+        means = sums / self.n_pixels
+        norms = np.sqrt(np.clip(sums_sq - sums * means, 0.0, None))
+
+        return means, norms
+
+    def subset(self, x: float, y: float) -> Tuple[np.ndarray, float]:
+        """
+        Подрегион эталона без среднего и его норма.
+        """
+        index = self.grid_index.get((float(x), float(y)))
+        if index is not None:
+            return self.grid_zero[index], float(self.grid_norms[index])
+
+        ref_zero, ref_norm = self.subsets(x, y)
+        return ref_zero[0], float(ref_norm[0])
+
+    def subsets(self, centers_x, centers_y) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Стек подрегионов эталона без среднего (N, s, s) и их нормы (N,).
+        Для целочисленных центров внутри изображения статистики берутся из таблиц сумм.
+        """
+        centers_x = np.atleast_1d(np.asarray(centers_x, dtype=np.float64))
+        centers_y = np.atleast_1d(np.asarray(centers_y, dtype=np.float64))
+        subsets = self.windows(centers_x, centers_y)
+
+        height, width = self.image.shape
+        tabulated = (
+            (centers_x == np.floor(centers_x))
+            & (centers_y == np.floor(centers_y))
+            & (centers_x >= 0)
+            & (centers_x < width)
+            & (centers_y >= 0)
+            & (centers_y < height)
+        )
+
+        means = np.mean(subsets, axis=(1, 2))
+        table_means, table_norms = self.statistics(centers_x[tabulated], centers_y[tabulated])
+        means[tabulated] = table_means
+
+        subsets -= means[:, None, None]
+        norms = np.sqrt(np.sum(subsets**2, axis=(1, 2)))
+        norms[tabulated] = table_norms
+
+        return subsets, norms
+
+
+class ReferenceCache:
+    """
+    Ограниченный LRU-кэш эталонных контекстов по хешу исходного изображения и параметрам
+    (размер подрегиона, шаг). Хранится в памяти процесса (не более max_memory_mb вместе с
+    таблицами сумм и данными сетки) и, если задан cache_dir, на диске (не более max_disk_mb);
+    при превышении лимитов вытесняются давно не использованные записи.
+    На диске хранится только нормированный эталон, таблицы сумм строятся при загрузке.
+    Один экземпляр можно разделять между потоками и экземплярами DigitalImageCorrelation.
+    """
+
+    def __init__(self, max_memory_mb: float = 1024, cache_dir: str = None, max_disk_mb: float = 1024):
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, dic: DigitalImageCorrelation, img1: np.ndarray) -> str:
+        """
+        Ключ: SHA-256 исходного изображения, его формы и типа, параметров сетки и точности.
+        """
+        img1 = np.ascontiguousarray(img1)
+        digest = hashlib.sha256(img1.view(np.uint8).ravel())
+        digest.update(f"{img1.shape}|{img1.dtype.str}|{dic.subset_size}|{dic.step}|{dic.precision}".encode())
+        return digest.hexdigest()
+
+    def get(self, dic: DigitalImageCorrelation, img1: np.ndarray, grid: bool = True) -> ReferenceContext:
+        """
+        Контекст эталона из памяти, с диска или построенный заново. Данные сетки
+        (при grid=True) предвычисляются в памяти и на диск не записываются.
+        """
+        key = self.key(dic, img1)
+        reference = self._lookup(dic, key)
+        if reference is None:
+            reference = ReferenceContext(dic, dic.preprocess_image(img1))
+            self._store(key, reference)
+            self._remember(key, reference)
+
+        if grid and reference.grid_zero is None and reference.precompute_grid(*dic._build_grid(reference.image)):
+            with self.lock:
+                self._shrink()
+
+        return reference
+
+    def peek(self, dic: DigitalImageCorrelation, img1: np.ndarray):
+        """
+        Контекст эталона из памяти или с диска без построения; None, если его нет в кэше.
+        """
+        return self._lookup(dic, self.key(dic, img1))
+
+    def _lookup(self, dic: DigitalImageCorrelation, key: str):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        reference = self._load(dic, key)
+        if reference is not None:
+            self._remember(key, reference)
+
+        return reference
+
+    def _remember(self, key: str, reference: ReferenceContext) -> None:
+        with self.lock:
+            self.entries[key] = reference
+            self.entries.move_to_end(key)
+            self._shrink()
+
+    def _shrink(self) -> None:
+        """
+        Вытеснение давно не использованных контекстов, пока объем в памяти превышает лимит
+        (вызывается под lock). Контекст больше лимита не удерживается, но вызывающий
+        код продолжает им пользоваться.
+        """
+        total = sum(reference.nbytes for reference in self.entries.values())
+        while self.entries and total > self.max_memory_bytes:
+            _, reference = self.entries.popitem(last=False)
+            total -= reference.nbytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _load(self, dic: DigitalImageCorrelation, key: str):
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+
+        try:
+            reference = ReferenceContext.load(dic, self._path(key))
+            os.utime(self._path(key))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Не удалось прочитать эталон {key} из кэша: {e}")
+            return None
+
+        return reference
+
+    def _store(self, key: str, reference: ReferenceContext) -> None:
+        if not self.cache_dir:
+            return
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            reference.save(self._path(key))
+            self._evict()
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить эталон {key} в кэш: {e}")
+
+    def _evict(self) -> None:
+        """
+        Удаление давно не использованных файлов, пока кэш на диске превышает лимит.
+        """
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".npz"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+class FieldCheckpoint:
+    """
+    Контрольная точка расчета поля: частичные параметры P, корреляция C и маска решенных
+    точек в одном сжатом файле .npz. Запись атомарна (временный файл и os.replace), поэтому
+    файл можно читать из другого процесса, в том числе во время записи, а повторный расчет
+    на другом обработчике продолжается с последней записанной точки. Контрольная точка
+    принимается, только если совпадает ключ расчета (изображения, сетка и параметры).
+    """
+
+    def __init__(self, path: str, interval: float = 60.0):
+        self.path = path
+        self.interval = max(float(interval), 0.0)
+        self._saved_at = time.monotonic()
+
+    def load(self, key: str, shape):
+        """
+        (P, C, solved) из файла или None, если файла нет, он поврежден или от другого расчета.
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with np.load(self.path) as data:
+                if str(data["key"]) != key or data["solved"].shape != tuple(shape):
+                    logger.info(f"Контрольная точка {self.path} относится к другому расчету")
+                    return None
+                return data["P"], data["C"], data["solved"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Не удалось прочитать контрольную точку {self.path}: {e}")
+            return None
+
+    def save(self, key: str, P: np.ndarray, C: np.ndarray, solved: np.ndarray) -> None:
+        """
+        Атомарная запись контрольной точки.
+        """
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(f, key=np.array(key), P=P, C=C, solved=solved)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось записать контрольную точку {self.path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._saved_at = time.monotonic()
+
+    def maybe_save(self, key: str, P: np.ndarray, C: np.ndarray, solved: np.ndarray) -> bool:
+        """
+        Запись, если с предыдущей прошло не меньше interval секунд.
+        """
+        if time.monotonic() - self._saved_at < self.interval:
+            return False
+
+        self.save(key, P, C, solved)
+        return True
+
+    def clear(self) -> None:
+        """
+        Удаление контрольной точки после завершения расчета.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _SharedFlag:
+    """
+    Флаг отмены в разделяемой памяти с интерфейсом threading.Event.is_set().
+    """
+
+    def __init__(self, block: shared_memory.SharedMemory):
+        self.block = block
+
+    def is_set(self) -> bool:
+        return self.block.buf[0] != 0
+
+
+def _attach_shared_images(dic: DigitalImageCorrelation, specs, cancel_name: str) -> None:
+    """
+    Инициализатор процесса: подключение изображений, таблиц сумм эталона,
+    коэффициентов сплайна (для IC-GN) и флага отмены из разделяемой памяти.
+    """
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [
+        np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf) for block, (_, shape, dtype) in zip(blocks, specs)
+    ]
+    images = arrays[:2]
+
+    _worker_state["dic"] = dic
+    _worker_state["blocks"] = blocks
+    _worker_state["images"] = images
+    _worker_state["reference"] = ReferenceContext(dic, images[0], tables=arrays[2:4])
+    if len(arrays) > 4:
+        dic._spline_source, dic._spline = images[1], arrays[4]
+    _worker_state["cancel_flag"] = shared_memory.SharedMemory(name=cancel_name)
+    dic.cancel_token = _SharedFlag(_worker_state["cancel_flag"])
+
+
+def _solve_tile(x_coords, y_coords, guess_u, guess_v, guess_c, active) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Расчет одного тайла сетки в процессе пула.
+    """
+    dic = _worker_state["dic"]
+    img1, img2 = _worker_state["images"]
 
-        if len(valid_mag) > 0:
-            return U_filtered, V_filtered
\ No newline at end of file
+    return dic._solve_grid(
+        img1, img2, x_coords, y_coords, guess_u, guess_v, guess_c, _worker_state["reference"], active
+    )
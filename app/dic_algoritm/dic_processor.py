@@ -1,5 +1,6 @@
 import asyncio
 import concurrent.futures
+import aiofiles
 from pathlib import Path
 import numpy as np
 from typing import Tuple, Dict, Any, Optional
@@ -10,6 +11,8 @@ import json
 import logging
 
 from async_dic import AsyncDigitalImageCorrelation
+from dic_algorithm import DigitalImageCorrelation, ReferenceCache
+from frame_sequence import list_frames, save_frame, sequence_path, sequence_results
 from visualization import save_three_images_sync
 
 logger = logging.getLogger(__name__)
@@ -17,17 +20,31 @@ logger = logging.getLogger(__name__)
 thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
 
 
+def _load_image_sync(path: str) -> np.ndarray:
+    """
+    Синхронная загрузка изображения в оттенках серого.
+    """
+    from matplotlib.image import imread
+
+    img = imread(path)
+    if len(img.shape) == 3:
+        img = np.mean(img, axis=2)
+    return img
+
+
 class DICProcessorAPI:
     """
     Асинхронный API процессор для обработки DIC запросов.
     Оптимизирован для средних окон (21-31 пикселя).
     """
 
-    def __init__(self, results_dir: str = "api_results"):
+    def __init__(self, results_dir: str = "api_results", reference_cache: ReferenceCache = None):
         """
         Инициализация API процессора.
+        reference_cache - кэш эталонов, общий для всех задач процессора (по умолчанию в памяти).
         """
         self.results_dir = results_dir
+        self.reference_cache = reference_cache if reference_cache is not None else ReferenceCache()
         self.processing_tasks = {}
         Path(results_dir).mkdir(parents=True, exist_ok=True)
 
@@ -39,6 +56,8 @@ class DICProcessorAPI:
         subset_size: int = 25,
         step: int = 12,
         max_iter: int = 35,
+        n_workers: int = 1,
+        precision: str = "float32",
     ) -> Dict[str, Any]:
         """
         Асинхронная обработка теста с двумя изображениями.
@@ -49,7 +68,13 @@ class DICProcessorAPI:
         Path(test_dir).mkdir(parents=True, exist_ok=True)
 
         dic = AsyncDigitalImageCorrelation(
-            subset_size=subset_size, step=step, max_iter=max_iter, output_dir=test_dir
+            subset_size=subset_size,
+            step=step,
+            max_iter=max_iter,
+            output_dir=test_dir,
+            n_workers=n_workers,
+            reference_cache=self.reference_cache,
+            precision=precision,
         )
 
         try:
@@ -103,6 +128,7 @@ class DICProcessorAPI:
                     "step": step,
                     "max_iter": max_iter,
                     "min_correlation": 0.4,
+                    "precision": precision,
                 },
                 "timestamp": datetime.datetime.now().isoformat(),
             }
@@ -130,6 +156,8 @@ class DICProcessorAPI:
         subset_size: int = 27,
         step: int = 13,
         max_iter: int = 40,
+        n_workers: int = 1,
+        precision: str = "float32",
     ) -> Dict[str, Any]:
         """
         Асинхронная обработка теста из файлов изображений.
@@ -139,28 +167,104 @@ class DICProcessorAPI:
             img1, img2 = await self._load_images_async(img1_path, img2_path)
 
             return await self.process_test_async(
-                test_id, img1, img2, subset_size=subset_size, step=step, max_iter=max_iter
+                test_id,
+                img1,
+                img2,
+                subset_size=subset_size,
+                step=step,
+                max_iter=max_iter,
+                n_workers=n_workers,
+                precision=precision,
             )
 
         except Exception as e:
             return {"test_id": test_id, "status": "error", "error": f"Ошибка загрузки изображений: {e}"}
 
+    async def process_sequence_async(
+        self,
+        test_id: str,
+        frames,
+        subset_size: int = 25,
+        step: int = 12,
+        max_iter: int = 35,
+        reference_mode: str = "fixed",
+        precision: str = "float32",
+    ) -> Dict[str, Any]:
+        """
+        Асинхронная обработка последовательности кадров (список путей или каталог).
+        Кадры решаются по одному в пуле потоков, результат каждого кадра сразу
+        записывается в {test_id}_frame_XXXX.npz и строкой в {test_id}_sequence.jsonl.
+        """
+        test_dir = os.path.join(self.results_dir, test_id)
+        Path(test_dir).mkdir(parents=True, exist_ok=True)
+
+        dic = DigitalImageCorrelation(
+            subset_size=subset_size,
+            step=step,
+            max_iter=max_iter,
+            reference_cache=self.reference_cache,
+            precision=precision,
+        )
+
+        try:
+            start_time = datetime.datetime.now()
+            frame_paths = list_frames(frames)
+
+            loop = asyncio.get_event_loop()
+            images = (_load_image_sync(path) for path in frame_paths)
+            sequence = dic.compute_displacement_sequence(images, reference_mode=reference_mode)
+            jsonl_path = sequence_path(test_dir, test_id)
+            frames_summary = []
+
+            async with aiofiles.open(jsonl_path, "w", encoding="utf-8") as sequence_file:
+                while True:
+                    frame = await loop.run_in_executor(thread_pool, next, sequence, None)
+                    if frame is None:
+                        break
+
+                    summary = await loop.run_in_executor(
+                        thread_pool, save_frame, dic, frame, frame_paths, test_dir, test_id
+                    )
+                    await sequence_file.write(json.dumps(summary, ensure_ascii=False) + "\n")
+                    await sequence_file.flush()
+                    frames_summary.append(summary)
+
+            results = sequence_results(
+                test_id,
+                frames_summary,
+                jsonl_path,
+                start_time,
+                subset_size=subset_size,
+                step=step,
+                max_iter=max_iter,
+                reference_mode=reference_mode,
+                precision=precision,
+            )
+
+            results_path = os.path.join(test_dir, f"{test_id}_results.json")
+            async with aiofiles.open(results_path, "w", encoding="utf-8") as f:
+                await f.write(json.dumps(results, ensure_ascii=False, indent=2, sort_keys=True))
+            results["results_json_path"] = results_path
+
+            return results
+
+        except Exception as e:
+            logger.exception("Ошибка при обработке последовательности %s: %s", test_id, e)
+            return {
+                "test_id": test_id,
+                "status": "error",
+                "error": str(e),
+                "timestamp": datetime.datetime.now().isoformat(),
+            }
+
     async def _load_images_async(self, img1_path: str, img2_path: str) -> Tuple[np.ndarray, np.ndarray]:
         """
         Асинхронная загрузка изображений.
         """
         loop = asyncio.get_event_loop()
 
-        def load_image_sync(path):
-            from matplotlib.image import imread
-
-            img = imread(path)
-            if len(img.shape) == 3:
-                img = np.mean(img, axis=2)
-            return img
-
-        img1_task = loop.run_in_executor(thread_pool, load_image_sync, img1_path)
-        img2_task = loop.run_in_executor(thread_pool, load_image_sync, img2_path)
+        img1_task = loop.run_in_executor(thread_pool, _load_image_sync, img1_path)
+        img2_task = loop.run_in_executor(thread_pool, _load_image_sync, img2_path)
 
         img1, img2 = await asyncio.gather(img1_task, img2_task)
 
@@ -0,0 +1,97 @@
+"""
+Общая часть обработки последовательности кадров для синхронного и асинхронного
+процессоров: список кадров, запись и сводка каждого кадра, итоговый результат.
+"""
+
+import datetime
+import os
+from pathlib import Path
+
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+MIN_CORRELATION = 0.4
+
+
+def list_frames(frames) -> list:
+    """
+    Упорядоченный список путей кадров из списка или каталога.
+    Для последовательности нужно не менее двух кадров.
+    """
+    if isinstance(frames, (str, os.PathLike)) and os.path.isdir(frames):
+        frame_paths = sorted(
+            str(path) for path in Path(frames).iterdir() if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+        )
+    else:
+        frame_paths = [str(path) for path in frames]
+
+    if len(frame_paths) < 2:
+        raise ValueError("Для последовательности нужно не менее двух кадров")
+    return frame_paths
+
+
+def sequence_path(test_dir: str, test_id: str) -> str:
+    """
+    Путь файла {test_id}_sequence.jsonl со сводками кадров.
+    """
+    return os.path.join(test_dir, f"{test_id}_sequence.jsonl")
+
+
+def save_frame(dic, frame: dict, frame_paths: list, test_dir: str, test_id: str) -> dict:
+    """
+    Фильтрация накопленного поля кадра, запись полей в {test_id}_frame_XXXX.npz
+    и сводка кадра (строка {test_id}_sequence.jsonl).
+    """
+    U_filtered, V_filtered = dic.post_process_displacements(
+        frame["U_total"], frame["V_total"], frame["C"], min_correlation=MIN_CORRELATION
+    )
+
+    frame_path = os.path.join(test_dir, f"{test_id}_frame_{frame['frame']:04d}.npz")
+    np.savez_compressed(
+        frame_path,
+        U=frame["U"],
+        V=frame["V"],
+        C=frame["C"],
+        U_total=frame["U_total"],
+        V_total=frame["V_total"],
+        U_filtered=U_filtered,
+        V_filtered=V_filtered,
+        x_coords=frame["x_coords"],
+        y_coords=frame["y_coords"],
+    )
+
+    magnitude = np.sqrt(U_filtered**2 + V_filtered**2)
+    mag_valid = magnitude[~np.isnan(magnitude)]
+    C = frame["C"]
+
+    return {
+        "frame": frame["frame"],
+        "image_path": frame_paths[frame["frame"]],
+        "fields_path": frame_path,
+        "mean_displacement": float(np.mean(mag_valid)) if len(mag_valid) > 0 else 0.0,
+        "max_displacement": float(np.max(mag_valid)) if len(mag_valid) > 0 else 0.0,
+        "correlation_quality": float(np.mean(C)),
+        "reliable_points_percentage": float(100 * np.sum(C > 0.5) / C.size) if C.size else 0.0,
+    }
+
+
+def sequence_results(
+    test_id: str, frames_summary: list, path: str, start_time: datetime.datetime, **parameters
+) -> dict:
+    """
+    Итоговый результат последовательности по сводкам кадров; parameters - параметры расчета.
+    """
+    end_time = datetime.datetime.now()
+
+    return {
+        "test_id": test_id,
+        "status": "completed",
+        "frames": frames_summary,
+        "sequence_path": path,
+        "statistics": {
+            "frames_processed": len(frames_summary),
+            "processing_time_seconds": (end_time - start_time).total_seconds(),
+        },
+        "parameters": dict(parameters, min_correlation=MIN_CORRELATION),
+        "timestamp": end_time.isoformat(),
+    }
@@ -28,6 +28,7 @@ async def run_real_test():
             subset_size=27,
             step=13,
             max_iter=40,
+            n_workers=os.cpu_count() or 1,
         )
 
         return results
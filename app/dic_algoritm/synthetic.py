@@ -0,0 +1,28 @@
+"""
+Синтетические пары изображений с известным полем смещений для тестов и бенчмарков.
+"""
+
+import numpy as np
+from scipy.ndimage import gaussian_filter, map_coordinates
+
+
+def synthetic_pair(size: int, shift: float = 2.35, strain: float = 0.002, seed: int = 42):
+    """
+    Синтетическая спекл-картина и ее деформированная копия с известным полем:
+    u = shift + strain * (x - xc), v = -shift / 2 + strain * (y - yc).
+    """
+    rng = np.random.default_rng(seed)
+    reference = gaussian_filter(rng.random((size, size)), 2.0)
+
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float64)
+    center = (size - 1) / 2.0
+    # Обратное отображение: точка X эталона переходит в X + u(X)
+    xs = (xx - shift - center) / (1.0 + strain) + center
+    ys = (yy + shift / 2.0 - center) / (1.0 + strain) + center
+    deformed = map_coordinates(reference, [ys, xs], order=3, mode="reflect")
+
+    def truth(x_coords, y_coords):
+        grid_x, grid_y = np.meshgrid(x_coords, y_coords)
+        return shift + strain * (grid_x - center), -shift / 2.0 + strain * (grid_y - center)
+
+    return reference, deformed, truth
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
+from PIL import Image
 
 
 class DicApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dic_api'
+
+    def ready(self):
+        # Предел PIL против "бомб декомпрессии" по умолчанию (~89 Мп) ниже размеров кадров DIC
+        Image.MAX_IMAGE_PIXELS = settings.DIC_MAX_IMAGE_PIXELS
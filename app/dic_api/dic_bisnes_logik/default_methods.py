@@ -1,11 +1,18 @@
-import threading
 import logging
-from ..serealisers import DICAnalysisSerializer
+from ..models import DICAnalysis
+from ..serealisers import DICAnalysisSerializer, DICPointsQuerySerializer
+from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 import os
 from rest_framework import status
 from rest_framework import viewsets
+from django.utils import timezone
 from .help_methods import HelpMethods
+from .job_queue import QueueFull, check_admission, client_key, estimate_image_cost, prospective_position, queue_position
+from .progress import EventStreamRenderer, progress_events, progress_from_instance, read_progress
+from django.http import StreamingHttpResponse
 
 
 class DefaultMethodsMixin(viewsets.ModelViewSet):
@@ -16,28 +23,67 @@ class DefaultMethodsMixin(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        dic_analysis = serializer.save()
-
-        task_id = str(dic_analysis.id)
-
-        thread = threading.Thread(
-            target=HelpMethods()._process_dic_task,
-            args=(
-                task_id,
-                dic_analysis.image_before.path,
-                dic_analysis.image_after.path,
-                dic_analysis.subset_size,
-                dic_analysis.step,
-                dic_analysis.max_iter,
-                dic_analysis.min_correlation,
-            ),
-            daemon=True,
+        user = request.user if request.user.is_authenticated else None
+        client = client_key(request)
+        validated_data = serializer.validated_data
+        help_methods = HelpMethods()
+
+        # Повтор уже рассчитанной задачи не занимает место в очереди и не ограничивается лимитом
+        cache_key = help_methods._upload_cache_key(validated_data)
+        cached = bool(cache_key) and help_methods._result_cache().contains(cache_key)
+        estimated_cost = estimate_image_cost(
+            validated_data["image_before"], validated_data.get("subset_size", 25), validated_data.get("step", 12)
         )
-        thread.start()
+        if not cached:
+            try:
+                check_admission(user, client)
+            except QueueFull as e:
+                return self._queue_full_response(e, validated_data, user, client, estimated_cost)
+
+            dic_analysis = serializer.save(user=user, client_key=client, estimated_cost=estimated_cost)
+        else:
+            # Задача создается выполняемой, чтобы ее не забрал обработчик очереди; при сбое
+            # копирования без сигнала ее вернет в очередь requeue_stale
+            dic_analysis = serializer.save(
+                user=user,
+                client_key=client,
+                estimated_cost=estimated_cost,
+                status=DICAnalysis.Status.PROCESSING,
+                heartbeat_at=timezone.now(),
+            )
+            if not help_methods._complete_from_cache(dic_analysis, cache_key):
+                # Запись вытеснена после проверки - задача рассчитывается как обычно
+                DICAnalysis.objects.filter(id=dic_analysis.id).update(
+                    status=DICAnalysis.Status.PENDING, started_at=None, heartbeat_at=None
+                )
 
+        dic_analysis.refresh_from_db()
         response_serializer = DICAnalysisSerializer(dic_analysis, context={"request": request})
-        headers = self.get_success_headers(response_serializer.data)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        data = dict(response_serializer.data, queue_position=queue_position(dic_analysis))
+        headers = self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def _queue_full_response(self, error, validated_data, user, client, estimated_cost):
+        """
+        Ответ 429: у пользователя или во всей очереди слишком много ожидающих задач.
+        queue_position - позиция, которую задача заняла бы в текущем порядке планировщика.
+        """
+        logging.getLogger(__name__).warning("Задача отклонена: %s", error)
+        position = prospective_position(
+            user,
+            client,
+            validated_data.get("priority", DICAnalysis.Priority.INTERACTIVE),
+            estimated_cost,
+        )
+        return Response(
+            {
+                "error": "Очередь задач заполнена, повторите запрос позже",
+                "pending_tasks": error.queue_length,
+                "queue_limit": error.limit,
+                "queue_position": position,
+            },
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+        )
 
     def list(self, request, *args, **kwargs):
         """Получение списка всех задач с фильтрацией."""
@@ -86,5 +132,63 @@ class DefaultMethodsMixin(viewsets.ModelViewSet):
         if instance.image_after:
             data["image_after_url"] = request.build_absolute_uri(instance.image_after.url)
 
+        if instance.status == DICAnalysis.Status.PENDING:
+            data["queue_position"] = queue_position(instance)
+
+        return Response(data)
+
+    @action(detail=True, methods=["post"])
+    def cancel(self, request, pk=None):
+        """Отмена ожидающей или выполняемой задачи."""
+        instance = self.get_object()
+
+        cancelled = DICAnalysis.objects.filter(
+            id=instance.id,
+            status__in=[DICAnalysis.Status.PENDING, DICAnalysis.Status.PROCESSING],
+        ).update(status=DICAnalysis.Status.CANCELLED)
+
+        if not cancelled:
+            return Response({"error": "Задача уже завершена"}, status=status.HTTP_400_BAD_REQUEST)
+
+        instance.refresh_from_db()
+        serializer = DICAnalysisSerializer(instance, context={"request": request})
+        return Response(serializer.data)
+
+    @action(detail=True, methods=["post"], parser_classes=[JSONParser, MultiPartParser, FormParser])
+    def points(self, request, pk=None):
+        """Смещения в заданных точках {"points": [[x, y], ...]} без расчета всей сетки."""
+        instance = self.get_object()
+
+        serializer = DICPointsQuerySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            result = HelpMethods()._query_points(instance, serializer.validated_data["points"])
+        except (OSError, ValueError) as e:
+            logging.getLogger(__name__).warning("Запрос точек задачи %s не выполнен: %s", instance.id, e)
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        result["id"] = str(instance.id)
+        return Response(result)
+
+    @action(detail=True, methods=["get"])
+    def progress(self, request, pk=None):
+        """Прогресс расчета: стадия, решено точек, всего точек, оценка оставшегося времени."""
+        data = read_progress(pk)
+        if data is None:
+            data = progress_from_instance(self.get_object())
         return Response(data)
 
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="progress/stream",
+        renderer_classes=[EventStreamRenderer, JSONRenderer],
+    )
+    def progress_stream(self, request, pk=None):
+        """Поток прогресса расчета (server-sent events), завершается с окончанием задачи."""
+        instance = self.get_object()
+        response = StreamingHttpResponse(progress_events(str(instance.id)), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
@@ -1,73 +1,236 @@
 import logging
+import time
 
+from django.conf import settings
+
+from dic_algoritm.dic_algorithm import FieldCheckpoint, ReferenceCache
+from .progress import ProgressReporter
+from .result_cache import ResultCache
 from .sync_processor import SyncDICProcessor
 from ..models import DICAnalysis
 
 
+RESULTS_DIR = "media/results"
+
+# Кэш эталонов общий для всех задач процесса
+reference_cache = ReferenceCache(
+    max_memory_mb=settings.DIC_REFERENCE_CACHE_MEMORY_MB,
+    cache_dir=settings.DIC_REFERENCE_CACHE_DIR,
+    max_disk_mb=settings.DIC_REFERENCE_CACHE_MAX_MB,
+)
+
+
+class AnalysisCancelToken:
+    """
+    Токен отмены задачи: задача отменена, если в базе у нее статус CANCELLED.
+    База опрашивается не чаще одного раза в interval секунд.
+    """
+
+    def __init__(self, task_id, interval=0.5):
+        self.task_id = task_id
+        self.interval = interval
+        self._checked_at = 0.0
+        self._cancelled = False
+
+    def is_set(self):
+        now = time.monotonic()
+        if not self._cancelled and now - self._checked_at >= self.interval:
+            self._checked_at = now
+            self._cancelled = DICAnalysis.objects.filter(id=self.task_id, status=DICAnalysis.Status.CANCELLED).exists()
+        return self._cancelled
+
+
 class HelpMethods:
     """Класс с вспомогательными методами для бизнес логики."""
 
-    def _process_dic_task(self, task_id, img1_path, img2_path, subset_size, step, max_iter, min_correlation):
+    def _process_dic_task(self, task_id, img1_path, img2_path, subset_size, step, max_iter, min_correlation, roi_mask_path=None, roi_polygon=None, auto_parameters=False, cache_key=None, worker_id=None):
         """
-        Вспомогательный метод для обработки задачи в отдельном потоке.
+        Обработка задачи, захваченной обработчиком очереди worker_id (статус PROCESSING).
+        Задача, отмененная во время расчета, останавливается по токену отмены.
+        Если задачу тем временем забрал другой обработчик, результат отбрасывается.
+        Завершенный результат сохраняется в кэш под ключом cache_key.
+        Прогресс и стадия расчета публикуются в кэш проекта (ProgressReporter).
         """
-        try:
-            processor = SyncDICProcessor(results_dir="media/results")
-
-            results = processor.process_test_from_files(
-                test_id=task_id,
-                img1_path=img1_path,
-                img2_path=img2_path,
-                subset_size=subset_size,
-                step=step,
-                max_iter=max_iter,
+        processor = SyncDICProcessor(results_dir=RESULTS_DIR, reference_cache=reference_cache)
+        reporter = ProgressReporter(task_id)
+
+        results = processor.process_test_from_files(
+            test_id=task_id,
+            img1_path=img1_path,
+            img2_path=img2_path,
+            subset_size=subset_size,
+            step=step,
+            max_iter=max_iter,
+            n_workers=settings.MAX_WORKERS,
+            memory_budget_mb=settings.DIC_MEMORY_BUDGET_MB,
+            roi_mask_path=roi_mask_path,
+            roi_polygon=roi_polygon,
+            auto_parameters=auto_parameters,
+            progress_callback=reporter.update,
+            stage_callback=reporter.stage,
+            cancel_token=AnalysisCancelToken(task_id),
+            precision=settings.DIC_PRECISION,
+            checkpoint_seconds=settings.DIC_CHECKPOINT_SECONDS,
+        )
+
+        if not self._update_task_results(task_id, results, worker_id):
+            logging.getLogger(__name__).warning(
+                "Задача %s передана другому обработчику, результат обработчика %s отброшен", task_id, worker_id
             )
+            return
+        if results["status"] == "error":
+            self._clear_checkpoint(task_id)
+        reporter.finish(results["status"])
+
+        if cache_key and results["status"] == "completed":
+            try:
+                self._result_cache().put(cache_key, results)
+            except Exception:
+                logging.getLogger(__name__).exception("Ошибка записи результата %s в кэш", task_id)
+
+    def _clear_checkpoint(self, task_id):
+        """
+        Удаление контрольной точки задачи, завершенной с ошибкой: повторного расчета не будет.
+        """
+        processor = SyncDICProcessor(results_dir=RESULTS_DIR, reference_cache=reference_cache)
+        FieldCheckpoint(processor.checkpoint_path(task_id)).clear()
+
+    def _clear_work_dir(self, task_id):
+        """
+        Удаление memmap-файлов задачи, оставшихся от убитого обработчика.
+        """
+        SyncDICProcessor(results_dir=RESULTS_DIR, reference_cache=reference_cache).clear_work_dir(task_id)
+
+    def _result_cache(self):
+        """
+        Кэш результатов по настройкам проекта.
+        """
+        return ResultCache(settings.DIC_RESULT_CACHE_DIR, settings.DIC_RESULT_CACHE_MAX_MB)
 
-            self._update_task_results(task_id, results)
+    def _cache_key(self, dic_analysis):
+        """
+        Ключ кэша задачи по содержимому изображений и параметрам; None, если файлы недоступны.
+        """
+        return self._make_cache_key(
+            dic_analysis,
+            dic_analysis.image_before.path,
+            dic_analysis.image_after.path,
+            dic_analysis.roi_mask.path if dic_analysis.roi_mask else None,
+        )
+
+    def _upload_cache_key(self, validated_data):
+        """
+        Ключ кэша по загруженным файлам до сохранения задачи; совпадает с _cache_key
+        сохраненной задачи. Параметры, не переданные в запросе, берутся по умолчанию модели.
+        """
+        files = ("image_before", "image_after", "roi_mask")
+        dic_analysis = DICAnalysis(**{name: value for name, value in validated_data.items() if name not in files})
+        return self._make_cache_key(
+            dic_analysis, validated_data["image_before"], validated_data["image_after"], validated_data.get("roi_mask")
+        )
+
+    def _make_cache_key(self, dic_analysis, img1, img2, roi_mask):
+        parameters = {
+            "subset_size": dic_analysis.subset_size,
+            "step": dic_analysis.step,
+            "max_iter": dic_analysis.max_iter,
+            "min_correlation": dic_analysis.min_correlation,
+            "roi_polygon": dic_analysis.roi_polygon,
+            "auto_parameters": dic_analysis.auto_parameters,
+            "precision": settings.DIC_PRECISION,
+        }
+        try:
+            return self._result_cache().make_key(img1, img2, parameters, roi_mask)
+        except OSError as e:
+            logging.getLogger(__name__).warning("Ключ кэша для задачи %s не вычислен: %s", dic_analysis.id, e)
+            return None
 
-        except Exception:
-            import traceback
+    def _complete_from_cache(self, dic_analysis, cache_key):
+        """
+        Завершение задачи из кэша результатов. Возвращает True при попадании.
+        При промахе задача не меняется.
+        """
+        from django.utils import timezone
+
+        if not cache_key:
+            return False
+
+        task_id = str(dic_analysis.id)
+        results = self._result_cache().get(cache_key, task_id, RESULTS_DIR)
+        if results is None:
+            return False
 
-            traceback.print_exc()
+        DICAnalysis.objects.filter(id=task_id).update(status=DICAnalysis.Status.PROCESSING, started_at=timezone.now())
+        self._update_task_results(task_id, results)
+        return True
 
-    def _update_task_results(self, task_id, results):
+    def _query_points(self, dic_analysis, points):
+        """
+        Смещения в заданных точках по изображениям задачи.
+        Параметры берутся из результата задачи (с учетом автоподбора), иначе из самой задачи,
+        чтобы ключ кэша эталонов совпал с ключом полного анализа.
+        """
+        parameters = (dic_analysis.result_json or {}).get("parameters", {})
+        processor = SyncDICProcessor(results_dir=RESULTS_DIR, reference_cache=reference_cache)
+
+        return processor.process_points(
+            dic_analysis.image_before.path,
+            dic_analysis.image_after.path,
+            points,
+            subset_size=parameters.get("subset_size", dic_analysis.subset_size),
+            step=parameters.get("step", dic_analysis.step),
+            max_iter=parameters.get("max_iter", dic_analysis.max_iter),
+            precision=settings.DIC_PRECISION,
+            memory_budget_mb=settings.DIC_MEMORY_BUDGET_MB,
+        )
+
+    def _update_task_results(self, task_id, results, worker_id=None):
         """
         Обновление результатов задачи в базе данных.
+        При заданном worker_id запись условная: если задача за это время перешла к другому
+        обработчику (requeue_stale), строка не обновляется и возвращается False.
         """
         from django.utils import timezone
 
         try:
-            dic_analysis = DICAnalysis.objects.get(id=task_id)
+            tasks = DICAnalysis.objects.filter(id=task_id)
+            if worker_id is not None:
+                tasks = tasks.filter(worker_id=worker_id)
+
+            if results["status"] == "cancelled":
+                return bool(tasks.update(status=DICAnalysis.Status.CANCELLED, updated_at=timezone.now()))
 
+            fields = {}
             if results["status"] == "completed":
-                dic_analysis.status = DICAnalysis.Status.COMPLETED
+                fields["status"] = DICAnalysis.Status.COMPLETED
+                fields["progress"] = 100
 
                 if "image_paths" in results:
                     image_paths = results["image_paths"]
-                    dic_analysis.original_image_path = image_paths.get("original_image", "")
-                    dic_analysis.deformed_image_path = image_paths.get("deformed_image", "")
-                    dic_analysis.displacement_map_path = image_paths.get("displacement_map", "")
+                    fields["original_image_path"] = image_paths.get("original_image", "")
+                    fields["deformed_image_path"] = image_paths.get("deformed_image", "")
+                    fields["displacement_map_path"] = image_paths.get("displacement_map", "")
 
                 if "statistics" in results:
                     stats = results["statistics"]
-                    dic_analysis.mean_displacement = stats.get("mean_displacement", 0)
-                    dic_analysis.max_displacement = stats.get("max_displacement", 0)
-                    dic_analysis.median_displacement = stats.get("median_displacement", 0)
-                    dic_analysis.std_displacement = stats.get("std_displacement", 0)
-                    dic_analysis.correlation_quality = stats.get("correlation_quality", 0)
-                    dic_analysis.reliable_points_percentage = stats.get("reliable_points_percentage", 0)
-                    dic_analysis.processing_time = stats.get("processing_time_seconds", 0)
+                    fields["mean_displacement"] = stats.get("mean_displacement", 0)
+                    fields["max_displacement"] = stats.get("max_displacement", 0)
+                    fields["median_displacement"] = stats.get("median_displacement", 0)
+                    fields["std_displacement"] = stats.get("std_displacement", 0)
+                    fields["correlation_quality"] = stats.get("correlation_quality", 0)
+                    fields["reliable_points_percentage"] = stats.get("reliable_points_percentage", 0)
+                    fields["processing_time"] = stats.get("processing_time_seconds", 0)
 
-                dic_analysis.result_json = results
+                fields["result_json"] = results
 
             else:
-                dic_analysis.status = DICAnalysis.Status.ERROR
-                dic_analysis.error_message = results.get("error", "Неизвестная ошибка")
+                fields["status"] = DICAnalysis.Status.ERROR
+                fields["error_message"] = results.get("error", "Неизвестная ошибка")
 
-            dic_analysis.completed_at = timezone.now()
-            dic_analysis.save()
+            now = timezone.now()
+            return bool(tasks.update(completed_at=now, updated_at=now, **fields))
 
         except Exception as e:
             logger = logging.getLogger(__name__)
             logger.exception("Ошибка при обновлении задачи %s: %s", task_id, e)
-    
\ No newline at end of file
+            return False
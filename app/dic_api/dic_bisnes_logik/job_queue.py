@@ -0,0 +1,418 @@
+"""
+Очередь задач DIC в базе данных по полю DICAnalysis.status.
+Задачи забирают обработчики manage.py dic_worker: строка блокируется при захвате,
+обработчик периодически обновляет heartbeat_at, а задачи обработчиков без сигнала
+возвращаются в очередь до исчерпания попыток.
+
+Порядок выбора задач: сначала класс приоритета (interactive, batch, background),
+внутри класса - пользователь с наименьшим числом выполняемых задач (справедливая доля),
+у пользователя - задача с наименьшей оценкой трудоемкости (кратчайшая задача первой).
+Анонимные задачи учитываются в лимите и справедливой доле по клиенту (client_key),
+а не одной общей группой. Кроме лимита на владельца действует общий лимит очереди.
+"""
+
+import hashlib
+import logging
+import os
+import signal
+import socket
+import threading
+import traceback
+from collections import defaultdict, deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from PIL import Image
+
+from ..models import DICAnalysis
+
+logger = logging.getLogger(__name__)
+
+# Число кандидатов, перебираемых при захвате, если первые заняты другими обработчиками
+CLAIM_CANDIDATES = 10
+PRIORITY_ORDER = (
+    DICAnalysis.Priority.INTERACTIVE,
+    DICAnalysis.Priority.BATCH,
+    DICAnalysis.Priority.BACKGROUND,
+)
+
+
+class QueueFull(Exception):
+    """Очередь ожидающих задач заполнена."""
+
+    def __init__(self, queue_length: int, limit: int):
+        super().__init__(f"Очередь задач заполнена: {queue_length} ожидающих (лимит {limit})")
+        self.queue_length = queue_length
+        self.limit = limit
+
+
+def client_key(request):
+    """
+    Ключ анонимного клиента: хеш ключа сессии, а без сессии - IP-адреса клиента
+    (см. client_address). Для аутентифицированного пользователя - None
+    (задачи учитываются по пользователю).
+    """
+    if request.user.is_authenticated:
+        return None
+
+    session = getattr(request, "session", None)
+    source = f"session:{session.session_key}" if session is not None and session.session_key else None
+    if source is None:
+        source = f"ip:{client_address(request)}"
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def client_address(request) -> str:
+    """
+    IP-адрес клиента. За доверенным прокси (DIC_TRUSTED_PROXIES) REMOTE_ADDR - адрес
+    прокси, поэтому берется последний адрес X-Forwarded-For: его дописал сам прокси,
+    а адреса левее мог подставить клиент. Заголовок от остальных источников не учитывается.
+    """
+    remote = request.META.get("REMOTE_ADDR", "")
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    if forwarded and remote in _trusted_proxy_addresses():
+        return forwarded.split(",")[-1].strip()
+    return remote
+
+
+def _trusted_proxy_addresses() -> set:
+    addresses = set()
+    for host in settings.DIC_TRUSTED_PROXIES:
+        try:
+            addresses.update(socket.gethostbyname_ex(host)[2])
+        except OSError:
+            continue
+    return addresses
+
+
+def _owner(user_id, client):
+    """
+    Владелец задачи для лимита и справедливой доли: пользователь или анонимный клиент.
+    """
+    return user_id if user_id is not None else ("anonymous", client)
+
+
+def check_admission(user=None, client=None) -> None:
+    """
+    QueueFull, если у пользователя (у анонимного клиента client) уже DIC_QUEUE_LIMIT
+    ожидающих задач или во всей очереди - DIC_QUEUE_GLOBAL_LIMIT. Лимит на пользователя:
+    пакет одного пользователя не закрывает очередь для остальных; общий лимит ограничивает
+    очередь при многих клиентах.
+    """
+    queued = DICAnalysis.objects.filter(status=DICAnalysis.Status.PENDING)
+    pending = queued.filter(user=user)
+    if user is None:
+        pending = pending.filter(client_key=client)
+    pending = pending.count()
+    if pending >= settings.DIC_QUEUE_LIMIT:
+        raise QueueFull(pending, settings.DIC_QUEUE_LIMIT)
+
+    total = queued.count()
+    if total >= settings.DIC_QUEUE_GLOBAL_LIMIT:
+        raise QueueFull(total, settings.DIC_QUEUE_GLOBAL_LIMIT)
+
+
+def estimate_cost(dic_analysis):
+    """
+    Оценка трудоемкости задачи: число узлов сетки на площадь подрегиона.
+    Размер изображения читается из заголовка файла; None, если файл недоступен.
+    """
+    return estimate_image_cost(dic_analysis.image_before.path, dic_analysis.subset_size, dic_analysis.step)
+
+
+def estimate_image_cost(image_file, subset_size: int, step: int):
+    """
+    Оценка трудоемкости по изображению (путь или файловый объект) и параметрам сетки.
+    """
+    try:
+        with Image.open(image_file) as image:
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        return None
+    finally:
+        if hasattr(image_file, "seek"):
+            image_file.seek(0)
+
+    step = max(step, 1)
+    nx = max((width - subset_size) // step + 1, 1)
+    ny = max((height - subset_size) // step + 1, 1)
+    return float(nx * ny * subset_size * subset_size)
+
+
+def schedule(pending, running_by_user) -> list:
+    """
+    Порядок запуска ожидающих задач (список словарей с полями id, user_id, priority,
+    estimated_cost, created_at) при running_by_user выполняемых задачах у пользователей.
+    Внутри класса задачи раздаются пользователям по очереди, начиная с наименее загруженного.
+    user_id - любой хешируемый ключ владельца (см. _owner).
+    """
+    def shortest_first(job):
+        cost = job["estimated_cost"]
+        return (cost is None, cost or 0.0, job["created_at"], str(job["id"]))
+
+    load = defaultdict(int, running_by_user)
+    order = []
+    for priority in PRIORITY_ORDER:
+        queues = defaultdict(deque)
+        for job in sorted((job for job in pending if job["priority"] == priority), key=shortest_first):
+            queues[job["user_id"]].append(job)
+
+        while queues:
+            user_id = min(queues, key=lambda user: (load[user], shortest_first(queues[user][0])))
+            order.append(queues[user_id].popleft())
+            load[user_id] += 1
+            if not queues[user_id]:
+                del queues[user_id]
+    return order
+
+
+def _scheduled_ids(candidate=None) -> list:
+    pending = list(
+        DICAnalysis.objects.filter(status=DICAnalysis.Status.PENDING).values(
+            "id", "user_id", "client_key", "priority", "estimated_cost", "created_at"
+        )
+    )
+    for job in pending:
+        job["user_id"] = _owner(job["user_id"], job.pop("client_key"))
+    if candidate is not None:
+        pending.append(candidate)
+
+    running = (
+        DICAnalysis.objects.filter(status=DICAnalysis.Status.PROCESSING)
+        .values("user_id", "client_key")
+        .annotate(count=Count("id"))
+    )
+    running_by_user = defaultdict(int)
+    for row in running:
+        running_by_user[_owner(row["user_id"], row["client_key"])] += row["count"]
+    return [job["id"] for job in schedule(pending, running_by_user)]
+
+
+def queue_position(dic_analysis):
+    """
+    Позиция задачи в очереди: 0 - выполняется, 1.. - ожидает, None - задача не в очереди.
+    Позиция считается по текущему порядку планировщика и может меняться с поступлением задач.
+    """
+    if dic_analysis.status == DICAnalysis.Status.PROCESSING:
+        return 0
+    if dic_analysis.status != DICAnalysis.Status.PENDING:
+        return None
+
+    scheduled = _scheduled_ids()
+    return scheduled.index(dic_analysis.id) + 1 if dic_analysis.id in scheduled else None
+
+
+def prospective_position(user=None, client=None, priority=DICAnalysis.Priority.INTERACTIVE, estimated_cost=None) -> int:
+    """
+    Позиция, которую заняла бы новая задача при текущем порядке планировщика
+    (например, для ответа об отказе в приеме).
+    """
+    candidate = {
+        "id": None,
+        "user_id": _owner(user.pk if user is not None else None, client),
+        "priority": priority,
+        "estimated_cost": estimated_cost,
+        "created_at": timezone.now(),
+    }
+    return _scheduled_ids(candidate).index(None) + 1
+
+
+def claim_next(worker_id: str):
+    """
+    Захват следующей по порядку планировщика задачи. Возвращает DICAnalysis или None.
+    На PostgreSQL строка блокируется через SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+    обработчики не ждут друг друга; на SQLite захват - условный UPDATE по статусу PENDING.
+    """
+    skip_locked = connection.features.has_select_for_update_skip_locked
+
+    for candidate in _scheduled_ids()[:CLAIM_CANDIDATES]:
+        if skip_locked:
+            with transaction.atomic():
+                locked = list(
+                    DICAnalysis.objects.select_for_update(skip_locked=True)
+                    .filter(id=candidate, status=DICAnalysis.Status.PENDING)
+                    .values_list("id", flat=True)
+                )
+                claimed = bool(locked) and _mark_claimed(candidate, worker_id)
+        else:
+            claimed = _mark_claimed(candidate, worker_id)
+
+        if claimed:
+            return DICAnalysis.objects.get(id=candidate)
+    return None
+
+
+def _mark_claimed(task_id, worker_id: str) -> bool:
+    now = timezone.now()
+    claimed = DICAnalysis.objects.filter(id=task_id, status=DICAnalysis.Status.PENDING).update(
+        status=DICAnalysis.Status.PROCESSING,
+        worker_id=worker_id,
+        started_at=now,
+        heartbeat_at=now,
+        attempts=F("attempts") + 1,
+        progress=0,
+    )
+    return bool(claimed)
+
+
+def heartbeat(task_id, worker_id: str) -> bool:
+    """
+    Сигнал обработчика о том, что задача еще выполняется. False, если задача больше не его.
+    """
+    updated = DICAnalysis.objects.filter(
+        id=task_id, worker_id=worker_id, status=DICAnalysis.Status.PROCESSING
+    ).update(heartbeat_at=timezone.now())
+    return bool(updated)
+
+
+def requeue_stale(timeout_seconds: float, max_attempts: int) -> int:
+    """
+    Возврат в очередь задач, обработчик которых не подавал сигнал дольше timeout_seconds
+    (процесс убит, OOM, перезапуск контейнера). Задачи, исчерпавшие max_attempts попыток,
+    помечаются ошибкой, их контрольные точки удаляются. Memmap-файлы расчета вне памяти
+    удаляются у всех таких задач. Возвращает число возвращенных задач.
+    """
+    from .help_methods import HelpMethods
+
+    cutoff = timezone.now() - timedelta(seconds=timeout_seconds)
+    stale = DICAnalysis.objects.filter(status=DICAnalysis.Status.PROCESSING, heartbeat_at__lt=cutoff)
+
+    failed = 0
+    for task_id in list(stale.filter(attempts__gte=max_attempts).values_list("id", flat=True)):
+        updated = stale.filter(id=task_id).update(
+            status=DICAnalysis.Status.ERROR,
+            error_message=f"Обработчик задачи не отвечает, попыток: {max_attempts}",
+            completed_at=timezone.now(),
+        )
+        if updated:
+            HelpMethods()._clear_checkpoint(str(task_id))
+            HelpMethods()._clear_work_dir(str(task_id))
+            failed += 1
+
+    requeued = 0
+    for task_id in list(stale.filter(attempts__lt=max_attempts).values_list("id", flat=True)):
+        # До возврата в очередь: после него каталог может занять новый обработчик
+        HelpMethods()._clear_work_dir(str(task_id))
+        requeued += stale.filter(id=task_id).update(
+            status=DICAnalysis.Status.PENDING, worker_id=None, heartbeat_at=None, progress=0
+        )
+
+    if failed:
+        logger.error("Задач без ответа обработчика помечено ошибкой: %s", failed)
+    if requeued:
+        logger.warning("Задач без ответа обработчика возвращено в очередь: %s", requeued)
+    return requeued
+
+
+class Heartbeat:
+    """
+    Фоновый поток, обновляющий heartbeat_at задачи раз в interval секунд, пока она выполняется.
+    """
+
+    def __init__(self, task_id, worker_id: str, interval: float):
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{task_id}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    heartbeat(self.task_id, self.worker_id)
+                except Exception:
+                    logger.exception("Ошибка сигнала обработчика для задачи %s", self.task_id)
+        finally:
+            connection.close()
+
+
+class Worker:
+    """
+    Обработчик очереди: возвращает зависшие задачи, захватывает следующую и выполняет ее.
+    Несколько обработчиков (процессов или контейнеров) работают с одной базой независимо.
+    По SIGTERM/SIGINT обработчик завершает текущую задачу и останавливается.
+    """
+
+    def __init__(self, worker_id: str = None, poll_interval: float = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = settings.DIC_WORKER_POLL_SECONDS if poll_interval is None else poll_interval
+        self._stopping = threading.Event()
+
+    def stop(self, *args) -> None:
+        self._stopping.set()
+
+    def run(self, once: bool = False) -> None:
+        """
+        Цикл обработки; при once=True - не более одной задачи.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        logger.info("Обработчик %s запущен", self.worker_id)
+        while not self._stopping.is_set():
+            requeue_stale(settings.DIC_HEARTBEAT_TIMEOUT_SECONDS, settings.DIC_MAX_ATTEMPTS)
+
+            dic_analysis = claim_next(self.worker_id)
+            if dic_analysis is not None:
+                self.process(dic_analysis)
+            if once:
+                break
+            if dic_analysis is None:
+                self._stopping.wait(self.poll_interval)
+        logger.info("Обработчик %s остановлен", self.worker_id)
+
+    def process(self, dic_analysis) -> None:
+        """
+        Выполнение захваченной задачи под сигналом обработчика.
+        """
+        from .help_methods import HelpMethods
+
+        task_id = str(dic_analysis.id)
+        logger.info("Обработчик %s: задача %s, попытка %s", self.worker_id, task_id, dic_analysis.attempts)
+        help_methods = HelpMethods()
+
+        with Heartbeat(task_id, self.worker_id, settings.DIC_HEARTBEAT_SECONDS):
+            try:
+                help_methods._process_dic_task(
+                    task_id,
+                    dic_analysis.image_before.path,
+                    dic_analysis.image_after.path,
+                    dic_analysis.subset_size,
+                    dic_analysis.step,
+                    dic_analysis.max_iter,
+                    dic_analysis.min_correlation,
+                    dic_analysis.roi_mask.path if dic_analysis.roi_mask else None,
+                    dic_analysis.roi_polygon,
+                    dic_analysis.auto_parameters,
+                    help_methods._cache_key(dic_analysis),
+                    worker_id=self.worker_id,
+                )
+            except Exception as e:
+                from .progress import clear_progress
+
+                logger.exception("Задача %s завершилась с ошибкой", task_id)
+                clear_progress(task_id)
+                failed = DICAnalysis.objects.filter(
+                    id=task_id, worker_id=self.worker_id, status=DICAnalysis.Status.PROCESSING
+                ).update(
+                    status=DICAnalysis.Status.ERROR,
+                    error_message=str(e),
+                    error_traceback=traceback.format_exc(),
+                    completed_at=timezone.now(),
+                )
+                if failed:
+                    help_methods._clear_checkpoint(task_id)
+
@@ -0,0 +1,200 @@
+"""
+Прогресс задач DIC в кэше проекта (settings.CACHES, django-redis): стадия, решенные точки,
+всего точек и оценка оставшегося времени. Обработчик публикует прогресс с ограниченной частотой,
+API читает его одним запросом к кэшу без обращения к базе.
+"""
+
+import datetime
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+
+from ..models import DICAnalysis
+from .job_queue import queue_position
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = (DICAnalysis.Status.COMPLETED, DICAnalysis.Status.ERROR, DICAnalysis.Status.CANCELLED)
+STREAM_PING_SECONDS = 15
+
+
+def progress_key(task_id) -> str:
+    return f"dic:progress:{task_id}"
+
+
+def read_progress(task_id):
+    """
+    Прогресс задачи из кэша или None, если записи нет, кэш недоступен или запись
+    выполняемой задачи не обновлялась дольше DIC_HEARTBEAT_TIMEOUT_SECONDS (обработчик завершился аварийно).
+    """
+    try:
+        data = cache.get(progress_key(task_id))
+    except Exception as e:
+        logger.warning("Прогресс задачи %s не прочитан из кэша: %s", task_id, e)
+        return None
+
+    if data is None:
+        return None
+
+    if data["status"] == DICAnalysis.Status.PROCESSING:
+        age = timezone.now() - datetime.datetime.fromisoformat(data["updated_at"])
+        if age.total_seconds() > settings.DIC_HEARTBEAT_TIMEOUT_SECONDS:
+            return None
+    return data
+
+
+def clear_progress(task_id) -> None:
+    try:
+        cache.delete(progress_key(task_id))
+    except Exception as e:
+        logger.warning("Прогресс задачи %s не удален из кэша: %s", task_id, e)
+
+
+def progress_from_instance(dic_analysis) -> dict:
+    """
+    Прогресс по строке задачи в базе (если в кэше записи нет).
+    """
+    return {
+        "id": str(dic_analysis.id),
+        "status": dic_analysis.status,
+        "stage": dic_analysis.status if dic_analysis.status in FINAL_STATUSES else None,
+        "done": None,
+        "total": None,
+        "percent": dic_analysis.progress,
+        "eta_seconds": None,
+        "queue_position": queue_position(dic_analysis),
+        "updated_at": dic_analysis.updated_at.isoformat(),
+    }
+
+
+class ProgressReporter:
+    """
+    Публикация прогресса задачи: в кэш - не чаще interval секунд, в поле progress задачи -
+    не чаще db_interval секунд; смена стадии и завершение публикуются сразу.
+    Оценка оставшегося времени - по скорости решения точек с начала текущей стадии.
+    Ошибки кэша не прерывают расчет.
+    """
+
+    def __init__(self, task_id, interval: float = None, db_interval: float = None):
+        self.task_id = str(task_id)
+        self.interval = settings.DIC_PROGRESS_SECONDS if interval is None else interval
+        self.db_interval = settings.DIC_PROGRESS_DB_SECONDS if db_interval is None else db_interval
+        self.state = {
+            "id": self.task_id,
+            "status": DICAnalysis.Status.PROCESSING,
+            "stage": None,
+            "done": 0,
+            "total": 0,
+            "percent": 0.0,
+            "eta_seconds": None,
+            "queue_position": 0,
+            "updated_at": None,
+        }
+        self._published_at = 0.0
+        self._saved_at = 0.0
+        self._rate_start = None
+
+    def stage(self, name: str) -> None:
+        self.state.update(stage=name, eta_seconds=None)
+        self._rate_start = None
+        self._publish(force=True)
+
+    def update(self, done: int, total: int) -> None:
+        """
+        Колбэк прогресса расчета (обработано точек, всего точек).
+        """
+        now = time.monotonic()
+        if self._rate_start is None or done < self._rate_start[1]:
+            self._rate_start = (now, done)
+
+        started_at, started_done = self._rate_start
+        eta = None
+        if done > started_done:
+            eta = round((total - done) * (now - started_at) / (done - started_done), 1)
+
+        self.state.update(
+            done=int(done),
+            total=int(total),
+            percent=round(100.0 * done / total, 1) if total else 100.0,
+            eta_seconds=eta,
+        )
+        self._publish(force=done >= total)
+
+    def finish(self, status: str) -> None:
+        """
+        Публикация конечного статуса задачи.
+        """
+        self.state.update(status=status, stage=status, eta_seconds=None, queue_position=None)
+        if status == DICAnalysis.Status.COMPLETED:
+            self.state["percent"] = 100.0
+        self._publish(force=True)
+
+    def _publish(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self._published_at >= self.interval:
+            self._published_at = now
+            self.state["updated_at"] = timezone.now().isoformat()
+            try:
+                cache.set(progress_key(self.task_id), dict(self.state), settings.DIC_PROGRESS_TTL_SECONDS)
+            except Exception as e:
+                logger.warning("Прогресс задачи %s не записан в кэш: %s", self.task_id, e)
+
+        if force or now - self._saved_at >= self.db_interval:
+            self._saved_at = now
+            DICAnalysis.objects.filter(id=self.task_id, status=DICAnalysis.Status.PROCESSING).update(
+                progress=self.state["percent"]
+            )
+
+
+def progress_events(task_id, poll_interval: float = None, max_seconds: float = None):
+    """
+    Поток server-sent events: событие progress при каждом изменении прогресса и
+    комментарий-пинг раз в STREAM_PING_SECONDS. Поток завершается на конечном статусе
+    задачи или через max_seconds (EventSource переподключается сам).
+    """
+    poll_interval = settings.DIC_PROGRESS_SECONDS if poll_interval is None else poll_interval
+    max_seconds = settings.DIC_PROGRESS_STREAM_SECONDS if max_seconds is None else max_seconds
+    deadline = time.monotonic() + max_seconds
+    pinged_at = time.monotonic()
+    last = None
+
+    yield f"retry: {int(poll_interval * 2000)}\n\n"
+    while True:
+        data = read_progress(task_id)
+        if data is None:
+            dic_analysis = DICAnalysis.objects.filter(id=task_id).first()
+            if dic_analysis is None:
+                return
+            data = progress_from_instance(dic_analysis)
+
+        now = time.monotonic()
+        if data != last:
+            last = data
+            pinged_at = now
+            yield f"event: progress\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        elif now - pinged_at >= STREAM_PING_SECONDS:
+            pinged_at = now
+            yield ": ping\n\n"
+
+        if data["status"] in FINAL_STATUSES or now >= deadline:
+            return
+        time.sleep(poll_interval)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Рендерер text/event-stream для согласования заголовка Accept потока прогресса;
+    сам поток отдается StreamingHttpResponse, рендерер используется только для ошибок.
+    """
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,181 @@
+"""
+Кэш результатов DIC по содержимому изображений и параметрам анализа.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Версия формата и алгоритма: при изменении расчета старые записи перестают совпадать
+CACHE_VERSION = 1
+HASH_CHUNK_BYTES = 1024 * 1024
+RESULTS_FILE = "results.json"
+
+
+class ResultCache:
+    """
+    Дисковый кэш результатов, адресуемый по содержимому.
+    Ключ - SHA-256 от содержимого обоих изображений, маски области интереса
+    и параметров анализа. Запись - каталог с results.json и изображениями
+    результатов. Общий размер ограничен max_size_mb, при превышении удаляются
+    записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: float):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, img1_path, img2_path, parameters: dict, roi_mask_path=None) -> str:
+        """
+        Ключ кэша по содержимому файлов (пути или файловые объекты, например загруженные
+        файлы еще не сохраненной задачи) и параметрам.
+        """
+        digest = hashlib.sha256()
+        digest.update(f"dic-result-cache-v{CACHE_VERSION}".encode())
+
+        for path in (img1_path, img2_path, roi_mask_path):
+            digest.update(b"\0")
+            if path:
+                digest.update(self._file_hash(path).encode())
+
+        digest.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def contains(self, key: str) -> bool:
+        """
+        Есть ли запись key в кэше (без отметки использования).
+        """
+        return os.path.exists(os.path.join(self.cache_dir, key, RESULTS_FILE))
+
+    def get(self, key: str, test_id: str, results_dir: str):
+        """
+        Результаты из кэша для новой задачи test_id или None.
+        Изображения результатов копируются в results_dir/test_id под именами новой задачи.
+        Если запись удаляется вытеснением во время копирования, скопированное удаляется
+        и возвращается None.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        entry_path = os.path.join(entry_dir, RESULTS_FILE)
+
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        test_dir = os.path.join(results_dir, test_id)
+        Path(test_dir).mkdir(parents=True, exist_ok=True)
+
+        image_paths = {}
+        try:
+            # Отметка использования до копирования: evict удаляет записи с самым старым mtime
+            os.utime(entry_path)
+            for name, filename in cached.get("image_paths", {}).items():
+                target = os.path.join(test_dir, f"{test_id}_{filename}")
+                shutil.copyfile(os.path.join(entry_dir, filename), target)
+                image_paths[name] = target
+        except OSError as e:
+            shutil.rmtree(test_dir, ignore_errors=True)
+            logger.warning("Запись кэша %s недоступна: %s", key, e)
+            return None
+
+        results = dict(cached)
+        results["test_id"] = test_id
+        results["image_paths"] = image_paths
+        results["cache_hit"] = True
+        results["timestamp"] = datetime.datetime.now().isoformat()
+
+        results_path = os.path.join(test_dir, f"{test_id}_results.json")
+        with open(results_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        results["results_json_path"] = results_path
+
+        logger.info("Результат задачи %s взят из кэша %s", test_id, key)
+        return results
+
+    def put(self, key: str, results: dict) -> None:
+        """
+        Сохранение завершенного результата. Запись собирается во временном каталоге
+        и переименовывается целиком, поэтому частично записанные записи не читаются.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            return
+
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+
+        try:
+            test_id = results.get("test_id", "")
+            image_paths = {}
+            for name, path in results.get("image_paths", {}).items():
+                filename = os.path.basename(path)
+                if test_id and filename.startswith(f"{test_id}_"):
+                    filename = filename[len(test_id) + 1 :]
+                shutil.copyfile(path, os.path.join(tmp_dir, filename))
+                image_paths[name] = filename
+
+            cached = {k: v for k, v in results.items() if k not in ("test_id", "results_json_path", "cache_hit")}
+            cached["image_paths"] = image_paths
+            with open(os.path.join(tmp_dir, RESULTS_FILE), "w", encoding="utf-8") as f:
+                json.dump(cached, f, ensure_ascii=False, indent=2)
+
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.exists(entry_dir):
+                logger.warning("Не удалось сохранить результат в кэш %s: %s", key, e)
+            return
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Удаление записей, к которым дольше всего не обращались, пока размер кэша превышает лимит.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                used = os.stat(os.path.join(entry.path, RESULTS_FILE)).st_mtime
+            except OSError:
+                continue
+            entries.append((used, size, entry.path))
+            total += size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info("Запись кэша %s удалена", os.path.basename(path))
+
+    @staticmethod
+    def _file_hash(source) -> str:
+        """
+        SHA-256 содержимого файла (путь или файловый объект), читаемого блоками.
+        Файловый объект читается с начала и возвращается в начало.
+        """
+        digest = hashlib.sha256()
+        if hasattr(source, "read"):
+            source.seek(0)
+            for chunk in iter(lambda: source.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+            source.seek(0)
+            return digest.hexdigest()
+
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
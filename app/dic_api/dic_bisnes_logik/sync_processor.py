@@ -7,50 +7,108 @@ import os
 import logging
 from pathlib import Path
 import json
+import shutil
+import tempfile
 import datetime
-from PIL import Image
+from PIL import Image, ImageDraw
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
-from dic_algoritm.dic_algorithm import DigitalImageCorrelation
+from dic_algoritm.dic_algorithm import DICCancelled, DigitalImageCorrelation, FieldCheckpoint, ReferenceCache
+from dic_algoritm.frame_sequence import list_frames, save_frame, sequence_path, sequence_results
 
 logger = logging.getLogger(__name__)
 
 
+# Оценка памяти обычного режима на пиксель пары изображений (декодирование, float64, предобработка)
+IN_MEMORY_BYTES_PER_PIXEL = 64
+MEMMAP_STRIP_PIXELS = 4_000_000
+# Память на пиксель полосы при записи memmap: строки, среднее по каналам и нормировка во float64
+MEMMAP_STRIP_BYTES_PER_PIXEL = 32
+PREVIEW_MAX_PIXELS = 4_000_000
+# Несжатые строки, которые читаются из файла напрямую: rawmode PIL -> (тип отсчета, число каналов)
+RAW_LAYOUTS = {
+    'L': ('u1', 1),
+    'I;16': ('<u2', 1),
+    'I;16B': ('>u2', 1),
+    'F;32F': ('<f4', 1),
+    'F;32BF': ('>f4', 1),
+    'RGB': ('u1', 3),
+    'BGR': ('u1', 3),
+    'RGBA': ('u1', 4),
+}
+
+
 class SyncDICProcessor:
     """
     Синхронный процессор для DIC анализа.
     """
 
-    def __init__(self, results_dir: str = "sync_results"):
+    def __init__(self, results_dir: str = "sync_results", reference_cache: ReferenceCache = None):
         """
         Инициализация синхронного процессора.
+        reference_cache - кэш эталонов, общий для задач (по умолчанию в памяти процессора).
         """
         self.results_dir = results_dir
+        self.reference_cache = reference_cache if reference_cache is not None else ReferenceCache()
         Path(results_dir).mkdir(parents=True, exist_ok=True)
 
-    def process_test(self, test_id: str, img1: np.ndarray, img2: np.ndarray, subset_size: int = 25, step: int = 12, max_iter: int = 35) -> dict:
+    def process_test(self, test_id: str, img1: np.ndarray, img2: np.ndarray, subset_size: int = 25, step: int = 12, max_iter: int = 35, n_workers: int = 1, memory_budget_mb: float = None, roi_mask: np.ndarray = None, auto_parameters: bool = False, progress_callback=None, cancel_token=None, precision: str = 'float32', checkpoint_seconds: float = None, stage_callback=None) -> dict:
         """
         Синхронная обработка теста.
+        При memory_budget_mb img1 и img2 - предобработанные memmap-изображения,
+        поле считается по тайлам в пределах бюджета памяти.
+        roi_mask - бинарная маска области интереса размером с изображение.
+        auto_parameters - подбор subset_size и step по качеству спекл-картины эталона,
+        выбранные значения записываются в parameters.
+        progress_callback(done, total) и cancel_token (is_set()) передаются алгоритму;
+        при отмене возвращается статус 'cancelled'.
+        precision - тип вычислений и полей смещений ('float32' или 'float64').
+        checkpoint_seconds - период записи контрольной точки тайлового расчета в файл
+        <results_dir>/<test_id>.checkpoint.npz (None - без контрольных точек); повторная
+        обработка теста продолжается с нее, после завершения, отмены или ошибки файл удаляется.
+        stage_callback(stage) вызывается при смене стадии: 'correlation', 'postprocessing', 'saving'.
         """
         test_dir = os.path.join(self.results_dir, test_id)
         Path(test_dir).mkdir(parents=True, exist_ok=True)
 
-        dic = DigitalImageCorrelation(subset_size=subset_size, step=step, max_iter=max_iter)
+        checkpoint = None
+        if checkpoint_seconds is not None:
+            checkpoint = FieldCheckpoint(self.checkpoint_path(test_id), checkpoint_seconds)
+
+        dic = DigitalImageCorrelation(subset_size=subset_size, step=step, max_iter=max_iter, n_workers=n_workers, roi_mask=roi_mask, progress_callback=progress_callback, cancel_token=cancel_token, reference_cache=self.reference_cache, precision=precision, checkpoint=checkpoint)
 
         try:
             start_time = datetime.datetime.now()
 
-            U, V, C, x_coords, y_coords, img1_processed, img2_processed = dic.compute_displacement_field_sequential(img1, img2)
+            speckle_quality = None
+            if auto_parameters:
+                speckle_quality = dic.configure_from_speckle(img1)
+                subset_size, step = dic.subset_size, dic.step
 
-            U_filtered, V_filtered = dic.post_process_displacements(U, V, C, min_correlation=0.4)
+            if stage_callback is not None:
+                stage_callback('correlation')
 
+            if memory_budget_mb is not None:
+                U, V, C, x_coords, y_coords, img1_processed, img2_processed = dic.compute_displacement_field_out_of_core(img1, img2, memory_budget_mb)
+                img1_processed = self._preview(img1_processed)
+                img2_processed = self._preview(img2_processed)
+            else:
+                U, V, C, x_coords, y_coords, img1_processed, img2_processed = dic.compute_displacement_field(img1, img2)
+
+            if stage_callback is not None:
+                stage_callback('postprocessing')
+            U_filtered, V_filtered, validation = dic.post_process_displacements(U, V, C, min_correlation=0.4, return_report=True)
+
+            if stage_callback is not None:
+                stage_callback('saving')
             image_paths = self._save_images_sync(img1_processed, img2_processed, U_filtered, V_filtered, x_coords, y_coords, test_dir, test_id)
 
             magnitude = np.sqrt(U_filtered**2 + V_filtered**2)
             valid_mask = ~np.isnan(magnitude)
             mag_valid = magnitude[valid_mask]
+            C_analysed = C[~np.isnan(U)]
 
             end_time = datetime.datetime.now()
             processing_time = (end_time - start_time).total_seconds()
@@ -64,9 +122,11 @@ class SyncDICProcessor:
                     'max_displacement': float(np.max(mag_valid)) if len(mag_valid) > 0 else 0.0,
                     'median_displacement': float(np.median(mag_valid)) if len(mag_valid) > 0 else 0.0,
                     'std_displacement': float(np.std(mag_valid)) if len(mag_valid) > 0 else 0.0,
-                    'correlation_quality': float(np.mean(C)),
-                    'reliable_points_percentage': float(100 * np.sum(C > 0.5) / C.size),
+                    'correlation_quality': float(np.mean(C_analysed)) if C_analysed.size else 0.0,
+                    'reliable_points_percentage': float(100 * np.sum(C_analysed > 0.5) / C_analysed.size) if C_analysed.size else 0.0,
                     'analysis_points': len(x_coords) * len(y_coords),
+                    'roi_points': int(C_analysed.size),
+                    'validation': validation,
                     'image_shape': img1.shape,
                     'processing_time_seconds': processing_time,
                     'window_size': subset_size,
@@ -76,10 +136,14 @@ class SyncDICProcessor:
                     'subset_size': subset_size,
                     'step': step,
                     'max_iter': max_iter,
-                    'min_correlation': 0.4
+                    'min_correlation': 0.4,
+                    'auto_parameters': auto_parameters,
+                    'precision': precision
                 },
                 'timestamp': datetime.datetime.now().isoformat()
             }
+            if speckle_quality is not None:
+                results['parameters']['speckle_quality'] = speckle_quality
 
             results_path = os.path.join(test_dir, f"{test_id}_results.json")
             with open(results_path, 'w', encoding='utf-8') as f:
@@ -87,8 +151,21 @@ class SyncDICProcessor:
 
             results['results_json_path'] = results_path
 
+            if checkpoint is not None:
+                checkpoint.clear()
+
             return results
 
+        except DICCancelled:
+            logger.info("Тест %s отменен", test_id)
+            if checkpoint is not None:
+                checkpoint.clear()
+            return {
+                'test_id': test_id,
+                'status': 'cancelled',
+                'timestamp': datetime.datetime.now().isoformat()
+            }
+
         except Exception as e:
             error_results = {
                 'test_id': test_id,
@@ -97,16 +174,62 @@ class SyncDICProcessor:
                 'timestamp': datetime.datetime.now().isoformat()
             }
             logger.exception("Ошибка при обработке теста %s: %s", test_id, e)
+            if checkpoint is not None:
+                checkpoint.clear()
             return error_results
 
-    def process_test_from_files(self, test_id: str, img1_path: str, img2_path: str, subset_size: int = 25, step: int = 12, max_iter: int = 35) -> dict:
+    def checkpoint_path(self, test_id: str) -> str:
+        """
+        Путь контрольной точки расчета теста test_id.
+        """
+        return os.path.join(self.results_dir, f"{test_id}.checkpoint.npz")
+
+    def work_dir(self, test_id: str) -> str:
+        """
+        Каталог memmap-файлов теста test_id при расчете вне памяти.
+        """
+        return os.path.join(self.results_dir, f"{test_id}.work")
+
+    def clear_work_dir(self, test_id: str) -> None:
+        """
+        Удаление каталога memmap-файлов теста test_id (после расчета, перед повторным
+        запуском и при возврате задачи в очередь).
+        """
+        shutil.rmtree(self.work_dir(test_id), ignore_errors=True)
+
+    def process_test_from_files(self, test_id: str, img1_path: str, img2_path: str, subset_size: int = 25, step: int = 12, max_iter: int = 35, n_workers: int = 1, memory_budget_mb: float = None, roi_mask_path: str = None, roi_polygon: list = None, auto_parameters: bool = False, progress_callback=None, cancel_token=None, precision: str = 'float32', checkpoint_seconds: float = None, stage_callback=None) -> dict:
         """
         Синхронная обработка теста из файлов.
+        Если обычная загрузка не укладывается в memory_budget_mb, изображения
+        записываются в нормированные memmap-файлы типа precision в work_dir(test_id)
+        и обрабатываются по тайлам.
+        Область интереса задается изображением-маской roi_mask_path и/или полигоном roi_polygon.
+        Перед загрузкой изображений stage_callback получает стадию 'loading'.
         """
         try:
+            if stage_callback is not None:
+                stage_callback('loading')
+
+            if memory_budget_mb is not None and self._estimate_memory_mb(img1_path, img2_path) > memory_budget_mb:
+                # Файлы прерванного запуска (обработчик убит) не переиспользуются
+                work_dir = self.work_dir(test_id)
+                self.clear_work_dir(test_id)
+                Path(work_dir).mkdir(parents=True)
+
+                img1 = img2 = roi_mask = None
+                try:
+                    img1, img2, _ = self._load_images_memmap(img1_path, img2_path, work_dir, test_id, precision, memory_budget_mb)
+                    roi_path = os.path.join(work_dir, f"{test_id}_roi.bool")
+                    roi_mask = self._load_roi_mask(img1.shape, roi_mask_path, roi_polygon, roi_path, memory_budget_mb)
+                    return self.process_test(test_id, img1, img2, subset_size, step, max_iter, n_workers, memory_budget_mb, roi_mask, auto_parameters, progress_callback, cancel_token, precision, checkpoint_seconds, stage_callback)
+                finally:
+                    del img1, img2, roi_mask
+                    self.clear_work_dir(test_id)
+
             img1, img2 = self._load_images_sync(img1_path, img2_path)
+            roi_mask = self._load_roi_mask(img1.shape, roi_mask_path, roi_polygon)
 
-            return self.process_test(test_id, img1, img2, subset_size, step, max_iter)
+            return self.process_test(test_id, img1, img2, subset_size, step, max_iter, n_workers, roi_mask=roi_mask, auto_parameters=auto_parameters, progress_callback=progress_callback, cancel_token=cancel_token, precision=precision, checkpoint_seconds=checkpoint_seconds, stage_callback=stage_callback)
 
         except Exception as e:
             return {
@@ -115,12 +238,308 @@ class SyncDICProcessor:
                 'error': f"Ошибка загрузки изображений: {e}"
             }
 
+    def process_points(self, img1_path: str, img2_path: str, points, subset_size: int = 25, step: int = 12, max_iter: int = 35, precision: str = 'float32', memory_budget_mb: float = None) -> dict:
+        """
+        Смещения только в заданных точках points [[x, y], ...] без расчета сетки.
+        Эталон берется из кэша эталонов, если его уже построил полный анализ
+        с теми же изображением, subset_size, step и precision.
+        Если изображения не укладываются в memory_budget_mb, они записываются в memmap-файлы
+        (как в process_test_from_files) и для каждой точки читается только окно вокруг нее.
+        Непосчитанные точки (у края изображения, без текстуры) возвращаются с null.
+        """
+        start_time = datetime.datetime.now()
+        dic = DigitalImageCorrelation(subset_size=subset_size, step=step, max_iter=max_iter, reference_cache=self.reference_cache, precision=precision)
+
+        if memory_budget_mb is not None and self._estimate_memory_mb(img1_path, img2_path) > memory_budget_mb:
+            Path(self.results_dir).mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=self.results_dir) as work_dir:
+                img1, img2, _ = self._load_images_memmap(img1_path, img2_path, work_dir, 'points', precision, memory_budget_mb)
+                try:
+                    U, V, C = dic.compute_displacement_points_out_of_core(img1, img2, points)
+                finally:
+                    del img1, img2
+        else:
+            img1, img2 = self._load_images_sync(img1_path, img2_path)
+            U, V, C = dic.compute_displacement_points(img1, img2, points)
+
+        def value(field, index):
+            return float(field[index]) if np.isfinite(field[index]) else None
+
+        return {
+            'points': [
+                {'x': float(x), 'y': float(y), 'u': value(U, index), 'v': value(V, index), 'correlation': float(C[index])}
+                for index, (x, y) in enumerate(points)
+            ],
+            'parameters': {
+                'subset_size': dic.subset_size,
+                'step': step,
+                'max_iter': max_iter,
+                'precision': precision
+            },
+            'processing_time_seconds': (datetime.datetime.now() - start_time).total_seconds()
+        }
+
+    def process_sequence(self, test_id: str, frames, subset_size: int = 25, step: int = 12, max_iter: int = 35, reference_mode: str = 'fixed', precision: str = 'float32') -> dict:
+        """
+        Синхронная обработка последовательности кадров.
+        frames - упорядоченный список путей к кадрам или путь к каталогу с кадрами.
+        Результат каждого кадра сразу записывается в {test_id}_frame_XXXX.npz
+        и строкой в {test_id}_sequence.jsonl.
+        """
+        test_dir = os.path.join(self.results_dir, test_id)
+        Path(test_dir).mkdir(parents=True, exist_ok=True)
+
+        dic = DigitalImageCorrelation(subset_size=subset_size, step=step, max_iter=max_iter, reference_cache=self.reference_cache, precision=precision)
+
+        try:
+            start_time = datetime.datetime.now()
+            frame_paths = list_frames(frames)
+
+            images = (self._load_image_sync(path) for path in frame_paths)
+            jsonl_path = sequence_path(test_dir, test_id)
+            frames_summary = []
+
+            with open(jsonl_path, 'w', encoding='utf-8') as sequence_file:
+                for frame in dic.compute_displacement_sequence(images, reference_mode=reference_mode):
+                    summary = save_frame(dic, frame, frame_paths, test_dir, test_id)
+                    sequence_file.write(json.dumps(summary, ensure_ascii=False) + '\n')
+                    sequence_file.flush()
+                    frames_summary.append(summary)
+
+            results = sequence_results(
+                test_id, frames_summary, jsonl_path, start_time,
+                subset_size=subset_size, step=step, max_iter=max_iter, reference_mode=reference_mode, precision=precision,
+            )
+
+            results_path = os.path.join(test_dir, f"{test_id}_results.json")
+            with open(results_path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+            results['results_json_path'] = results_path
+
+            return results
+
+        except Exception as e:
+            error_results = {
+                'test_id': test_id,
+                'status': 'error',
+                'error': str(e),
+                'timestamp': datetime.datetime.now().isoformat()
+            }
+            logger.exception("Ошибка при обработке последовательности %s: %s", test_id, e)
+            return error_results
+
+    def _load_image_sync(self, path: str) -> np.ndarray:
+        """
+        Синхронная загрузка одного кадра в оттенках серого.
+        """
+        with self._open_image(path) as img:
+            img_array = np.array(img)
+        if len(img_array.shape) == 3:
+            img_array = np.mean(img_array, axis=2)
+        return img_array
+
+    def _open_image(self, path: str):
+        """
+        Открытие изображения без декодирования (PIL читает только заголовок).
+        Изображения больше Image.MAX_IMAGE_PIXELS (settings.DIC_MAX_IMAGE_PIXELS) отклоняются.
+        """
+        try:
+            img = Image.open(path)
+        except Image.DecompressionBombError:
+            img = None
+
+        if img is None or (Image.MAX_IMAGE_PIXELS and img.width * img.height > Image.MAX_IMAGE_PIXELS):
+            if img is not None:
+                img.close()
+            raise ValueError(f"Изображение {os.path.basename(path)} больше {Image.MAX_IMAGE_PIXELS} пикселей")
+        return img
+
+    def _estimate_memory_mb(self, img1_path: str, img2_path: str) -> float:
+        """
+        Оценка пиковой памяти обычного режима по размерам изображений из заголовков.
+        """
+        with self._open_image(img1_path) as img1, self._open_image(img2_path) as img2:
+            pixels = min(img1.width, img2.width) * min(img1.height, img2.height)
+        return pixels * IN_MEMORY_BYTES_PER_PIXEL / (1024 * 1024)
+
+    def _load_images_memmap(self, img1_path: str, img2_path: str, work_dir: str, test_id: str, precision: str = 'float32', memory_budget_mb: float = None):
+        """
+        Загрузка изображений в memmap-файлы типа precision с той же предобработкой,
+        что preprocess_image (среднее по каналам, нормировка в [0, 1]).
+        Изображения читаются полосами строк, размер полосы ограничен memory_budget_mb.
+        Несжатые строки (TIFF без сжатия, BMP, PGM/PPM) читаются из файла без декодирования;
+        сжатое изображение декодируется целиком и должно укладываться в memory_budget_mb.
+        """
+        with self._open_image(img1_path) as img1, self._open_image(img2_path) as img2:
+            width = min(img1.width, img2.width)
+            height = min(img1.height, img2.height)
+
+        strip = self._strip_rows(width, memory_budget_mb)
+
+        arrays = []
+        paths = []
+        for name, path in (('before', img1_path), ('after', img2_path)):
+            memmap_path = os.path.join(work_dir, f"{test_id}_{name}.{precision}")
+            array = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.dtype(precision), shape=(height, width))
+            paths.append(memmap_path)
+
+            with self._open_image(path) as img:
+                bands = self._strip_bands(img, memory_budget_mb)
+                low, high = np.inf, -np.inf
+                for top in range(0, height, strip):
+                    rows = self._read_strip(img, bands, top, min(top + strip, height), width)
+                    low = min(low, float(rows.min()))
+                    high = max(high, float(rows.max()))
+
+                for top in range(0, height, strip):
+                    rows = self._read_strip(img, bands, top, min(top + strip, height), width)
+                    array[top:top + len(rows)] = (rows - low) / (high - low + 1e-10)
+                del bands
+
+            array.flush()
+            arrays.append(array)
+
+        return arrays[0], arrays[1], paths
+
+    def _strip_rows(self, width: int, memory_budget_mb: float = None) -> int:
+        """
+        Число строк полосы при чтении изображения ширины width в пределах memory_budget_mb.
+        """
+        strip_pixels = MEMMAP_STRIP_PIXELS
+        if memory_budget_mb is not None:
+            strip_pixels = min(strip_pixels, int(memory_budget_mb * 1024 * 1024 / MEMMAP_STRIP_BYTES_PER_PIXEL))
+        return max(strip_pixels // width, 1)
+
+    def _strip_bands(self, img, memory_budget_mb: float = None):
+        """
+        Несжатые полосы изображения для _read_strip (_raw_bands) или None, если изображение
+        придется декодировать целиком; декодирование больше memory_budget_mb не выполняется.
+        """
+        bands = self._raw_bands(img)
+        if bands is None and memory_budget_mb is not None:
+            decoded_mb = img.width * img.height * len(img.getbands()) * self._band_bytes(img) / (1024 * 1024)
+            if decoded_mb > memory_budget_mb:
+                raise ValueError(
+                    f"Сжатое изображение {os.path.basename(img.filename)} требует {decoded_mb:.0f} МБ при декодировании, "
+                    f"больше бюджета памяти {memory_budget_mb} МБ; сохраните его в TIFF без сжатия"
+                )
+        return bands
+
+    def _raw_bands(self, img):
+        """
+        Несжатые данные изображения как полосы строк [(top, bottom, массив строк)] поверх файла
+        (np.memmap) или None, если данные сжаты или формат строк не из RAW_LAYOUTS.
+        """
+        bands = []
+        for codec, (x0, y0, x1, y1), offset, args in img.tile:
+            args = (args,) if isinstance(args, str) else tuple(args)
+            rawmode = args[0]
+            stride = args[1] if len(args) > 1 else 0
+            orientation = args[2] if len(args) > 2 else 1
+            if codec != 'raw' or rawmode not in RAW_LAYOUTS or x0 != 0 or x1 != img.width or not img.filename:
+                return None
+
+            dtype, channels = RAW_LAYOUTS[rawmode]
+            dtype = np.dtype(dtype)
+            row_bytes = img.width * channels * dtype.itemsize
+            stride = stride or row_bytes
+            data = np.memmap(img.filename, dtype=np.uint8, mode='r', offset=offset, shape=((y1 - y0 - 1) * stride + row_bytes,))
+            rows = np.ndarray(
+                (y1 - y0, img.width, channels), dtype=dtype, buffer=data,
+                strides=(stride, channels * dtype.itemsize, dtype.itemsize),
+            )
+            bands.append((y0, y1, rows[::-1] if orientation < 0 else rows))
+
+        bands.sort(key=lambda band: band[0])
+        covered = 0
+        for top, bottom, _ in bands:
+            if top != covered:
+                return None
+            covered = bottom
+        return bands if covered == img.height else None
+
+    @staticmethod
+    def _band_bytes(img) -> int:
+        """
+        Байт на канал декодированного изображения PIL.
+        """
+        if img.mode.startswith('I;16'):
+            return 2
+        return 4 if img.mode in ('I', 'F') else 1
+
+    def _read_strip(self, img, bands, top: int, bottom: int, width: int) -> np.ndarray:
+        """
+        Полоса строк изображения в оттенках серого: из несжатых полос bands
+        или, если их нет, из декодированного изображения.
+        """
+        if bands is not None:
+            parts = [rows[max(top - y0, 0):bottom - y0, :width] for y0, y1, rows in bands if y0 < bottom and y1 > top]
+            return np.mean(np.concatenate(parts) if len(parts) > 1 else parts[0], axis=2)
+
+        rows = np.array(img.crop((0, top, width, bottom)))
+        if len(rows.shape) == 3:
+            rows = np.mean(rows, axis=2)
+        return rows
+
+    def _load_roi_mask(self, shape, roi_mask_path: str = None, roi_polygon: list = None, memmap_path: str = None, memory_budget_mb: float = None):
+        """
+        Маска области интереса из изображения-маски (ненулевые пиксели) и полигона [[x, y], ...].
+        Маска большего размера обрезается как изображения, иначе масштабируется.
+        Маска строится полосами строк; при memmap_path она записывается в memmap-файл
+        (тайловый режим), и алгоритм читает из нее только узлы сетки.
+        None - анализируется все изображение.
+        """
+        if not roi_mask_path and not roi_polygon:
+            return None
+
+        height, width = shape[:2]
+        if memmap_path is not None:
+            mask = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=bool, shape=(height, width))
+            mask[:] = True
+        else:
+            mask = np.ones((height, width), dtype=bool)
+        strip = self._strip_rows(width, memory_budget_mb)
+
+        if roi_mask_path:
+            with self._open_image(roi_mask_path) as img:
+                bands = self._strip_bands(img, memory_budget_mb)
+                cropped = img.width >= width and img.height >= height
+                # Масштабирование NEAREST: строка/столбец маски для центра пикселя изображения
+                columns = np.arange(width) if cropped else ((np.arange(width) + 0.5) * img.width / width).astype(np.intp)
+                for top in range(0, height, strip):
+                    bottom = min(top + strip, height)
+                    rows = np.arange(top, bottom)
+                    if not cropped:
+                        rows = ((rows + 0.5) * img.height / height).astype(np.intp)
+                    values = self._read_strip(img, bands, int(rows[0]), int(rows[-1]) + 1, img.width)
+                    mask[top:bottom] &= values[rows - rows[0]][:, columns] > 0
+                del bands
+
+        if roi_polygon:
+            for top in range(0, height, strip):
+                bottom = min(top + strip, height)
+                canvas = Image.new('1', (width, bottom - top), 0)
+                ImageDraw.Draw(canvas).polygon([(x, y - top) for x, y in roi_polygon], fill=1)
+                mask[top:bottom] &= np.array(canvas, dtype=bool)
+
+        if memmap_path is not None:
+            mask.flush()
+        return mask
+
+    def _preview(self, img: np.ndarray) -> np.ndarray:
+        """
+        Уменьшенная копия большого изображения для визуализации.
+        """
+        factor = max(int(np.ceil(np.sqrt(img.size / PREVIEW_MAX_PIXELS))), 1)
+        return np.array(img[::factor, ::factor])
+
     def _load_images_sync(self, img1_path: str, img2_path: str):
         """
         Синхронная загрузка изображений.
         """
-        img1 = Image.open(img1_path)
-        img2 = Image.open(img2_path)
+        img1 = self._open_image(img1_path)
+        img2 = self._open_image(img2_path)
 
         img1_array = np.array(img1)
         img2_array = np.array(img2)
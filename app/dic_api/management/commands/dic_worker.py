@@ -0,0 +1,65 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def run_worker_process(worker_id, once):
+    """
+    Точка входа дочернего процесса (процессы запускаются через spawn, Django настраивается заново).
+    """
+    import django
+
+    django.setup()
+    from dic_api.dic_bisnes_logik.job_queue import Worker
+
+    Worker(worker_id).run(once=once)
+
+
+class Command(BaseCommand):
+    help = "Обработчик очереди задач DIC. Можно запускать несколько экземпляров (процессов или контейнеров)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.DIC_WORKER_PROCESSES,
+            help="число процессов обработчика в этом экземпляре",
+        )
+        parser.add_argument("--worker-id", default=None, help="имя обработчика (по умолчанию хост:pid)")
+        parser.add_argument("--once", action="store_true", help="обработать не более одной задачи и завершиться")
+
+    def handle(self, *args, **options):
+        processes = max(options["processes"], 1)
+        worker_id = options["worker_id"]
+
+        if processes == 1:
+            from dic_api.dic_bisnes_logik.job_queue import Worker
+
+            Worker(worker_id).run(once=options["once"])
+            return
+
+        context = multiprocessing.get_context("spawn")
+        children = [
+            context.Process(
+                target=run_worker_process,
+                args=(f"{worker_id}-{index}" if worker_id else None, options["once"]),
+                name=f"dic-worker-{index}",
+            )
+            for index in range(processes)
+        ]
+        for child in children:
+            child.start()
+
+        # SIGTERM передается дочерним процессам: каждый завершает текущую задачу
+        def stop_children(*args):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+
+        signal.signal(signal.SIGTERM, stop_children)
+        signal.signal(signal.SIGINT, stop_children)
+        self.stdout.write(f"Запущено процессов обработчика: {processes}")
+        for child in children:
+            child.join()
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dic_api', '0002_dicanalysis_manufacture_dicanalysis_material_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='roi_mask',
+            field=models.ImageField(blank=True, null=True, upload_to='uploads/roi/', verbose_name='Маска области интереса'),
+        ),
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='roi_polygon',
+            field=models.JSONField(blank=True, null=True, verbose_name='Полигон области интереса'),
+        ),
+    ]
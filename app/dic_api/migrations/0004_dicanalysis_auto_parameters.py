@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dic_api', '0003_dicanalysis_roi_mask_dicanalysis_roi_polygon'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='auto_parameters',
+            field=models.BooleanField(default=False, verbose_name='Автоподбор подрегиона и шага'),
+        ),
+    ]
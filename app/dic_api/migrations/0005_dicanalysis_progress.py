@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dic_api', '0004_dicanalysis_auto_parameters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='progress',
+            field=models.FloatField(default=0, verbose_name='Прогресс, %'),
+        ),
+    ]
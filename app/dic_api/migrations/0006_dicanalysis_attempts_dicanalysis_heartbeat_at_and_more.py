@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dic_api', '0005_dicanalysis_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='attempts',
+            field=models.IntegerField(default=0, verbose_name='Число попыток обработки'),
+        ),
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний сигнал обработчика'),
+        ),
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Обработчик'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dic_api', '0006_dicanalysis_attempts_dicanalysis_heartbeat_at_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='estimated_cost',
+            field=models.FloatField(blank=True, null=True, verbose_name='Оценка трудоемкости'),
+        ),
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='priority',
+            field=models.CharField(choices=[('interactive', 'Интерактивная'), ('batch', 'Пакетная'), ('background', 'Фоновая')], default='interactive', max_length=20, verbose_name='Класс приоритета'),
+        ),
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dic_analyses', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dic_api', '0007_dicanalysis_estimated_cost_dicanalysis_priority_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dicanalysis',
+            name='client_key',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Анонимный клиент'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.conf import settings
 import uuid
 from django.core.validators import MinValueValidator, MaxValueValidator
 
@@ -12,6 +13,11 @@ class DICAnalysis(models.Model):
         COMPLETED = 'completed', 'Завершено'
         ERROR = 'error', 'Ошибка'
         CANCELLED = 'cancelled', 'Отменено'
+
+    class Priority(models.TextChoices):
+        INTERACTIVE = 'interactive', 'Интерактивная'
+        BATCH = 'batch', 'Пакетная'
+        BACKGROUND = 'background', 'Фоновая'
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255, default="DIC Analysis")
@@ -20,6 +26,23 @@ class DICAnalysis(models.Model):
         choices=Status.choices,
         default=Status.PENDING
     )
+    progress = models.FloatField(default=0, verbose_name="Прогресс, %")
+    priority = models.CharField(
+        max_length=20,
+        choices=Priority.choices,
+        default=Priority.INTERACTIVE,
+        verbose_name="Класс приоритета"
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='dic_analyses',
+        verbose_name="Пользователь"
+    )
+    # Анонимные задачи учитываются в очереди по клиенту (хеш сессии или IP-адреса)
+    client_key = models.CharField(max_length=64, null=True, blank=True, verbose_name="Анонимный клиент")
     
     sample_name = models.CharField(max_length=255, blank=True, null=True, verbose_name="Наименование образца")
     material = models.CharField(max_length=255, blank=True, null=True, verbose_name="Материал")
@@ -35,10 +58,15 @@ class DICAnalysis(models.Model):
     step = models.IntegerField(default=12)
     max_iter = models.IntegerField(default=35)
     min_correlation = models.FloatField(default=0.4)
+    auto_parameters = models.BooleanField(default=False, verbose_name="Автоподбор подрегиона и шага")
     
     image_before = models.ImageField(upload_to='uploads/before/')
     image_after = models.ImageField(upload_to='uploads/after/')
     
+    # Область интереса: изображение-маска (ненулевые пиксели) и/или полигон [[x, y], ...]
+    roi_mask = models.ImageField(upload_to='uploads/roi/', blank=True, null=True, verbose_name="Маска области интереса")
+    roi_polygon = models.JSONField(blank=True, null=True, verbose_name="Полигон области интереса")
+    
     result_json = models.JSONField(null=True, blank=True)
     result_image_path = models.CharField(max_length=500, null=True, blank=True)
     original_image_path = models.CharField(max_length=500, null=True, blank=True)
@@ -56,8 +84,15 @@ class DICAnalysis(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
-    processing_time = models.FloatField(null=True, blank=True)  
-    
+    processing_time = models.FloatField(null=True, blank=True)
+
+    # Очередь задач: обработчик, взявший задачу, время его последнего сигнала, число попыток
+    # и оценка трудоемкости для планировщика
+    worker_id = models.CharField(max_length=255, null=True, blank=True, verbose_name="Обработчик")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Последний сигнал обработчика")
+    attempts = models.IntegerField(default=0, verbose_name="Число попыток обработки")
+    estimated_cost = models.FloatField(null=True, blank=True, verbose_name="Оценка трудоемкости")
+
     error_message = models.TextField(null=True, blank=True)
     error_traceback = models.TextField(null=True, blank=True)
     
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import DICAnalysis
 import os
+import json
 
 
 class DICAnalysisCreateSerializer(serializers.ModelSerializer):
@@ -19,7 +20,11 @@ class DICAnalysisCreateSerializer(serializers.ModelSerializer):
             'subset_size',
             'step',
             'max_iter',
-            'min_correlation'
+            'min_correlation',
+            'auto_parameters',
+            'roi_mask',
+            'roi_polygon',
+            'priority'
         ]
     
     def validate_subset_size(self, value):
@@ -30,6 +35,50 @@ class DICAnalysisCreateSerializer(serializers.ModelSerializer):
         elif value > 31:
             value = 31
         return value
+    
+    def validate_roi_polygon(self, value):
+        if value is None:
+            return value
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise serializers.ValidationError("Полигон должен быть JSON-списком вершин [x, y]")
+        if not isinstance(value, list) or len(value) < 3:
+            raise serializers.ValidationError("Полигон должен содержать не менее трех вершин [x, y]")
+        for point in value:
+            if (
+                not isinstance(point, (list, tuple)) or len(point) != 2
+                or not all(isinstance(coord, (int, float)) and not isinstance(coord, bool) for coord in point)
+            ):
+                raise serializers.ValidationError("Вершина полигона должна быть парой чисел [x, y]")
+        return value
+
+
+class DICPointsQuerySerializer(serializers.Serializer):
+    """Сериализатор запроса смещений в заданных точках."""
+
+    MAX_POINTS = 1000
+
+    points = serializers.JSONField()
+
+    def validate_points(self, value):
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise serializers.ValidationError("Точки должны быть JSON-списком пар [x, y]")
+        if not isinstance(value, list) or not value:
+            raise serializers.ValidationError("Нужна хотя бы одна точка [x, y]")
+        if len(value) > self.MAX_POINTS:
+            raise serializers.ValidationError(f"Не более {self.MAX_POINTS} точек за запрос")
+        for point in value:
+            if (
+                not isinstance(point, (list, tuple)) or len(point) != 2
+                or not all(isinstance(coord, (int, float)) and not isinstance(coord, bool) for coord in point)
+            ):
+                raise serializers.ValidationError("Точка должна быть парой чисел [x, y]")
+        return value
 
 
 class DICAnalysisSerializer(serializers.ModelSerializer):
@@ -47,15 +96,17 @@ class DICAnalysisSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = DICAnalysis
-        fields = '__all__'
+        # client_key и worker_id - служебные поля очереди, клиенту не отдаются
+        exclude = ['client_key', 'worker_id']
         read_only_fields = [
-            'id', 'status', 'created_at', 'updated_at', 
+            'id', 'status', 'progress', 'created_at', 'updated_at', 
             'started_at', 'completed_at', 'processing_time',
             'error_message', 'error_traceback', 'result_json',
             'mean_displacement', 'max_displacement', 'median_displacement',
             'std_displacement', 'correlation_quality', 'reliable_points_percentage',
             'result_image_path', 'original_image_path', 'deformed_image_path',
-            'displacement_map_path'
+            'displacement_map_path', 'user', 'priority', 'estimated_cost',
+            'heartbeat_at', 'attempts'
         ]
     
     def get_image_before_url(self, obj):
@@ -1,3 +1,558 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import warnings
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+
+from dic_algoritm.dic_algorithm import DICCancelled, DigitalImageCorrelation, FieldCheckpoint, ReferenceCache
+from dic_algoritm.synthetic import synthetic_pair
+
+from .dic_bisnes_logik.help_methods import HelpMethods
+from .dic_bisnes_logik.job_queue import (
+    QueueFull,
+    check_admission,
+    client_address,
+    prospective_position,
+    queue_position,
+    requeue_stale,
+    schedule,
+)
+from .dic_bisnes_logik.progress import ProgressReporter, read_progress
+from .dic_bisnes_logik.result_cache import ResultCache
+from .dic_bisnes_logik.sync_processor import SyncDICProcessor
+from .models import DICAnalysis
+
+
+def upload(name, value=0):
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((64, 64), value, dtype=np.uint8)).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+def rms_error(dic, reference, deformed, truth):
+    U, V, _, x_coords, y_coords, *_ = dic.compute_displacement_field(reference, deformed)
+    true_u, true_v = truth(x_coords, y_coords)
+    inner = (slice(2, -2), slice(2, -2))
+    error = np.hypot(U[inner] - true_u[inner], V[inner] - true_v[inner]).astype(np.float64)
+    return float(np.sqrt(np.mean(error[np.isfinite(error)] ** 2)))
+
+
+class SolverAccuracyTests(SimpleTestCase):
+    def test_icgn_not_less_accurate_than_lbfgsb(self):
+        reference, deformed, truth = synthetic_pair(160)
+
+        for shape_function in DigitalImageCorrelation.SHAPE_FUNCTIONS:
+            with self.subTest(shape_function=shape_function):
+                errors = {
+                    solver: rms_error(
+                        DigitalImageCorrelation(subset_size=25, step=10, solver=solver, shape_function=shape_function),
+                        reference,
+                        deformed,
+                        truth,
+                    )
+                    for solver in ("lbfgsb", "icgn")
+                }
+                self.assertLessEqual(errors["icgn"], errors["lbfgsb"])
+
+
+class WorkerCountTests(SimpleTestCase):
+    def test_field_does_not_depend_on_worker_count(self):
+        reference, deformed, _ = synthetic_pair(160)
+
+        for options in ({"scan": "reliability"}, {"adaptive_levels": 1}):
+            with self.subTest(**options):
+                sequential, parallel = (
+                    DigitalImageCorrelation(subset_size=21, step=8, tile_size=6, n_workers=n_workers, **options)
+                    .compute_displacement_field(reference, deformed)
+                    for n_workers in (1, 2)
+                )
+                for actual, expected in zip(sequential[:3], parallel[:3]):
+                    np.testing.assert_array_equal(actual, expected)
+
+
+class ReferenceCacheTests(SimpleTestCase):
+    def test_parallel_field_fills_cache(self):
+        reference, deformed, _ = synthetic_pair(120)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ReferenceCache(cache_dir=cache_dir)
+            options = {"subset_size": 21, "step": 8, "tile_size": 6, "solver": "icgn"}
+            parallel = DigitalImageCorrelation(n_workers=2, reference_cache=cache, **options)
+            expected = DigitalImageCorrelation(**options).compute_displacement_field(reference, deformed)
+            actual = parallel.compute_displacement_field(reference, deformed)
+
+            for a, e in zip(actual[:3], expected[:3]):
+                np.testing.assert_array_equal(a, e)
+            self.assertIsNotNone(cache.peek(parallel, reference))
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_memory_limit_evicts_oldest(self):
+        rng = np.random.default_rng(0)
+        dic = DigitalImageCorrelation(subset_size=21, step=8)
+        images = [rng.random((100, 100)) for _ in range(3)]
+        size = ReferenceCache().get(dic, images[0], grid=False).nbytes
+        cache = ReferenceCache(max_memory_mb=2.5 * size / 1024**2)
+
+        for image in images:
+            cache.get(dic, image, grid=False)
+
+        self.assertEqual(len(cache.entries), 2)
+        self.assertIsNone(cache.peek(dic, images[0]))
+        self.assertIsNotNone(cache.peek(dic, images[2]))
+
+
+class InitialGuessTests(SimpleTestCase):
+    def test_search_skips_points_outside_roi(self):
+        reference, deformed, _ = synthetic_pair(160)
+        roi = np.zeros(reference.shape, dtype=bool)
+        roi[60:100, 60:100] = True
+
+        for pyramid_levels in (1, 2):
+            with self.subTest(pyramid_levels=pyramid_levels):
+                dic = DigitalImageCorrelation(subset_size=21, step=8, pyramid_levels=pyramid_levels, roi_mask=roi)
+                img1, img2 = dic.preprocess_image(reference), dic.preprocess_image(deformed)
+                x_coords, y_coords = dic._build_grid(img1)
+                active = dic._roi_points(img1, x_coords, y_coords)
+
+                full = dic._initial_guesses(img1, img2, x_coords, y_coords)
+                masked = dic._initial_guesses(img1, img2, x_coords, y_coords, active)
+                for expected, actual in zip(full, masked):
+                    np.testing.assert_array_equal(actual[active], expected[active])
+                    self.assertFalse(actual[~active].any())
+
+
+class PostProcessingTests(SimpleTestCase):
+    def test_nan_median_matches_numpy(self):
+        rng = np.random.default_rng(0)
+        field = rng.normal(size=(40, 50)).astype(np.float32)
+        field[rng.random(field.shape) < 0.3] = np.nan
+        field[10:16, 10:16] = np.nan
+
+        for include_center in (False, True):
+            with self.subTest(include_center=include_center):
+                planes = DigitalImageCorrelation._neighbour_planes(field, include_center)
+                stack = np.where(np.isinf(planes), np.nan, planes)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    expected = np.nanmedian(stack, axis=0)
+                    expected_spread = np.nanmedian(np.abs(stack - expected), axis=0)
+
+                # Несколько блоков строк, включая неполный последний
+                with mock.patch.object(DigitalImageCorrelation, "MEDIAN_BLOCK_POINTS", 7 * field.shape[1]):
+                    median = DigitalImageCorrelation._nan_median(planes)
+                    spread = DigitalImageCorrelation._nan_median(planes, offset=median)
+
+                np.testing.assert_allclose(median, expected, rtol=1e-6, equal_nan=True)
+                np.testing.assert_allclose(spread, expected_spread, rtol=1e-6, equal_nan=True)
+
+    def test_outlier_is_rejected_and_filled(self):
+        yy, xx = np.mgrid[0:30, 0:30].astype(np.float32)
+        U = 0.01 * xx
+        V = -0.02 * yy
+        C = np.full(U.shape, 0.9, dtype=np.float32)
+        U[15, 15] = 5.0
+        U[0:3, 0:3] = np.nan
+        V[0:3, 0:3] = np.nan
+
+        U_filtered, V_filtered, report = DigitalImageCorrelation().post_process_displacements(
+            U, V, C, return_report=True
+        )
+
+        self.assertEqual(report["rejected_median"], 1)
+        self.assertEqual(report["filled"], 1)
+        self.assertAlmostEqual(float(U_filtered[15, 15]), 0.15, places=5)
+        self.assertTrue(np.isnan(U_filtered[0:3, 0:3]).all())
+        self.assertEqual(report["valid_points"], U.size - 9)
+
+
+def anonymous_rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class OutOfCoreMemoryTests(SimpleTestCase):
+    @unittest.skipUnless(os.path.exists("/proc/self/status"), "нужен /proc/self/status")
+    def test_peak_memory_within_budget(self):
+        # Декодированная пара RGB 6000x6000 (216 МБ) больше бюджета; бюджет включает
+        # и постоянные расходы matplotlib на сохранение превью (около 100 МБ)
+        budget_mb = 192
+        speckle = (gaussian_filter(np.random.default_rng(0).random((500, 500)), 2.0) * 255).astype(np.uint8)
+        image = np.repeat(np.tile(speckle, (12, 12))[:, :, None], 3, axis=2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            before_path = os.path.join(tmp_dir, "before.tif")
+            after_path = os.path.join(tmp_dir, "after.tif")
+            Image.fromarray(image).save(before_path)
+            Image.fromarray(np.roll(image, 2, axis=1)).save(after_path)
+            del speckle, image
+
+            baseline = anonymous_rss_mb()
+            peak = [baseline]
+            stop = threading.Event()
+
+            def sample():
+                while not stop.wait(0.005):
+                    peak[0] = max(peak[0], anonymous_rss_mb())
+
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+            try:
+                result = SyncDICProcessor(results_dir=tmp_dir).process_test_from_files(
+                    "memory", before_path, after_path, step=500, memory_budget_mb=budget_mb
+                )
+            finally:
+                stop.set()
+                sampler.join()
+
+        self.assertEqual(result["status"], "completed", result.get("error"))
+        self.assertLess(peak[0] - baseline, budget_mb)
+
+    def test_points_out_of_core_match_in_memory(self):
+        reference, deformed, _ = synthetic_pair(160)
+        points = [[80, 80], [40.5, 100], [5, 80], [500, 500]]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for name, image in (("before", reference), ("after", deformed)):
+                paths.append(os.path.join(tmp_dir, f"{name}.tif"))
+                Image.fromarray((image * 255 / image.max()).astype(np.uint8)).save(paths[-1])
+
+            processor = SyncDICProcessor(results_dir=tmp_dir)
+            in_memory, out_of_core = (
+                processor.process_points(*paths, points, subset_size=21, step=8, memory_budget_mb=budget_mb)["points"]
+                for budget_mb in (None, 0.01)
+            )
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ["after.tif", "before.tif"])
+
+        for expected, actual in zip(in_memory, out_of_core):
+            for key in ("u", "v", "correlation"):
+                if expected[key] is None:
+                    self.assertIsNone(actual[key])
+                else:
+                    self.assertAlmostEqual(actual[key], expected[key], places=3)
+        self.assertIsNotNone(in_memory[0]["u"])
+        self.assertIsNone(in_memory[3]["u"])
+
+
+class StaleWorkerTests(TestCase):
+    def test_result_of_requeued_task_is_dropped(self):
+        task = DICAnalysis.objects.create(
+            image_before="before.png", image_after="after.png", status=DICAnalysis.Status.PROCESSING, worker_id="new"
+        )
+        results = {"status": "error", "error": "старый обработчик"}
+
+        self.assertFalse(HelpMethods()._update_task_results(task.id, results, worker_id="old"))
+        task.refresh_from_db()
+        self.assertEqual(task.status, DICAnalysis.Status.PROCESSING)
+
+        self.assertTrue(HelpMethods()._update_task_results(task.id, results, worker_id="new"))
+        task.refresh_from_db()
+        self.assertEqual(task.status, DICAnalysis.Status.ERROR)
+
+    def test_requeue_removes_work_dir(self):
+        task = DICAnalysis.objects.create(
+            image_before="before.png",
+            image_after="after.png",
+            status=DICAnalysis.Status.PROCESSING,
+            worker_id="dead",
+            heartbeat_at=timezone.now() - timedelta(minutes=10),
+            attempts=1,
+        )
+
+        with tempfile.TemporaryDirectory() as results_dir:
+            work_dir = SyncDICProcessor(results_dir=results_dir).work_dir(str(task.id))
+            os.makedirs(work_dir)
+            open(os.path.join(work_dir, f"{task.id}_before.float32"), "wb").close()
+
+            with mock.patch("dic_api.dic_bisnes_logik.help_methods.RESULTS_DIR", results_dir):
+                self.assertEqual(requeue_stale(60, 3), 1)
+            self.assertFalse(os.path.exists(work_dir))
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, DICAnalysis.Status.PENDING)
+
+
+class AnonymousQueueTests(TestCase):
+    @override_settings(DIC_QUEUE_LIMIT=2)
+    def test_anonymous_clients_are_admitted_and_scheduled_separately(self):
+        for _ in range(2):
+            DICAnalysis.objects.create(image_before="before.png", image_after="after.png", client_key="a")
+
+        with self.assertRaises(QueueFull):
+            check_admission(None, "a")
+        check_admission(None, "b")
+
+        # Клиент b без задач получает место сразу после первой задачи клиента a
+        self.assertEqual(prospective_position(None, "a"), 3)
+        self.assertEqual(prospective_position(None, "b"), 2)
+
+    @override_settings(DIC_QUEUE_LIMIT=5, DIC_QUEUE_GLOBAL_LIMIT=3)
+    def test_global_limit_applies_across_clients(self):
+        for client in ("a", "b", "c"):
+            DICAnalysis.objects.create(image_before="before.png", image_after="after.png", client_key=client)
+
+        with self.assertRaises(QueueFull) as raised:
+            check_admission(None, "d")
+        self.assertEqual(raised.exception.limit, 3)
+
+    @override_settings(DIC_TRUSTED_PROXIES=["10.0.0.2"])
+    def test_forwarded_address_is_trusted_only_from_proxy(self):
+        factory = RequestFactory()
+        forwarded = {"HTTP_X_FORWARDED_FOR": "1.1.1.1, 203.0.113.7"}
+
+        self.assertEqual(client_address(factory.get("/", REMOTE_ADDR="10.0.0.2", **forwarded)), "203.0.113.7")
+        self.assertEqual(client_address(factory.get("/", REMOTE_ADDR="198.51.100.1", **forwarded)), "198.51.100.1")
+        self.assertEqual(client_address(factory.get("/", REMOTE_ADDR="10.0.0.2")), "10.0.0.2")
+
+
+class SchedulerTests(SimpleTestCase):
+    def job(self, job_id, owner, cost, priority=DICAnalysis.Priority.INTERACTIVE):
+        return {
+            "id": job_id,
+            "user_id": owner,
+            "priority": priority,
+            "estimated_cost": cost,
+            "created_at": timezone.now(),
+        }
+
+    def test_priority_fair_share_and_shortest_first(self):
+        pending = [
+            self.job(1, "a", 30.0),
+            self.job(2, "a", 10.0),
+            self.job(3, "a", 20.0),
+            self.job(4, "b", 50.0),
+            self.job(5, "b", None),
+            self.job(6, "c", 1.0, DICAnalysis.Priority.BACKGROUND),
+        ]
+
+        order = [job["id"] for job in schedule(pending, {"a": 1})]
+
+        # b меньше загружен и начинает; внутри владельца - кратчайшая задача, без оценки - последней
+        self.assertEqual(order, [4, 2, 5, 3, 1, 6])
+
+
+class QueuePositionTests(TestCase):
+    def test_position_follows_schedule(self):
+        running = DICAnalysis.objects.create(
+            image_before="before.png", image_after="after.png", status=DICAnalysis.Status.PROCESSING, client_key="a"
+        )
+        first = DICAnalysis.objects.create(image_before="before.png", image_after="after.png", client_key="a")
+        second = DICAnalysis.objects.create(image_before="before.png", image_after="after.png", client_key="b")
+        done = DICAnalysis.objects.create(
+            image_before="before.png", image_after="after.png", status=DICAnalysis.Status.COMPLETED
+        )
+
+        self.assertEqual(queue_position(running), 0)
+        self.assertEqual(queue_position(second), 1)
+        self.assertEqual(queue_position(first), 2)
+        self.assertIsNone(queue_position(done))
+
+    @override_settings(DIC_QUEUE_LIMIT=1)
+    def test_queue_full_response(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(
+            override_settings(MEDIA_ROOT=media_root, DIC_RESULT_CACHE_DIR=os.path.join(media_root, "result_cache"))
+        )
+        DICAnalysis.objects.create(image_before="before.png", image_after="after.png", client_key="other")
+
+        created = self.client.post(
+            reverse("dic-analysis-list"), {"image_before": upload("a.png"), "image_after": upload("b.png")}
+        )
+        self.assertEqual(created.status_code, 201)
+        self.assertNotIn("client_key", created.json())
+        self.assertNotIn("worker_id", created.json())
+
+        response = self.client.post(
+            reverse("dic-analysis-list"), {"image_before": upload("a.png"), "image_after": upload("b.png")}
+        )
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()["pending_tasks"], 1)
+        self.assertEqual(response.json()["queue_limit"], 1)
+        self.assertEqual(response.json()["queue_position"], 3)
+
+
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.cache_dir = os.path.join(self.media_root, "result_cache")
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root, DIC_RESULT_CACHE_DIR=self.cache_dir))
+        self.enterContext(
+            mock.patch("dic_api.dic_bisnes_logik.help_methods.RESULTS_DIR", os.path.join(self.media_root, "results"))
+        )
+
+    def test_hit_miss_and_key(self):
+        cache = ResultCache(self.cache_dir, 16)
+        before, after = upload("a.png"), upload("b.png", 1)
+        key = cache.make_key(before, after, {"step": 12})
+
+        self.assertEqual(cache.make_key(before, after, {"step": 12}), key)
+        self.assertNotEqual(cache.make_key(before, after, {"step": 10}), key)
+        self.assertNotEqual(cache.make_key(after, before, {"step": 12}), key)
+        self.assertIsNone(cache.get(key, "new", self.media_root))
+
+        image_path = os.path.join(self.media_root, "old_map.png")
+        with open(image_path, "wb") as f:
+            f.write(b"map")
+        cache.put(key, {"status": "completed", "test_id": "old", "image_paths": {"displacement_map": image_path}})
+
+        results = cache.get(key, "new", self.media_root)
+        self.assertTrue(results["cache_hit"])
+        with open(results["image_paths"]["displacement_map"], "rb") as f:
+            self.assertEqual(f.read(), b"map")
+
+    @override_settings(DIC_QUEUE_LIMIT=0)
+    def test_cached_resubmission_bypasses_queue_limit(self):
+        data = {"image_before": upload("a.png"), "image_after": upload("b.png", 1), "step": 10}
+        key = HelpMethods()._upload_cache_key(data)
+        ResultCache(self.cache_dir, 16).put(key, {"status": "completed", "statistics": {"mean_displacement": 1.5}})
+
+        response = self.client.post(reverse("dic-analysis-list"), data)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["status"], DICAnalysis.Status.COMPLETED)
+        self.assertEqual(response.json()["mean_displacement"], 1.5)
+
+        data.update(image_before=upload("a.png"), image_after=upload("b.png", 1), step=12)
+        self.assertEqual(self.client.post(reverse("dic-analysis-list"), data).status_code, 429)
+
+
+class SequenceTests(SimpleTestCase):
+    def test_sequence_from_directory(self):
+        reference, deformed, _ = synthetic_pair(96, shift=1.0, strain=0.0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            frames_dir = os.path.join(tmp_dir, "frames")
+            os.makedirs(frames_dir)
+            for index, image in enumerate((reference, deformed, deformed)):
+                Image.fromarray((image * 255 / image.max()).astype(np.uint8)).save(
+                    os.path.join(frames_dir, f"{index:02d}.png")
+                )
+            open(os.path.join(frames_dir, "notes.txt"), "w").close()
+
+            processor = SyncDICProcessor(results_dir=os.path.join(tmp_dir, "results"))
+            results = processor.process_sequence("seq", frames_dir, subset_size=21, step=16)
+
+            self.assertEqual(results["status"], "completed", results.get("error"))
+            self.assertEqual([frame["frame"] for frame in results["frames"]], [1, 2])
+            self.assertEqual(results["parameters"]["min_correlation"], 0.4)
+            with open(results["sequence_path"]) as f:
+                self.assertEqual(len(f.readlines()), 2)
+            with np.load(results["frames"][0]["fields_path"]) as fields:
+                self.assertAlmostEqual(float(np.nanmedian(fields["U_filtered"])), 1.0, places=1)
+
+            single = processor.process_sequence("single", [os.path.join(frames_dir, "00.png")])
+            self.assertEqual(single["status"], "error")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProgressTests(TestCase):
+    def setUp(self):
+        self.task = DICAnalysis.objects.create(
+            image_before="before.png", image_after="after.png", status=DICAnalysis.Status.PROCESSING
+        )
+
+    def test_reporter_throttles_and_forces_final_updates(self):
+        reporter = ProgressReporter(self.task.id, interval=3600, db_interval=3600)
+
+        reporter.stage("solving")
+        self.assertEqual(read_progress(self.task.id)["stage"], "solving")
+
+        reporter.update(10, 100)
+        self.assertEqual(read_progress(self.task.id)["done"], 0)
+
+        reporter.update(100, 100)
+        self.assertEqual(read_progress(self.task.id)["percent"], 100.0)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.progress, 100.0)
+
+        reporter.finish(DICAnalysis.Status.COMPLETED)
+        data = read_progress(self.task.id)
+        self.assertEqual(data["status"], DICAnalysis.Status.COMPLETED)
+        self.assertIsNone(data["queue_position"])
+
+    def test_eta_from_solving_rate(self):
+        reporter = ProgressReporter(self.task.id, interval=0, db_interval=3600)
+        reporter.update(0, 100)
+        self.assertIsNone(read_progress(self.task.id)["eta_seconds"])
+
+        reporter.update(50, 100)
+        self.assertGreaterEqual(read_progress(self.task.id)["eta_seconds"], 0)
+
+    @override_settings(DIC_HEARTBEAT_TIMEOUT_SECONDS=60)
+    def test_progress_endpoint_falls_back_to_database(self):
+        url = reverse("dic-analysis-progress", args=[self.task.id])
+        reporter = ProgressReporter(self.task.id, interval=0, db_interval=0)
+        reporter.update(30, 60)
+
+        self.assertEqual(self.client.get(url).json()["done"], 30)
+
+        # Запись обработчика без сигнала считается устаревшей, ответ строится по базе
+        stale = timezone.now() - timedelta(minutes=5)
+        with mock.patch("dic_api.dic_bisnes_logik.progress.timezone.now", return_value=stale):
+            reporter.update(40, 60)
+        data = self.client.get(url).json()
+        self.assertIsNone(data["done"])
+        self.assertEqual(data["percent"], 66.7)
+        self.assertEqual(data["queue_position"], 0)
+
+    def test_stream_ends_with_final_status(self):
+        ProgressReporter(self.task.id).finish(DICAnalysis.Status.COMPLETED)
+
+        response = self.client.get(
+            reverse("dic-analysis-progress-stream", args=[self.task.id]), HTTP_ACCEPT="text/event-stream"
+        )
+        body = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertTrue(body.startswith("retry: "))
+        self.assertEqual(body.count("event: progress"), 1)
+        self.assertIn('"status": "completed"', body)
+
+
+class SequentialCheckpointTests(SimpleTestCase):
+    def test_sequential_run_resumes_from_checkpoint(self):
+        reference, deformed, _ = synthetic_pair(160)
+        expected = DigitalImageCorrelation(subset_size=21, step=8, tile_size=4, n_workers=2).compute_displacement_field(
+            reference, deformed
+        )
+
+        class CancelAfter:
+            def __init__(self, calls):
+                self.calls = calls
+
+            def is_set(self):
+                self.calls -= 1
+                return self.calls < 0
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint = FieldCheckpoint(os.path.join(tmp_dir, "field.checkpoint.npz"), interval=0)
+            interrupted = DigitalImageCorrelation(
+                subset_size=21, step=8, tile_size=4, checkpoint=checkpoint, cancel_token=CancelAfter(200)
+            )
+            with self.assertRaises(DICCancelled):
+                interrupted.compute_displacement_field(reference, deformed)
+            self.assertTrue(os.path.exists(checkpoint.path))
+
+            resumed = DigitalImageCorrelation(subset_size=21, step=8, tile_size=4, checkpoint=checkpoint)
+            result = resumed.compute_displacement_field(reference, deformed)
+
+        for actual, wanted in zip(result[:3], expected[:3]):
+            np.testing.assert_array_equal(actual, wanted)
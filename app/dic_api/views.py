@@ -31,11 +31,6 @@ class DICAnalysisViewSet(
     ordering_fields = ['created_at', 'completed_at', 'processing_time', 'max_displacement']
     permission_classes = [rest_framework.permissions.AllowAny]
     
-    def get_queryset(self):
-        import time
-        time.sleep(8)
-        return super().get_queryset()   
-    
     def get_serializer_class(self):
         if self.action == 'create':
             return DICAnalysisCreateSerializer
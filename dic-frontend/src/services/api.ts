@@ -5,6 +5,7 @@ import type {
   DICAnalysisStats,
   DICAnalysisSummary,
   DICAnalysisListResponse,
+  DICAnalysisProgress,
   CSRFToken
 } from '@/types/api';
 
@@ -80,6 +81,15 @@ class ApiService {
     return this.api.get(`/analyses/${id}/`);
   }
 
+  async getAnalysisProgress(id: string): Promise<AxiosResponse<DICAnalysisProgress>> {
+    return this.api.get(`/analyses/${id}/progress/`);
+  }
+
+  // Server-sent events stream of analysis progress (event: progress)
+  streamAnalysisProgress(id: string): EventSource {
+    return new EventSource(`/api/analyses/${id}/progress/stream/`, { withCredentials: true });
+  }
+
   async createAnalysis(data: DICAnalysisCreate): Promise<AxiosResponse<DICAnalysis>> {
     console.log('DEBUG: createAnalysis called with data:', {
       name: data.name,
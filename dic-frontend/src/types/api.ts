@@ -127,6 +127,18 @@ export interface DICAnalysisListResponse {
   results: DICAnalysis[];
 }
 
+export interface DICAnalysisProgress {
+  id: string;
+  status: DICAnalysisStatus;
+  stage: string | null;
+  done: number | null;
+  total: number | null;
+  percent: number;
+  eta_seconds: number | null;
+  queue_position: number | null;
+  updated_at: string;
+}
+
 export interface CSRFToken {
   csrfToken: string;
 }
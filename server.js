@@ -11,12 +11,19 @@ const server = http.createServer((req, res) => {
   if (req.url.startsWith("/api/")) {
     console.log("Proxying API request to backend:", req.url);
 
+    // Backend trusts the last X-Forwarded-For address only from this proxy
+    const forwardedFor = req.headers["x-forwarded-for"];
+    const clientAddress = req.socket.remoteAddress;
+
     const options = {
       hostname: "backend",
       port: 8000,
       path: req.url,
       method: req.method,
-      headers: req.headers
+      headers: {
+        ...req.headers,
+        "x-forwarded-for": forwardedFor ? `${forwardedFor}, ${clientAddress}` : clientAddress
+      }
     };
 
     const proxyReq = http.request(options, (proxyRes) => {